@@ -1,8 +1,9 @@
 import cv2
 import threading
 import time
-from queue import Queue
+from queue import Queue, Empty
 from config import CAMERA_SOURCE, CAMERA_WIDTH, CAMERA_HEIGHT
+from utils.performance import RateMeter
 
 class CameraStream:
     def __init__(self, source=CAMERA_SOURCE, width=CAMERA_WIDTH, height=CAMERA_HEIGHT):
@@ -14,6 +15,8 @@ class CameraStream:
         self.running = False
         self.thread = None
         self.frame_queue = Queue(maxsize=1)
+        self.capture_rate = RateMeter()
+        self.dropped_frames = 0  # captured but replaced before anyone read them
         
     def start(self):
         """Start camera stream"""
@@ -41,11 +44,18 @@ class CameraStream:
             ret, frame = self.cap.read()
             if ret:
                 self.frame = frame
-                if self.frame_queue.empty():
+                self.capture_rate.tick()
+                # Keep only the newest frame so readers never see stale ones
+                if self.frame_queue.full():
                     try:
-                        self.frame_queue.put(frame.copy(), block=False)
-                    except:
+                        self.frame_queue.get(block=False)
+                        self.dropped_frames += 1
+                    except Empty:
                         pass
+                try:
+                    self.frame_queue.put(frame.copy(), block=False)
+                except:
+                    pass
             else:
                 print("Error: Could not read frame")
                 break
@@ -57,6 +67,13 @@ class CameraStream:
             return self.frame_queue.get()
         return None if self.frame is None else self.frame.copy()
     
+    def read(self, timeout=None):
+        """Wait for the next captured frame"""
+        try:
+            return self.frame_queue.get(timeout=timeout)
+        except Empty:
+            return None
+    
     def is_opened(self):
         """Check if camera is opened"""
         return self.cap is not None and self.cap.isOpened()
@@ -9,9 +9,10 @@ DATA_DIR = BASE_DIR / "data"
 MODELS_DIR = BASE_DIR / "models"
 DATABASE_DIR = BASE_DIR / "database"
 LOG_DIR = BASE_DIR / "logs"
+IMAGE_STORE_DIR = BASE_DIR / "image_store"  # bottle ROI images, referenced by bottles.image_path
 
 # Create directories if they don't exist
-for directory in [DATA_DIR, MODELS_DIR, DATABASE_DIR, LOG_DIR]:
+for directory in [DATA_DIR, MODELS_DIR, DATABASE_DIR, LOG_DIR, IMAGE_STORE_DIR]:
     directory.mkdir(exist_ok=True)
 
 # Camera settings
@@ -26,10 +27,98 @@ BATCH_SIZE = 32
 EPOCHS = 20  # Reduced for faster training
 LEARNING_RATE = 0.001
 
+# Training: each model is fitted in its own process, pinned to its own CPU
+# cores. Cores per model by name; models not listed share the rest evenly
+TRAINING_CORES = {}
+TRAINING_LOG_PATH = LOG_DIR / "training_log.jsonl"
+
+# Training stops when the monitored validation metric has not improved for
+# EARLY_STOPPING_PATIENCE epochs; the learning rate is cut by LR_FACTOR after
+# LR_PATIENCE epochs without improvement. Each epoch is checkpointed so an
+# interrupted run can resume (train_models.py --resume)
+EARLY_STOPPING_MONITOR = 'val_loss'
+EARLY_STOPPING_PATIENCE = 5
+EARLY_STOPPING_MIN_DELTA = 0.001
+LR_PATIENCE = 2
+LR_FACTOR = 0.5
+MIN_LEARNING_RATE = 1e-6
+TRAINING_MAX_MINUTES = None      # wall-clock budget for a training run (None: no limit)
+CHECKPOINT_DIR = MODELS_DIR / "checkpoints"
+
+# Compact student distilled from the two classifiers (train_models.py
+# --distill): one small MobileNetV2 predicting water level and shape.
+# MODEL_VARIANT 'student' makes the detector use it when it exists
+MODEL_VARIANT = 'teacher'
+STUDENT_MODEL_FILE = 'student_model.h5'
+STUDENT_IMG_SIZE = (128, 128)
+STUDENT_ALPHA = 0.35                 # MobileNetV2 width multiplier
+DISTILLATION_TEMPERATURE = 4.0
+DISTILLATION_SOFT_WEIGHT = 0.7       # teacher targets vs ground-truth labels
+DISTILLATION_REPORT_PATH = LOG_DIR / "distillation_report.json"
+
+# Accuracy/latency sweep over backbone variants (sweep_models.py). Latency is
+# measured one variant at a time on SWEEP_LATENCY_CORES cores, to match the
+# inspection PCs
+SWEEP_IMG_SIZES = (224, 192, 160, 128, 96)
+SWEEP_ALPHAS = (1.0, 0.75, 0.5, 0.35)
+SWEEP_WORKERS = None              # parallel trials (None: one per 4 cores)
+SWEEP_LATENCY_CORES = 2
+SWEEP_REPORT_PATH = LOG_DIR / "model_sweep.json"
+
+# Batch evaluation of the deployed models (evaluate_models.py, also run
+# after training). The confidence threshold is tuned so that no more than
+# 1 - TARGET_DEFECT_RECALL of defective bottles are missed
+EVALUATION_WORKERS = None         # processes (None: one per 4 cores)
+EVALUATION_BATCH_SIZE = 64
+TARGET_DEFECT_RECALL = 0.99
+EVALUATION_REPORT_PATH = LOG_DIR / "evaluation_report.json"   # HTML next to it
+
+# Versioned model sets (manage_models.py). The detector loads the active
+# version and polls for a newly activated one, which it loads and warms up
+# in the background before swapping it in between frames
+MODEL_REGISTRY_DIR = MODELS_DIR / "registry"
+MODEL_REGISTRY_POLL_SECONDS = 5
+MODEL_WARMUP_RUNS = 3
+
+# Dataset manifest of the training images (size, dimensions, content and
+# perceptual hashes, corrupt files), and the deduplicated train/validation
+# splits built from it (distances in bits of 64)
+DATASET_INDEX_PATH = DATA_DIR / "dataset_index.json"
+DATASET_SPLIT_DIR = DATA_DIR / "splits"
+DATASET_INDEX_WORKERS = None     # hashing processes (None: one per core)
+DEDUP_DUPLICATE_DISTANCE = 4     # near-identical copies, only one is kept
+DEDUP_GROUP_DISTANCE = 10        # similar images, kept on the same side of the split
+
+# Incremental fine-tuning of the classifier heads on operator-labelled
+# production images (main.py --fine-tune)
+FINETUNE_EPOCHS = 20
+FINETUNE_LEARNING_RATE = 1e-4
+FINETUNE_REPLAY_SAMPLES = 500       # original training images mixed in against forgetting
+FINETUNE_VALIDATION_SAMPLES = 1000  # held-out original images checked for regressions
+FINETUNE_HOLDOUT_FRACTION = 0.2     # labelled production images held out for validation
+FINETUNE_MAX_REGRESSION = 0.005     # accuracy drop tolerated on held-out original images
+FINETUNE_STATE_PATH = MODELS_DIR / "fine_tune_state.json"
+FEATURE_CACHE_DIR = MODELS_DIR / "feature_cache"   # backbone features by image content
+
 # Detection settings
 CONFIDENCE_THRESHOLD = 0.75  # Lowered threshold for better detection
 MIN_BOTTLE_AREA = 3000  # Reduced minimum area for bottle detection
 
+# Pipeline settings: (queue size, policy when full) for each stage edge
+# Policies: 'block' (backpressure), 'drop_oldest', 'drop_newest'
+PIPELINE_QUEUES = {
+    'detect': (2, 'drop_oldest'),     # capture -> detect
+    'classify': (2, 'drop_oldest'),   # detect -> classify
+    'persist': (64, 'block'),         # classify -> persist
+    'display': (2, 'drop_oldest'),    # detect -> display (live frames)
+    'results': (8, 'drop_oldest')     # persist -> display (annotated detections)
+}
+
+# Storage backend: 'mysql' (server from DB_CONFIG) or 'sqlite' (embedded file,
+# no database server needed)
+DB_BACKEND = 'mysql'
+SQLITE_PATH = DATABASE_DIR / "bottle_defect.db"
+
 # Database settings - UPDATED WITH YOUR PASSWORD
 DB_CONFIG = {
     'host': 'localhost',
@@ -39,6 +128,77 @@ DB_CONFIG = {
     'auth_plugin': 'mysql_native_password'  # Added for MySQL 8
 }
 
+# Write-behind persistence: saves are queued and flushed in batches by a
+# background writer instead of one INSERT + commit per bottle
+DB_WRITE_BEHIND = True
+DB_WRITE_QUEUE_SIZE = 1000   # bottles buffered before save_bottle_data blocks
+DB_BATCH_SIZE = 50           # flush when this many bottles are queued...
+DB_FLUSH_INTERVAL = 1.0      # ...or when the oldest queued bottle is this old (seconds)
+DB_RETRY_DELAY = 2.0         # seconds between reconnect attempts
+DB_RETRY_MAX_DELAY = 30.0    # reconnect backoff doubles up to this (seconds)
+DB_SHUTDOWN_RETRIES = 3      # reconnect attempts when draining on close
+
+# Range partitioning of bottles on detection_date: 'monthly', 'daily' or None.
+# Existing tables are converted with main.py --maintain-partitions --convert-partitions
+DB_PARTITIONING = None
+DB_PARTITIONS_AHEAD = 3          # future partitions kept ready
+DB_RETENTION_DAYS = None         # drop data older than this many days (None keeps everything)
+DB_RETENTION_EXPORT_DIR = BASE_DIR / "archive"  # export before dropping (None to skip)
+
+# Connection pool shared by the video, writer, statistics and GUI threads
+DB_POOL_SIZE = 5
+DB_POOL_TIMEOUT = 5.0        # seconds to wait for a free connection
+
+# Serial numbers: <prefix>-<station>-<number>, leased from the database in blocks.
+# SERIAL_STATION_ID must be unique for every station sharing a database.
+SERIAL_PREFIX = "BTL"
+SERIAL_STATION_ID = "S01"
+SERIAL_BLOCK_SIZE = 1000            # serials leased per database round trip
+SERIAL_PREFETCH_THRESHOLD = 200     # lease the next block when this few remain
+SERIAL_CHECKPOINT_INTERVAL = 50     # persist the high-water mark every this many serials
+SERIAL_STATE_PATH = DATABASE_DIR / "serial_state.json"
+
+# The GUI updates from detection events; this slow pass (seconds) picks up
+# anything else, e.g. bottles saved by other stations
+GUI_RECONCILE_INTERVAL = 30
+
+# Performance panel: latency samples kept per stage, and the window (seconds)
+# frame rates are averaged over
+PERF_SAMPLES = 300
+PERF_RATE_WINDOW = 5.0
+
+# Per-minute rollups back the short trend views and are pruned after this
+# many days; per-hour rollups are kept
+ROLLUP_MINUTE_RETENTION_DAYS = 31
+
+# QR labels
+LABEL_SPOOLING = False              # render a label for every saved bottle into LABEL_SPOOL_DIR
+LABEL_SPOOL_DIR = BASE_DIR / "labels"
+LABEL_WORKERS = 2                   # label rendering processes
+LABEL_BATCH_SIZE = 64
+LABEL_QUEUE_SIZE = 5000             # saved bottles waiting for a label
+LABEL_CACHE_BYTES = 32 * 1024 * 1024
+LABEL_BOX_SIZE = 10                 # pixels per QR module
+LABEL_SHEET_GRID = (4, 8)           # labels per sheet (columns, rows), A4
+LABEL_SHEET_DPI = 300
+
+# Defect review browser: thumbnails are decoded by background threads and
+# kept in memory (LRU, bytes) and on disk
+THUMBNAIL_SIZE = 128                # longest side, pixels
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+THUMBNAIL_CACHE_DIR = BASE_DIR / "thumbnails"
+THUMBNAIL_DISK_CACHE_BYTES = 512 * 1024 * 1024
+
+# Live statistics are kept in memory; reconcile with the database this often (seconds)
+STATS_RECONCILE_INTERVAL = 60
+
+# Rows fetched per page as the history table is scrolled
+HISTORY_PAGE_SIZE = 100
+
+# Exports stream rows from the database in chunks of this many
+EXPORT_CHUNK_SIZE = 5000
+
 # Classification labels
 WATER_LEVEL_LABELS = ['low', 'full', 'overflow']
 SHAPE_LABELS = ['perfect', 'defective']
@@ -2,7 +2,10 @@
 CREATE DATABASE IF NOT EXISTS bottle_defect_db;
 USE bottle_defect_db;
 
--- Bottle information table
+-- Bottle information table. To partition it on detection_date, set
+-- DB_PARTITIONING in config.py and run
+-- "python main.py --maintain-partitions --convert-partitions" once, then
+-- "python main.py --maintain-partitions" (e.g. daily from cron).
 CREATE TABLE IF NOT EXISTS bottles (
     id INT AUTO_INCREMENT PRIMARY KEY,
     serial_number VARCHAR(50) UNIQUE NOT NULL,
@@ -10,15 +13,15 @@ CREATE TABLE IF NOT EXISTS bottles (
     water_level VARCHAR(20),
     shape_status VARCHAR(20),
     confidence_score FLOAT,
-    image_path VARCHAR(255),
+    image_path VARCHAR(255),              -- relative path in the image store
     is_defective BOOLEAN DEFAULT FALSE,
-    processed_image LONGBLOB
+    processed_image LONGBLOB              -- legacy, see database/migrate_images.py
 );
 
 -- Defect statistics table
 CREATE TABLE IF NOT EXISTS defect_statistics (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    date DATE NOT NULL,
+    date DATE NOT NULL UNIQUE,
     total_bottles INT DEFAULT 0,
     defective_bottles INT DEFAULT 0,
     perfect_bottles INT DEFAULT 0,
@@ -26,12 +29,47 @@ CREATE TABLE IF NOT EXISTS defect_statistics (
     low_count INT DEFAULT 0
 );
 
+-- Next unleased serial number of every station. Stations lease blocks of
+-- serials by advancing their counter, so serials never collide.
+CREATE TABLE IF NOT EXISTS serial_counters (
+    station_id VARCHAR(20) PRIMARY KEY,
+    next_serial BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Trend aggregates per minute and per hour, incremented with every insert
+-- batch (mean confidence = confidence_sum / total_bottles)
+CREATE TABLE IF NOT EXISTS rollup_minute (
+    bucket DATETIME PRIMARY KEY,
+    total_bottles INT DEFAULT 0,
+    defective_bottles INT DEFAULT 0,
+    low_count INT DEFAULT 0,
+    full_count INT DEFAULT 0,
+    overflow_count INT DEFAULT 0,
+    shape_defective_count INT DEFAULT 0,
+    confidence_sum DOUBLE DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS rollup_hour LIKE rollup_minute;
+
+-- Operator-confirmed or corrected labels of production bottles, used to
+-- fine-tune the models. No foreign key: bottles may be partitioned.
+CREATE TABLE IF NOT EXISTS sample_labels (
+    bottle_id INT PRIMARY KEY,
+    water_level VARCHAR(20) NOT NULL,
+    shape_status VARCHAR(20) NOT NULL,
+    labelled_at DATETIME NOT NULL,
+    INDEX idx_labelled_at (labelled_at)
+);
+
 -- Create indexes for better performance
 CREATE INDEX idx_serial ON bottles(serial_number);
 CREATE INDEX idx_date ON bottles(detection_date);
 CREATE INDEX idx_defective ON bottles(is_defective);
 
--- Create stored procedure for daily statistics
+-- Stored procedure recomputing today's statistics from scratch.
+-- Inserts increment the counters directly (see DatabaseHandler); this is
+-- only needed to repair them.
 DELIMITER $$
 CREATE PROCEDURE UpdateDailyStatistics()
 BEGIN
@@ -44,7 +82,7 @@ BEGIN
         SUM(CASE WHEN water_level = 'overflow' THEN 1 ELSE 0 END) as overflow_count,
         SUM(CASE WHEN water_level = 'low' THEN 1 ELSE 0 END) as low_count
     FROM bottles
-    WHERE DATE(detection_date) = CURDATE()
+    WHERE detection_date >= CURDATE() AND detection_date < CURDATE() + INTERVAL 1 DAY
     GROUP BY DATE(detection_date)
     ON DUPLICATE KEY UPDATE
         total_bottles = VALUES(total_bottles),
@@ -0,0 +1,59 @@
+import mysql.connector
+from mysql.connector import Error
+from config import DB_CONFIG
+from utils.image_store import ImageStore
+
+def migrate_images(batch_size=100):
+    """Move processed_image blobs from the bottles table into the image store.
+
+    Each batch is committed on its own, so the migration can be stopped and
+    re-run at any time; it continues with the rows that still have a blob.
+    """
+    print("Migrating bottle images to the image store...")
+    store = ImageStore()
+    migrated = 0
+
+    try:
+        connection = mysql.connector.connect(**DB_CONFIG)
+        cursor = connection.cursor()
+        last_id = 0
+
+        while True:
+            # Keyset pagination on the primary key keeps every batch an index range scan
+            cursor.execute("""
+            SELECT id, processed_image FROM bottles
+            WHERE id > %s AND processed_image IS NOT NULL
+            ORDER BY id
+            LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for bottle_id, image_blob in rows:
+                image_path = store.put(bytes(image_blob))
+                updates.append((image_path, bottle_id))
+            last_id = rows[-1][0]
+
+            cursor.executemany(
+                "UPDATE bottles SET image_path = %s, processed_image = NULL WHERE id = %s",
+                updates
+            )
+            connection.commit()
+            migrated += len(updates)
+            print(f"Migrated {migrated} images (up to id {last_id})")
+
+        cursor.close()
+        connection.close()
+
+        print(f"\nImage migration completed: {migrated} images moved to {store.root}")
+        if migrated:
+            print("Run 'OPTIMIZE TABLE bottles' to reclaim the space used by the old blobs")
+
+    except Error as e:
+        print(f"Error migrating images: {e}")
+        print(f"{migrated} images were migrated before the error; re-run to continue")
+
+if __name__ == "__main__":
+    migrate_images()
@@ -0,0 +1,202 @@
+import csv
+import gzip
+import os
+from datetime import date, datetime, timedelta
+from config import DB_PARTITIONING, DB_PARTITIONS_AHEAD, DB_RETENTION_DAYS, DB_RETENTION_EXPORT_DIR
+
+# MySQL TO_DAYS() is the proleptic Gregorian ordinal offset by year 0
+TO_DAYS_OFFSET = 365
+
+FUTURE_PARTITION = 'p_future'
+
+
+def to_days(day):
+    return day.toordinal() + TO_DAYS_OFFSET
+
+
+def from_days(days):
+    return date.fromordinal(days - TO_DAYS_OFFSET)
+
+
+def period_start(day, granularity=DB_PARTITIONING):
+    """First day of the partition period containing day"""
+    if granularity == 'daily':
+        return day
+    return day.replace(day=1)
+
+
+def next_period(day, granularity=DB_PARTITIONING):
+    """First day of the period after the one starting at day"""
+    if granularity == 'daily':
+        return day + timedelta(days=1)
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start, granularity=DB_PARTITIONING):
+    return f"p{start:%Y%m%d}" if granularity == 'daily' else f"p{start:%Y%m}"
+
+
+def partition_bounds(first_day, last_day, granularity=DB_PARTITIONING):
+    """(name, start, end) for every period from first_day through last_day"""
+    bounds = []
+    start = period_start(first_day, granularity)
+    while start <= last_day:
+        end = next_period(start, granularity)
+        bounds.append((partition_name(start, granularity), start, end))
+        start = end
+    return bounds
+
+
+def partition_definitions(bounds):
+    definitions = [f"PARTITION {name} VALUES LESS THAN ({to_days(end)})" for name, start, end in bounds]
+    definitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+    return ",\n            ".join(definitions)
+
+
+def partition_clause(first_day=None, granularity=DB_PARTITIONING, ahead=DB_PARTITIONS_AHEAD):
+    """PARTITION BY clause covering first_day up to `ahead` periods from today"""
+    today = date.today()
+    last_day = today
+    for _ in range(ahead):
+        last_day = next_period(period_start(last_day, granularity), granularity)
+    bounds = partition_bounds(first_day or today, last_day, granularity)
+    return f"""
+        PARTITION BY RANGE (TO_DAYS(detection_date)) (
+            {partition_definitions(bounds)}
+        )"""
+
+
+def get_partitions(cursor):
+    """[(name, upper bound date or None for MAXVALUE, rows)] of the bottles table"""
+    cursor.execute("""
+    SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'bottles' AND PARTITION_NAME IS NOT NULL
+    ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    partitions = []
+    for name, description, rows in cursor.fetchall():
+        upper = None if description == 'MAXVALUE' else from_days(int(description))
+        partitions.append((name, upper, rows))
+    return partitions
+
+
+def partition_existing_table(cursor, granularity=DB_PARTITIONING, ahead=DB_PARTITIONS_AHEAD):
+    """Convert an unpartitioned bottles table (copies the table once).
+
+    MySQL requires the partitioning column in every unique key, so the
+    primary key becomes (id, detection_date) and the serial number key
+    (serial_number, detection_date). Serial numbers stay unique because
+    SerialAllocator checks every leased block against the stored ones.
+    """
+    cursor.execute("SELECT MIN(detection_date) FROM bottles")
+    oldest = cursor.fetchone()[0]
+    first_day = oldest.date() if oldest else date.today()
+
+    print("Rebuilding 'bottles' as a partitioned table, this can take a while...")
+    cursor.execute("""
+    ALTER TABLE bottles
+        MODIFY detection_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (id, detection_date),
+        DROP INDEX serial_number,
+        ADD UNIQUE KEY uq_serial (serial_number, detection_date)
+    """)
+    cursor.execute("ALTER TABLE bottles" + partition_clause(first_day, granularity, ahead))
+    print("Table 'bottles' is now partitioned")
+
+
+def ensure_future_partitions(cursor, granularity=DB_PARTITIONING, ahead=DB_PARTITIONS_AHEAD):
+    """Split the empty MAXVALUE partition so `ahead` future periods exist"""
+    partitions = get_partitions(cursor)
+    if not partitions:
+        return []
+    bounded = [upper for name, upper, rows in partitions if upper is not None]
+
+    target = date.today()
+    for _ in range(ahead + 1):
+        target = next_period(period_start(target, granularity), granularity)
+
+    bounds = []
+    start = max(bounded) if bounded else period_start(date.today(), granularity)
+    while start < target:
+        end = next_period(start, granularity)
+        bounds.append((partition_name(start, granularity), start, end))
+        start = end
+    if not bounds:
+        return []
+
+    # p_future holds no rows as long as enough partitions exist ahead, so
+    # reorganizing it is a metadata-only operation
+    cursor.execute(f"""
+    ALTER TABLE bottles REORGANIZE PARTITION {FUTURE_PARTITION} INTO (
+            {partition_definitions(bounds)}
+    )""")
+    names = [name for name, start, end in bounds]
+    print(f"Created partitions: {', '.join(names)}")
+    return names
+
+
+def export_partition(cursor, name, export_dir, chunk_size=5000):
+    """Write every row of one partition to <export_dir>/bottles_<name>.csv.gz"""
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(str(export_dir), f"bottles_{name}.csv.gz")
+    cursor.execute(f"""
+    SELECT id, serial_number, detection_date, water_level, shape_status,
+           confidence_score, is_defective, image_path
+    FROM bottles PARTITION ({name})
+    """)
+    with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+    return path
+
+
+def drop_expired_partitions(cursor, retention_days=DB_RETENTION_DAYS, export_dir=DB_RETENTION_EXPORT_DIR):
+    """Drop (optionally after exporting) partitions entirely older than retention_days"""
+    if retention_days is None:
+        return []
+
+    cutoff = date.today() - timedelta(days=retention_days)
+    dropped = []
+    for name, upper, rows in get_partitions(cursor):
+        if upper is None or upper > cutoff:
+            continue
+        if export_dir:
+            path = export_partition(cursor, name, export_dir)
+            print(f"Exported partition {name} to {path}")
+        # Dropping a partition is O(1), unlike DELETE of its rows
+        cursor.execute(f"ALTER TABLE bottles DROP PARTITION {name}")
+        dropped.append(name)
+        print(f"Dropped partition {name} (rows before {upper})")
+    return dropped
+
+
+def is_partitioned(cursor):
+    return bool(get_partitions(cursor))
+
+
+def maintain_partitions(connection, convert=False):
+    """Create future partitions and apply retention; run daily (e.g. from cron)"""
+    if not DB_PARTITIONING:
+        print("Partitioning is disabled (DB_PARTITIONING = None)")
+        return
+
+    cursor = connection.cursor()
+    if not is_partitioned(cursor):
+        if not convert:
+            print("Table 'bottles' is not partitioned; run 'main.py --maintain-partitions --convert-partitions' "
+                  "to convert it")
+            cursor.close()
+            return
+        partition_existing_table(cursor)
+
+    ensure_future_partitions(cursor)
+    drop_expired_partitions(cursor)
+    cursor.close()
+    print(f"Partition maintenance completed at {datetime.now():%Y-%m-%d %H:%M}")
@@ -1,9 +1,165 @@
 import mysql.connector
 from mysql.connector import Error
-from config import DB_CONFIG
+from config import DB_BACKEND, DB_CONFIG, DB_PARTITIONING, SQLITE_PATH
+from database.partitions import partition_clause
+import sqlite3
 import os
 
-def setup_database():
+# Embedded backend schema, equivalent to the MySQL one below. There is no
+# stored procedure: statistics are maintained by DatabaseHandler upserts.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bottles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT UNIQUE NOT NULL,
+    detection_date TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    water_level TEXT,
+    shape_status TEXT,
+    confidence_score REAL,
+    image_path TEXT,
+    is_defective BOOLEAN DEFAULT 0,
+    processed_image BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_date ON bottles(detection_date);
+CREATE INDEX IF NOT EXISTS idx_defective ON bottles(is_defective);
+
+CREATE TABLE IF NOT EXISTS defect_statistics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date DATE NOT NULL UNIQUE,
+    total_bottles INTEGER DEFAULT 0,
+    defective_bottles INTEGER DEFAULT 0,
+    perfect_bottles INTEGER DEFAULT 0,
+    overflow_count INTEGER DEFAULT 0,
+    low_count INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS serial_counters (
+    station_id TEXT PRIMARY KEY,
+    next_serial INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS rollup_minute (
+    bucket TIMESTAMP PRIMARY KEY,
+    total_bottles INTEGER DEFAULT 0,
+    defective_bottles INTEGER DEFAULT 0,
+    low_count INTEGER DEFAULT 0,
+    full_count INTEGER DEFAULT 0,
+    overflow_count INTEGER DEFAULT 0,
+    shape_defective_count INTEGER DEFAULT 0,
+    confidence_sum REAL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS rollup_hour (
+    bucket TIMESTAMP PRIMARY KEY,
+    total_bottles INTEGER DEFAULT 0,
+    defective_bottles INTEGER DEFAULT 0,
+    low_count INTEGER DEFAULT 0,
+    full_count INTEGER DEFAULT 0,
+    overflow_count INTEGER DEFAULT 0,
+    shape_defective_count INTEGER DEFAULT 0,
+    confidence_sum REAL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS sample_labels (
+    bottle_id INTEGER PRIMARY KEY,
+    water_level TEXT NOT NULL,
+    shape_status TEXT NOT NULL,
+    labelled_at TIMESTAMP NOT NULL
+);
+"""
+
+# Trend aggregates per minute and per hour, maintained by DatabaseHandler
+ROLLUP_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bucket DATETIME PRIMARY KEY,
+    total_bottles INT DEFAULT 0,
+    defective_bottles INT DEFAULT 0,
+    low_count INT DEFAULT 0,
+    full_count INT DEFAULT 0,
+    overflow_count INT DEFAULT 0,
+    shape_defective_count INT DEFAULT 0,
+    confidence_sum DOUBLE DEFAULT 0
+)
+"""
+
+# Next unleased serial number of every station (see utils/serial_allocator.py)
+SERIAL_COUNTERS_TABLE = """
+CREATE TABLE IF NOT EXISTS serial_counters (
+    station_id VARCHAR(20) PRIMARY KEY,
+    next_serial BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+)
+"""
+
+# Operator-confirmed or corrected labels of production bottles, used to
+# fine-tune the models (see utils/fine_tuning.py). No foreign key: MySQL
+# does not support them on the partitioned bottles table.
+SAMPLE_LABELS_TABLE = """
+CREATE TABLE IF NOT EXISTS sample_labels (
+    bottle_id INT PRIMARY KEY,
+    water_level VARCHAR(20) NOT NULL,
+    shape_status VARCHAR(20) NOT NULL,
+    labelled_at DATETIME NOT NULL,
+    INDEX idx_labelled_at (labelled_at)
+)
+"""
+
+# (serial_number, water_level, shape_status, confidence_score, is_defective)
+SAMPLE_BOTTLES = [
+    ('BTL-TEST-001', 'full', 'perfect', 0.95, False),
+    ('BTL-TEST-002', 'overflow', 'perfect', 0.88, True),
+    ('BTL-TEST-003', 'low', 'defective', 0.92, True)
+]
+
+def create_sqlite_schema(connection):
+    """Create the SQLite tables and indexes if they don't exist"""
+    connection.executescript(SQLITE_SCHEMA)
+    connection.commit()
+
+def setup_sqlite_database(path=SQLITE_PATH):
+    print("Setting up SQLite database...")
+
+    try:
+        connection = sqlite3.connect(str(path))
+        connection.execute("PRAGMA journal_mode=WAL")
+        create_sqlite_schema(connection)
+        print("Tables 'bottles', 'defect_statistics', 'serial_counters' and rollups created or already exist")
+
+        # Insert some sample data for testing
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT OR IGNORE INTO bottles (serial_number, water_level, shape_status, confidence_score, is_defective)
+        VALUES
+            ('BTL-TEST-001', 'full', 'perfect', 0.95, 0),
+            ('BTL-TEST-002', 'overflow', 'perfect', 0.88, 1),
+            ('BTL-TEST-003', 'low', 'defective', 0.92, 1)
+        """)
+        if cursor.rowcount > 0:
+            cursor.execute("""
+            INSERT INTO defect_statistics (date, total_bottles, defective_bottles, perfect_bottles,
+                                           overflow_count, low_count)
+            VALUES (date('now', 'localtime'), ?, ?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET
+                total_bottles = total_bottles + excluded.total_bottles,
+                defective_bottles = defective_bottles + excluded.defective_bottles,
+                perfect_bottles = perfect_bottles + excluded.perfect_bottles,
+                overflow_count = overflow_count + excluded.overflow_count,
+                low_count = low_count + excluded.low_count
+            """, (3, 2, 1, 1, 1))
+            print("Sample data inserted")
+        connection.commit()
+        connection.close()
+
+        print("\nDatabase setup completed successfully!")
+        print(f"Database file: {path}")
+
+    except sqlite3.Error as e:
+        print(f"Error setting up database: {e}")
+
+def setup_database(backend=DB_BACKEND):
+    if backend == 'sqlite':
+        setup_sqlite_database()
+        return
+
     print("Setting up database...")
     
     try:
@@ -23,23 +179,44 @@ def setup_database():
         cursor.execute(f"USE {database_name}")
         
         # Bottle information table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS bottles (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            serial_number VARCHAR(50) UNIQUE NOT NULL,
-            detection_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            water_level VARCHAR(20),
-            shape_status VARCHAR(20),
-            confidence_score FLOAT,
-            image_path VARCHAR(255),
-            is_defective BOOLEAN DEFAULT FALSE,
-            processed_image LONGBLOB,
-            INDEX idx_serial (serial_number),
-            INDEX idx_date (detection_date),
-            INDEX idx_defective (is_defective)
-        )
-        """)
-        print("Table 'bottles' created or already exists")
+        if DB_PARTITIONING:
+            # Range partitioned on detection_date; MySQL requires the partitioning
+            # column in every unique key, so SerialAllocator keeps serials unique
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bottles (
+                id INT AUTO_INCREMENT,
+                serial_number VARCHAR(50) NOT NULL,
+                detection_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                water_level VARCHAR(20),
+                shape_status VARCHAR(20),
+                confidence_score FLOAT,
+                image_path VARCHAR(255),    -- relative path in the image store
+                is_defective BOOLEAN DEFAULT FALSE,
+                processed_image LONGBLOB,   -- legacy, see database/migrate_images.py
+                PRIMARY KEY (id, detection_date),
+                UNIQUE KEY uq_serial (serial_number, detection_date),
+                INDEX idx_date (detection_date),
+                INDEX idx_defective (is_defective)
+            )""" + partition_clause())
+            print(f"Table 'bottles' ({DB_PARTITIONING} partitions) created or already exists")
+        else:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bottles (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                serial_number VARCHAR(50) UNIQUE NOT NULL,
+                detection_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                water_level VARCHAR(20),
+                shape_status VARCHAR(20),
+                confidence_score FLOAT,
+                image_path VARCHAR(255),    -- relative path in the image store
+                is_defective BOOLEAN DEFAULT FALSE,
+                processed_image LONGBLOB,   -- legacy, see database/migrate_images.py
+                INDEX idx_serial (serial_number),
+                INDEX idx_date (detection_date),
+                INDEX idx_defective (is_defective)
+            )
+            """)
+            print("Table 'bottles' created or already exists")
         
         # Defect statistics table
         cursor.execute("""
@@ -56,7 +233,18 @@ def setup_database():
         """)
         print("Table 'defect_statistics' created or already exists")
         
-        # Create stored procedure for daily statistics
+        cursor.execute(SERIAL_COUNTERS_TABLE)
+        print("Table 'serial_counters' created or already exists")
+        
+        for table in ('rollup_minute', 'rollup_hour'):
+            cursor.execute(ROLLUP_TABLE.format(table=table))
+            print(f"Table '{table}' created or already exists")
+        
+        cursor.execute(SAMPLE_LABELS_TABLE)
+        print("Table 'sample_labels' created or already exists")
+        
+        # Create stored procedure recomputing today's statistics (inserts
+        # increment the counters directly; this is only used for repairs)
         cursor.execute("DROP PROCEDURE IF EXISTS UpdateDailyStatistics")
         
         create_procedure_sql = """
@@ -72,7 +260,7 @@ def setup_database():
                 SUM(CASE WHEN water_level = 'overflow' THEN 1 ELSE 0 END) as overflow_count,
                 SUM(CASE WHEN water_level = 'low' THEN 1 ELSE 0 END) as low_count
             FROM bottles
-            WHERE DATE(detection_date) = CURDATE()
+            WHERE detection_date >= CURDATE() AND detection_date < CURDATE() + INTERVAL 1 DAY
             GROUP BY DATE(detection_date)
             ON DUPLICATE KEY UPDATE
                 total_bottles = VALUES(total_bottles),
@@ -86,19 +274,24 @@ def setup_database():
         cursor.execute(create_procedure_sql)
         print("Stored procedure 'UpdateDailyStatistics' created")
         
-        # Insert some sample data for testing
+        # Insert some sample data for testing. A partitioned bottles table has no
+        # unique key on serial_number alone, so check for each serial explicitly
         try:
-            cursor.execute("""
-            INSERT INTO bottles (serial_number, water_level, shape_status, confidence_score, is_defective)
-            VALUES 
-                ('BTL-TEST-001', 'full', 'perfect', 0.95, FALSE),
-                ('BTL-TEST-002', 'overflow', 'perfect', 0.88, TRUE),
-                ('BTL-TEST-003', 'low', 'defective', 0.92, TRUE)
-            ON DUPLICATE KEY UPDATE detection_date = CURRENT_TIMESTAMP
-            """)
-            print("Sample data inserted")
-        except:
-            print("Sample data already exists or error inserting")
+            inserted = 0
+            for sample in SAMPLE_BOTTLES:
+                cursor.execute("""
+                INSERT INTO bottles (serial_number, water_level, shape_status, confidence_score, is_defective)
+                SELECT %s, %s, %s, %s, %s FROM DUAL
+                WHERE NOT EXISTS (SELECT 1 FROM bottles WHERE serial_number = %s)
+                """, sample + (sample[0],))
+                inserted += cursor.rowcount
+            if inserted:
+                cursor.callproc('UpdateDailyStatistics')
+                print("Sample data inserted")
+            else:
+                print("Sample data already exists")
+        except Error as e:
+            print(f"Error inserting sample data: {e}")
         
         connection.commit()
         
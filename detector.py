@@ -3,100 +3,254 @@ import numpy as np
 import time
 from datetime import datetime
 from utils.model_loader import BottleDetectorModels
+from utils.model_registry import ModelRegistry
 from utils.image_processing import ImageProcessor
-from utils.database_handler import DatabaseHandler
-from config import CONFIDENCE_THRESHOLD
+from utils.database_handler import create_database_handler
+from utils.live_statistics import LiveStatistics
+from utils.label_service import LabelService
+from utils.performance import PerformanceMonitor
+from utils.pipeline import Pipeline
+from config import CONFIDENCE_THRESHOLD, PIPELINE_QUEUES, LABEL_SPOOLING
 
 class BottleDefectDetector:
     def __init__(self):
-        self.models = BottleDetectorModels()
+        # New model versions are swapped in while the line runs
+        self.models = BottleDetectorModels(registry=ModelRegistry())
+        self.models.start_watching()
         self.image_processor = ImageProcessor()
-        self.database = DatabaseHandler()
+        self.performance = PerformanceMonitor()
+        self.database = create_database_handler()
+        self.performance.track('db_write', self.database.write_latency)
+        self.live_statistics = LiveStatistics(self.database)
+        self.live_statistics.start()
+        self.labels = None
+        if LABEL_SPOOLING:
+            # Labels are rendered off the pipeline, on the label service's own workers
+            self.labels = LabelService()
+            self.labels.start_spooling()
+            self.database.add_listener(self.labels)
         self.current_serial = None
         self.last_detection_time = 0
         self.detection_cooldown = 3  # seconds between detections
         self.detection_history = []
-        
+
     def process_frame(self, frame):
         """Process a single frame for bottle detection"""
+        display_frame, bottle_roi, bbox, contour = self.detect(frame)
+
+        if bottle_roi is not None:
+            predictions = self.classify(bottle_roi)
+            if predictions is not None:
+                detection_data = self.persist(predictions, bbox)
+                if detection_data is not None:
+                    display_frame = self.render_detection(display_frame, detection_data, contour)
+                    return display_frame, detection_data
+
+        return self.render_scanning(display_frame), None
+
+    def detect(self, frame):
+        """Detect stage: locate the bottle ROI, respecting the detection cooldown"""
         # Create a copy for display
         display_frame = frame.copy()
-        
+
         # Detect bottle in frame
-        bottle_roi, bbox, contour = self.image_processor.detect_bottle(frame)
-        
-        if bottle_roi is not None and bbox is not None:
-            # Check cooldown
-            current_time = time.time()
-            if current_time - self.last_detection_time > self.detection_cooldown:
-                # Enhance image
-                enhanced_roi = self.image_processor.enhance_image(bottle_roi)
-                
-                # Make predictions
-                predictions = self.models.predict(enhanced_roi)
-                
-                # Check confidence
-                if predictions['overall_confidence'] > CONFIDENCE_THRESHOLD:
-                    # Generate serial number
-                    self.current_serial = self.database.generate_serial_number()
-                    
-                    # Save to database
-                    success = self.database.save_bottle_data(
-                        self.current_serial,
-                        predictions['water_level'],
-                        predictions['shape'],
-                        predictions['overall_confidence'],
-                        enhanced_roi
-                    )
-                    
-                    if success:
-                        # Add to history
-                        detection_data = {
-                            'timestamp': datetime.now(),
-                            'serial': self.current_serial,
-                            'water_level': predictions['water_level'],
-                            'shape': predictions['shape'],
-                            'confidence': predictions['overall_confidence'],
-                            'bbox': bbox
-                        }
-                        self.detection_history.append(detection_data)
-                        
-                        # Update last detection time
-                        self.last_detection_time = current_time
-                        
-                        # Draw detection info
-                        display_frame = self.image_processor.draw_detection_info(
-                            display_frame, bbox,
-                            predictions['water_level'],
-                            predictions['shape'],
-                            predictions['overall_confidence'],
-                            self.current_serial
-                        )
-                        
-                        # Draw contour
-                        if contour is not None:
-                            cv2.drawContours(display_frame, [contour], -1, (0, 255, 255), 2)
-                        
-                        return display_frame, detection_data
-        
-        # Draw "Scanning..." text if no bottle detected
-        cv2.putText(display_frame, "Scanning for bottle...", (20, 40), 
+        with self.performance.timed('detection'):
+            bottle_roi, bbox, contour = self.image_processor.detect_bottle(frame)
+        self.performance.tick('processed')
+
+        if bottle_roi is None or bbox is None or self.in_cooldown():
+            return display_frame, None, None, None
+        return display_frame, bottle_roi, bbox, contour
+
+    def classify(self, bottle_roi):
+        """Classify stage: enhance the ROI and run both models"""
+        # Another frame of the same bottle may have passed while this one was queued
+        if self.in_cooldown():
+            return None
+
+        # Enhance image
+        with self.performance.timed('enhancement'):
+            enhanced_roi = self.image_processor.enhance_image(bottle_roi)
+
+        # Make predictions
+        with self.performance.timed('inference'):
+            predictions = self.models.predict(enhanced_roi)
+
+        # Check confidence
+        if predictions['overall_confidence'] <= CONFIDENCE_THRESHOLD:
+            return None
+
+        # Start the cooldown now so queued frames of this bottle are skipped
+        self.last_detection_time = time.time()
+        predictions['enhanced_roi'] = enhanced_roi
+        return predictions
+
+    def persist(self, predictions, bbox):
+        """Persist stage: assign a serial number and save the detection"""
+        # Generate serial number
+        self.current_serial = self.database.generate_serial_number()
+        if self.current_serial is None:
+            print("No serial number available, detection not saved")
+            return None
+
+        # Save to database
+        success = self.database.save_bottle_data(
+            self.current_serial,
+            predictions['water_level'],
+            predictions['shape'],
+            predictions['overall_confidence'],
+            predictions['enhanced_roi']
+        )
+
+        if not success:
+            return None
+
+        # Add to history
+        detection_data = {
+            'timestamp': datetime.now(),
+            'serial': self.current_serial,
+            'water_level': predictions['water_level'],
+            'shape': predictions['shape'],
+            'confidence': predictions['overall_confidence'],
+            'bbox': bbox
+        }
+        self.detection_history.append(detection_data)
+        return detection_data
+
+    def render_detection(self, display_frame, detection_data, contour=None):
+        """Draw detection info and contour on the display frame"""
+        display_frame = self.image_processor.draw_detection_info(
+            display_frame, detection_data['bbox'],
+            detection_data['water_level'],
+            detection_data['shape'],
+            detection_data['confidence'],
+            detection_data['serial']
+        )
+
+        # Draw contour
+        if contour is not None:
+            cv2.drawContours(display_frame, [contour], -1, (0, 255, 255), 2)
+
+        return display_frame
+
+    def render_scanning(self, display_frame):
+        """Draw "Scanning..." text if no bottle detected"""
+        cv2.putText(display_frame, "Scanning for bottle...", (20, 40),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-        
-        return display_frame, None
-    
+        return display_frame
+
+    def in_cooldown(self):
+        return time.time() - self.last_detection_time <= self.detection_cooldown
+
     def get_statistics(self):
-        """Get detection statistics"""
-        return self.database.get_statistics()
-    
+        """Get detection statistics (served from memory, no SQL)"""
+        return self.live_statistics.get_statistics()
+
+    def get_performance_metrics(self):
+        """Frame rates, per-stage latencies and process CPU/RSS"""
+        return self.performance.get_metrics()
+
     def get_recent_detections(self, limit=10):
         """Get recent detections from database"""
         return self.database.get_bottle_history(limit=limit)
-    
+
     def reset_detection(self):
         """Reset current detection"""
         self.current_serial = None
-    
+
     def close(self):
         """Close detector resources"""
-        self.database.close()
\ No newline at end of file
+        self.models.stop_watching()
+        self.live_statistics.stop()
+        self.database.close()
+        if self.labels:
+            self.labels.close()
+
+
+class InspectionPipeline:
+    """Runs capture -> detect -> classify -> persist on separate workers.
+
+    The display stage is the caller's thread, which pulls finished frames
+    with next_frame(). Queue sizes and full-queue policies come from
+    PIPELINE_QUEUES in config.py.
+    """
+
+    def __init__(self, detector, camera, queue_config=PIPELINE_QUEUES):
+        self.detector = detector
+        self.camera = camera
+
+        self.pipeline = Pipeline()
+        for name in ('detect', 'classify', 'persist', 'display', 'results'):
+            maxsize, policy = queue_config[name]
+            self.pipeline.add_queue(name, maxsize, policy)
+
+        self.pipeline.add_stage('capture', self._capture, output_names=('detect',))
+        self.pipeline.add_stage('detect', self._detect, 'detect', ('display', 'classify'))
+        self.pipeline.add_stage('classify', self._classify, 'classify', ('persist',))
+        self.pipeline.add_stage('persist', self._persist, 'persist', ('results',))
+
+    def start(self):
+        self.pipeline.start()
+
+    def stop(self):
+        self.pipeline.stop()
+
+    def next_frame(self, timeout=0.1):
+        """Display stage: next (frame, detection_data) to show, or None"""
+        # Annotated frames of persisted bottles take priority over live frames
+        result = self.pipeline.queues['results'].get(timeout=0)
+        if result is not None:
+            self.detector.performance.tick('displayed')
+            return result
+
+        display_frame = self.pipeline.queues['display'].get(timeout=timeout)
+        if display_frame is None:
+            return None
+        self.detector.performance.tick('displayed')
+        return display_frame, None
+
+    def get_metrics(self):
+        """Per-stage utilization/throughput and per-queue depth/drops"""
+        metrics = self.pipeline.get_metrics()
+        metrics['bottleneck'] = self.pipeline.get_bottleneck(metrics)
+        return metrics
+
+    def get_frame_metrics(self):
+        """Capture/processed/displayed FPS and frames dropped on the way"""
+        rates = {name: meter.rate() for name, meter in self.detector.performance.rates.items()}
+        queue_drops = sum(queue.dropped for queue in self.pipeline.queues.values())
+        return {
+            'capture_fps': self.camera.capture_rate.rate(),
+            'processed_fps': rates.get('processed', 0.0),
+            'displayed_fps': rates.get('displayed', 0.0),
+            'dropped_frames': self.camera.dropped_frames + queue_drops
+        }
+
+    def _capture(self):
+        frame = self.camera.read(timeout=0.1)
+        if frame is None:
+            return None
+        return {'detect': frame}
+
+    def _detect(self, frame):
+        display_frame, bottle_roi, bbox, contour = self.detector.detect(frame)
+
+        outputs = {'display': self.detector.render_scanning(display_frame.copy())}
+        if bottle_roi is not None:
+            outputs['classify'] = (display_frame, bottle_roi, bbox, contour)
+        return outputs
+
+    def _classify(self, item):
+        display_frame, bottle_roi, bbox, contour = item
+        predictions = self.detector.classify(bottle_roi)
+        if predictions is None:
+            return None
+        return {'persist': (display_frame, predictions, bbox, contour)}
+
+    def _persist(self, item):
+        display_frame, predictions, bbox, contour = item
+        detection_data = self.detector.persist(predictions, bbox)
+        if detection_data is None:
+            return None
+        display_frame = self.detector.render_detection(display_frame, detection_data, contour)
+        return {'results': (display_frame, detection_data)}
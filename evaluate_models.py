@@ -0,0 +1,36 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.evaluation import evaluate_models
+from config import (MODELS_DIR, MODEL_VARIANT, EVALUATION_WORKERS, EVALUATION_BATCH_SIZE, TARGET_DEFECT_RECALL,
+                    EVALUATION_REPORT_PATH)
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the deployed models on labelled images')
+    parser.add_argument('--data-dir', help='Labelled images as <model>/<class>/image '
+                                           '(default: the validation side of the training splits)')
+    parser.add_argument('--models-dir', default=str(MODELS_DIR))
+    parser.add_argument('--variant', choices=['teacher', 'student'], default=MODEL_VARIANT)
+    parser.add_argument('--workers', type=int, default=EVALUATION_WORKERS, help='Worker processes')
+    parser.add_argument('--batch-size', type=int, default=EVALUATION_BATCH_SIZE)
+    parser.add_argument('--target-recall', type=float, default=TARGET_DEFECT_RECALL,
+                        help='Defect recall the confidence threshold is tuned for (default: %(default)s)')
+    parser.add_argument('--min-accuracy', type=float,
+                        help='Exit with status 1 if any model is less accurate than this')
+    parser.add_argument('--output', default=str(EVALUATION_REPORT_PATH), help='JSON report; HTML is written next to it')
+    args = parser.parse_args()
+
+    report = evaluate_models(args.data_dir, args.models_dir, args.variant, args.workers, args.batch_size,
+                             args.target_recall, args.output)
+    if report is None:
+        sys.exit(1)
+    if args.min_accuracy is not None:
+        below = [name for name, metrics in report['models'].items() if metrics['accuracy'] < args.min_accuracy]
+        if below:
+            print(f"Below {args.min_accuracy:.2%} accuracy: {', '.join(below)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from datetime import datetime
 import os
 from typing import List, Dict
 from config import WATER_LEVEL_LABELS, SHAPE_LABELS, DATA_DIR
+from utils.dataset_index import DatasetIndex
 
 
 def bullet_list(pdf: FPDF, items, indent=10, line_height=7):
@@ -45,38 +46,21 @@ def read_requirements() -> List[str]:
     return deps
 
 
-def summarize_dataset() -> (Dict[str, int], Dict[str, int]):
-    """Count images per class for water_level and shape in data/train."""
+def summarize_dataset() -> (Dict[str, int], Dict[str, int], int):
+    """Usable images per class for water_level and shape in data/train, and the
+    number of corrupt images, from the incrementally updated dataset manifest."""
     wl_counts: Dict[str, int] = {cls: 0 for cls in WATER_LEVEL_LABELS}
     shape_counts: Dict[str, int] = {cls: 0 for cls in SHAPE_LABELS}
 
     train_dir = os.path.join(str(DATA_DIR), "train")
-    # Water level
-    wl_dir = os.path.join(train_dir, "water_level")
-    for cls in WATER_LEVEL_LABELS:
-        cls_dir = os.path.join(wl_dir, cls)
-        wl_counts[cls] = count_images(cls_dir)
-
-    # Shape
-    shape_dir = os.path.join(train_dir, "shape")
-    for cls in SHAPE_LABELS:
-        cls_dir = os.path.join(shape_dir, cls)
-        shape_counts[cls] = count_images(cls_dir)
-
-    return wl_counts, shape_counts
-
-
-def count_images(dir_path: str) -> int:
-    """Count image files in a directory (common extensions)."""
-    if not os.path.exists(dir_path):
-        return 0
-    exts = {".jpg", ".jpeg", ".png", ".bmp"}
-    total = 0
-    for fn in os.listdir(dir_path):
-        ext = os.path.splitext(fn)[1].lower()
-        if ext in exts:
-            total += 1
-    return total
+    if not os.path.exists(train_dir):
+        return wl_counts, shape_counts, 0
+
+    index = DatasetIndex(train_dir)
+    index.update()
+    wl_counts.update(index.class_counts("water_level"))
+    shape_counts.update(index.class_counts("shape"))
+    return wl_counts, shape_counts, len(index.corrupt())
 
 
 def build_report(output_path: str = "Water_Bottle_Defect_Detection_Report.pdf"):
@@ -299,16 +283,17 @@ def build_report(output_path: str = "Water_Bottle_Defect_Detection_Report.pdf"):
 
     # Dataset Summary (dynamic)
     pdf.add_page()
-    wl_counts, shape_counts = summarize_dataset()
+    wl_counts, shape_counts, corrupt_count = summarize_dataset()
     add_section(
         pdf,
         "13. Dataset Summary",
         paragraphs=[
-            "Training dataset summary gathered from data/train/. Counts reflect number of images per class found on disk.",
+            "Training dataset summary gathered from data/train/ via the dataset manifest. Counts reflect usable images per class; unreadable or truncated files are excluded.",
         ],
         bullets=[
             f"Water level classes: " + ", ".join([f"{cls}: {wl_counts.get(cls, 0)}" for cls in WATER_LEVEL_LABELS]),
             f"Shape classes: " + ", ".join([f"{cls}: {shape_counts.get(cls, 0)}" for cls in SHAPE_LABELS]),
+            f"Corrupt images excluded: {corrupt_count}",
             "Ensure balanced classes for best model generalization",
         ],
     )
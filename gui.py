@@ -4,15 +4,20 @@ import numpy as np
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
-from datetime import datetime
+from datetime import datetime, timedelta
+import threading
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib
 matplotlib.use('Qt5Agg')
 
 from camera_stream import CameraStream
-from detector import BottleDefectDetector
-from config import COLORS
+from detector import BottleDefectDetector, InspectionPipeline
+from utils.exporter import EXPORT_FORMATS, export_bottles
+from utils.database_handler import ROLLUP_RESOLUTIONS, rollup_bucket
+from utils.thumbnail_cache import ThumbnailCache, ThumbnailLoader
+from config import (COLORS, HISTORY_PAGE_SIZE, THUMBNAIL_SIZE, WATER_LEVEL_LABELS, SHAPE_LABELS, FRAME_RATE,
+                    GUI_RECONCILE_INTERVAL)
 
 class VideoThread(QThread):
     frame_ready = pyqtSignal(np.ndarray, object)
@@ -22,22 +27,27 @@ class VideoThread(QThread):
         super().__init__()
         self.detector = detector
         self.camera = None
+        self.pipeline = None
         self.running = False
         
     def run(self):
         self.camera = CameraStream()
         if self.camera.start():
+            # Capture, detection, classification and persistence run on their
+            # own workers; this thread is the display stage
+            self.pipeline = InspectionPipeline(self.detector, self.camera)
+            self.pipeline.start()
             self.running = True
             while self.running:
                 try:
-                    frame = self.camera.get_frame()
-                    if frame is not None:
-                        processed_frame, detection_data = self.detector.process_frame(frame)
+                    output = self.pipeline.next_frame(timeout=0.1)
+                    if output is not None:
+                        processed_frame, detection_data = output
                         self.frame_ready.emit(processed_frame, detection_data)
-                    self.msleep(30)  # ~30 FPS
                 except Exception as e:
                     self.error_signal.emit(str(e))
                     break
+            self.pipeline.stop()
             self.camera.stop()
         else:
             self.error_signal.emit("Could not start camera. Check camera connection.")
@@ -45,6 +55,223 @@ class VideoThread(QThread):
     def stop(self):
         self.running = False
         self.wait()
+    
+    def get_pipeline_metrics(self):
+        return self.pipeline.get_metrics() if self.pipeline else None
+    
+    def get_frame_metrics(self):
+        return self.pipeline.get_frame_metrics() if self.pipeline else None
+
+class DetectionEvents(QObject):
+    """Forwards DatabaseHandler listener callbacks to the GUI thread.
+    
+    Callbacks arrive on the persist and writer threads and only set dirty
+    flags; at most one `changed` signal is in flight until the GUI takes
+    the flags, so a burst of detections costs a single update.
+    """
+    changed = pyqtSignal()
+    
+    STATISTICS = 1   # live counts changed (bottle accepted)
+    HISTORY = 2      # rows committed to the database
+    
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._signalled = False
+    
+    def _mark(self, kind):
+        with self._lock:
+            self._dirty |= kind
+            if self._signalled:
+                return
+            self._signalled = True
+        self.changed.emit()
+    
+    def take(self):
+        """Dirty flags accumulated since the last call"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, 0
+            self._signalled = False
+            return dirty
+    
+    # DatabaseHandler listener interface
+    def bottle_saved(self, record):
+        self._mark(self.STATISTICS)
+    
+    def bottles_flushed(self, records, committed=True):
+        self._mark(self.STATISTICS | self.HISTORY if committed else self.STATISTICS)
+
+class ExportThread(QThread):
+    """Streams an export on a worker thread so the UI stays responsive"""
+    progress = pyqtSignal(int, int)
+    finished_export = pyqtSignal(str, int)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+    
+    def __init__(self, database, path, filters):
+        super().__init__()
+        self.database = database
+        self.path = path
+        self.filters = filters
+        self.cancel_event = threading.Event()
+        
+    def run(self):
+        try:
+            written = export_bottles(self.database, self.path,
+                                     progress=lambda written, total: self.progress.emit(written, total or 0),
+                                     cancel_event=self.cancel_event, **self.filters)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if written is None:
+            self.cancelled.emit()
+        else:
+            self.finished_export.emit(self.path, written)
+    
+    def cancel(self):
+        self.cancel_event.set()
+
+class ExportDialog(QDialog):
+    """Date range, filter and format selection for an export"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Export Data")
+        
+        layout = QFormLayout()
+        
+        today = QDate.currentDate()
+        self.start_edit = QDateEdit(today.addDays(1 - today.day()))
+        self.start_edit.setCalendarPopup(True)
+        self.end_edit = QDateEdit(today)
+        self.end_edit.setCalendarPopup(True)
+        self.defective_check = QCheckBox("Defective bottles only")
+        self.format_combo = QComboBox()
+        for suffix in EXPORT_FORMATS:
+            self.format_combo.addItem(suffix)
+        
+        layout.addRow("From:", self.start_edit)
+        layout.addRow("To:", self.end_edit)
+        layout.addRow("", self.defective_check)
+        layout.addRow("Format:", self.format_combo)
+        
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+    
+    def get_filters(self):
+        # The end date is inclusive for the operator, exclusive for the query
+        start = self.start_edit.date().toPyDate()
+        end = self.end_edit.date().toPyDate() + timedelta(days=1)
+        return {'start': start, 'end': end, 'defective_only': self.defective_check.isChecked()}
+    
+    def get_suffix(self):
+        return self.format_combo.currentText()
+
+class Sparkline(QWidget):
+    """Tiny line chart of recent values, painted directly with QPainter"""
+    
+    def __init__(self, color='#007bff'):
+        super().__init__()
+        self.values = []
+        self.color = QColor(color)
+        self.setMinimumSize(120, 24)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+    
+    def set_values(self, values):
+        self.values = values
+        self.update()
+    
+    def paintEvent(self, event):
+        if len(self.values) < 2:
+            return
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(QPen(self.color, 1.2))
+        
+        width, height = self.width() - 2, self.height() - 4
+        peak = max(self.values) or 1.0
+        step = width / (len(self.values) - 1)
+        points = [QPointF(1 + i * step, 2 + height * (1 - value / peak))
+                  for i, value in enumerate(self.values)]
+        painter.drawPolyline(QPolygonF(points))
+        painter.end()
+
+class PerformancePanel(QGroupBox):
+    """Collapsible panel with frame rates, stage latencies and process load.
+    
+    Unchecking the group box collapses it and stops its refreshes.
+    """
+    
+    # Latency name -> label
+    STAGES = [
+        ('detection', "Detection"),
+        ('enhancement', "Enhancement"),
+        ('inference', "Inference"),
+        ('db_write', "DB write")
+    ]
+    
+    def __init__(self):
+        super().__init__("⚡ Performance")
+        self.setCheckable(True)
+        self.setChecked(False)
+        self.init_ui()
+        self.toggled.connect(self.content.setVisible)
+        self.content.setVisible(False)
+    
+    def init_ui(self):
+        layout = QVBoxLayout()
+        self.content = QWidget()
+        content_layout = QVBoxLayout()
+        content_layout.setContentsMargins(0, 0, 0, 0)
+        
+        self.rates_label = QLabel("Capture: - fps | Processed: - fps | Displayed: - fps | Dropped: -")
+        self.process_label = QLabel("CPU: - | RSS: -")
+        content_layout.addWidget(self.rates_label)
+        content_layout.addWidget(self.process_label)
+        
+        grid = QGridLayout()
+        grid.addWidget(QLabel("<b>Stage</b>"), 0, 0)
+        grid.addWidget(QLabel("<b>p50 / p95 / p99</b>"), 0, 1)
+        grid.addWidget(QLabel("<b>Recent</b>"), 0, 2)
+        self.stage_labels = {}
+        self.sparklines = {}
+        for row, (name, label) in enumerate(self.STAGES, start=1):
+            grid.addWidget(QLabel(label), row, 0)
+            self.stage_labels[name] = QLabel("-")
+            grid.addWidget(self.stage_labels[name], row, 1)
+            self.sparklines[name] = Sparkline()
+            grid.addWidget(self.sparklines[name], row, 2)
+        grid.setColumnStretch(2, 1)
+        content_layout.addLayout(grid)
+        
+        self.content.setLayout(content_layout)
+        layout.addWidget(self.content)
+        self.setLayout(layout)
+    
+    def update_metrics(self, performance, frames):
+        if not self.isChecked():
+            return
+        
+        if frames:
+            self.rates_label.setText(f"Capture: {frames['capture_fps']:.1f} fps | "
+                                     f"Processed: {frames['processed_fps']:.1f} fps | "
+                                     f"Displayed: {frames['displayed_fps']:.1f} fps | "
+                                     f"Dropped: {frames['dropped_frames']}")
+        rss = performance['rss']
+        rss_text = f"{rss / (1024 * 1024):.0f} MB" if rss is not None else "n/a"
+        self.process_label.setText(f"CPU: {performance['cpu_percent']:.0f}% | RSS: {rss_text}")
+        
+        for name, label in self.STAGES:
+            stats = performance['latency'].get(name)
+            if not stats or not stats['samples']:
+                continue
+            p50, p95, p99 = (stats['percentiles'][point] * 1000 for point in (50, 95, 99))
+            self.stage_labels[name].setText(f"{p50:.1f} / {p95:.1f} / {p99:.1f} ms")
+            self.sparklines[name].set_values(stats['samples'][-100:])
 
 class StatisticsWidget(QWidget):
     def __init__(self):
@@ -123,28 +350,515 @@ class StatisticsWidget(QWidget):
             self.overall_perfect.setText(str(overall_stats.get('perfect_total', 0) or 0))
             self.overall_defective.setText(str(overall_stats.get('defective_total', 0) or 0))
 
+class TrendWidget(QWidget):
+    """Defect trends drawn from the per-minute/per-hour rollup tables.
+    
+    The axes are fixed for each view (x in buckets before now, y in
+    percent), so a refresh only updates the line data and blits them over
+    a cached background; a full redraw happens only on view change or
+    resize. The rollups are queried on a background thread, at most one
+    query at a time; refreshes requested meanwhile are folded into one.
+    """
+    
+    # View name -> (rollup resolution, number of buckets)
+    VIEWS = {
+        "Last hour (per minute)": ('minute', 60),
+        "Last 24 hours (per hour)": ('hour', 24),
+        "Last 7 days (per hour)": ('hour', 24 * 7),
+        "Last 4 weeks (per hour)": ('hour', 24 * 28)
+    }
+    
+    SERIES = [
+        ('defective_bottles', "Defective", '#dc3545'),
+        ('low_count', "Low", '#fd7e14'),
+        ('overflow_count', "Overflow", '#6f42c1'),
+        ('shape_defective_count', "Shape defect", '#343a40')
+    ]
+    
+    # (generation, start of the first bucket, rows) of a finished query, delivered on the GUI thread
+    rollups_loaded = pyqtSignal(int, object, object)
+    
+    def __init__(self, database):
+        super().__init__()
+        self.database = database
+        self.background = None
+        # Bumped on view change, so rollups of the previous view are dropped
+        self.generation = 0
+        self.loading = False
+        self.refresh_pending = False
+        self.query_pool = QThreadPool()
+        self.query_pool.setMaxThreadCount(1)
+        self.rollups_loaded.connect(self._rollups_loaded, Qt.ConnectionType.QueuedConnection)
+        self.init_ui()
+        self.set_view(self.view_combo.currentText())
+        
+    def init_ui(self):
+        layout = QVBoxLayout()
+        
+        header = QHBoxLayout()
+        title = QLabel("Defect Trends")
+        title.setStyleSheet("font-size: 16px; font-weight: bold; color: #2c3e50;")
+        header.addWidget(title)
+        header.addStretch()
+        self.view_combo = QComboBox()
+        self.view_combo.addItems(list(self.VIEWS))
+        self.view_combo.currentTextChanged.connect(self.set_view)
+        header.addWidget(self.view_combo)
+        layout.addLayout(header)
+        
+        self.figure = plt.Figure(figsize=(5, 3), tight_layout=True)
+        self.canvas = FigureCanvas(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        self.axes.set_ylim(0, 100)
+        self.axes.set_ylabel("% of bottles")
+        self.axes.grid(True, alpha=0.3)
+        
+        # Animated artists are left out of full draws and blitted on refresh
+        self.lines = {}
+        for column, label, color in self.SERIES:
+            line, = self.axes.plot([], [], label=label, color=color, linewidth=1.5, animated=True)
+            self.lines[column] = line
+        self.summary = self.axes.text(0.01, 0.97, "", transform=self.axes.transAxes,
+                                      va='top', fontsize=8, animated=True)
+        self.axes.legend(loc='upper right', fontsize=8)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        
+        layout.addWidget(self.canvas)
+        self.setLayout(layout)
+    
+    def set_view(self, view):
+        self.generation += 1
+        self.resolution, self.buckets = self.VIEWS[view]
+        table, self.bucket_width = ROLLUP_RESOLUTIONS[self.resolution]
+        
+        # x is the bucket offset from now, so the axes stay put as time passes
+        self.x = np.arange(-self.buckets + 1, 1)
+        self.axes.set_xlim(self.x[0], self.x[-1])
+        unit = "min" if self.resolution == 'minute' else "h"
+        self.axes.set_xlabel(f"{unit} ago")
+        self.axes.xaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(
+            lambda value, position: f"{-int(value)}"))
+        
+        # Full redraw; on_draw recaches the background
+        self.background = None
+        self.canvas.draw_idle()
+        self.refresh()
+    
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_artists()
+    
+    def draw_artists(self):
+        for line in self.lines.values():
+            self.axes.draw_artist(line)
+        self.axes.draw_artist(self.summary)
+    
+    def refresh(self):
+        """Reload the visible buckets from the rollups; the lines are blitted when they arrive"""
+        if self.loading:
+            self.refresh_pending = True
+            return
+        self.loading = True
+        self.refresh_pending = False
+        generation, resolution, width = self.generation, self.resolution, self.bucket_width
+        now = rollup_bucket(datetime.now(), resolution)
+        start = now - width * (self.buckets - 1)
+        self.query_pool.start(lambda: self.rollups_loaded.emit(
+            generation, start, self.database.get_rollups(resolution, start, now + width)))
+    
+    def _rollups_loaded(self, generation, start, rows):
+        self.loading = False
+        if self.refresh_pending:
+            # Bottles were committed or the view changed while querying
+            self.refresh()
+        if generation != self.generation:
+            return
+        
+        totals = np.zeros(self.buckets)
+        counts = {column: np.zeros(self.buckets) for column, label, color in self.SERIES}
+        confidence = 0.0
+        for row in rows:
+            index = int((row['bucket'] - start) / self.bucket_width)
+            if 0 <= index < self.buckets:
+                totals[index] = row['total_bottles']
+                confidence += row['confidence_sum']
+                for column in counts:
+                    counts[column][index] = row[column]
+        
+        # Buckets without bottles are gaps, not 0%
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for column, line in self.lines.items():
+                line.set_data(self.x, np.where(totals > 0, 100 * counts[column] / totals, np.nan))
+        
+        total = int(totals.sum())
+        defective = int(counts['defective_bottles'].sum())
+        mean_confidence = confidence / total if total else 0.0
+        self.summary.set_text(f"{total} bottles | {defective / total if total else 0:.1%} defective | "
+                              f"mean confidence {mean_confidence:.1%}")
+        
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.figure.bbox)
+    
+    def stop(self):
+        self.query_pool.clear()
+        self.query_pool.waitForDone(2000)
+
+class BottleHistoryModel(QAbstractTableModel):
+    """Bottle history fetched page by page from the database.
+    
+    Older pages are loaded through Qt's canFetchMore/fetchMore as the view
+    scrolls down; new detections are inserted at the top by fetch_newer()
+    without touching the rows already loaded. Queries run on a background
+    thread and their rows are added when they arrive, so a slow database
+    never freezes the GUI.
+    """
+    
+    HEADERS = ["Time", "Serial", "Water Level", "Shape", "Confidence"]
+    
+    # (generation, newer, rows) of a finished query, delivered on the GUI thread
+    page_loaded = pyqtSignal(int, bool, object)
+    
+    def __init__(self, database, page_size=HISTORY_PAGE_SIZE):
+        super().__init__()
+        self.database = database
+        self.page_size = page_size
+        self.filters = {}
+        self.rows = []
+        self.exhausted = False
+        # Bumped when the rows are reset, so results of older queries are dropped
+        self.generation = 0
+        self.loading_older = False
+        self.loading_newer = False
+        self.query_pool = QThreadPool()
+        self.query_pool.setMaxThreadCount(1)
+        self.page_loaded.connect(self._page_loaded, Qt.ConnectionType.QueuedConnection)
+    
+    def set_filters(self, **filters):
+        """Show only matching bottles, starting again from the newest"""
+        self.beginResetModel()
+        self.generation += 1
+        self.filters = {key: value for key, value in filters.items() if value}
+        self.rows = []
+        self.exhausted = False
+        self.loading_older = self.loading_newer = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+    
+    def _cursor(self, row):
+        return (row['detection_date'], row['id'])
+    
+    def _query(self, newer, query):
+        generation = self.generation
+        self.query_pool.start(lambda: self.page_loaded.emit(generation, newer, query()))
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted and not self.loading_older
+    
+    def fetchMore(self, parent):
+        if parent.isValid() or self.exhausted or self.loading_older:
+            return
+        self.loading_older = True
+        before = self._cursor(self.rows[-1]) if self.rows else None
+        filters, limit = dict(self.filters), self.page_size
+        self._query(False, lambda: self.database.get_bottle_page(before=before, limit=limit, **filters))
+    
+    def fetch_newer(self):
+        """Insert bottles detected since the newest loaded row at the top"""
+        if not self.rows:
+            self.exhausted = False
+            self.fetchMore(QModelIndex())
+            return
+        if self.loading_newer:
+            return
+        self.loading_newer = True
+        after = self._cursor(self.rows[0])
+        filters, limit = dict(self.filters), self.page_size
+        
+        def query(after=after):
+            newer = []
+            while True:
+                page = self.database.get_bottle_page(after=after, limit=limit, **filters)
+                newer = page + newer
+                if len(page) < limit:
+                    return newer
+                after = self._cursor(page[0])
+        
+        self._query(True, query)
+    
+    def _page_loaded(self, generation, newer, rows):
+        if generation != self.generation:
+            return
+        if newer:
+            self.loading_newer = False
+            if rows:
+                self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+                self.rows[:0] = rows
+                self.endInsertRows()
+            return
+        
+        self.loading_older = False
+        if len(rows) < self.page_size:
+            self.exhausted = True
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+    
+    def stop(self):
+        self.query_pool.clear()
+        self.query_pool.waitForDone(2000)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.rows[index.row()]
+        column = index.column()
+        
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                detected_at = record['detection_date']
+                if not isinstance(detected_at, datetime):
+                    return str(detected_at)
+                if detected_at.date() == datetime.now().date():
+                    return detected_at.strftime("%H:%M:%S")
+                return detected_at.strftime("%Y-%m-%d %H:%M:%S")
+            if column == 1:
+                return record.get('serial_number') or 'N/A'
+            if column == 2:
+                return record.get('water_level') or 'N/A'
+            if column == 3:
+                return record.get('shape_status') or 'N/A'
+            return f"{record.get('confidence_score') or 0:.2%}"
+        
+        # Color coding of water level and shape
+        if role == Qt.ItemDataRole.BackgroundRole:
+            if column == 2:
+                water_level = record.get('water_level')
+                if water_level in ('overflow', 'low'):
+                    return QColor(*COLORS[water_level])
+                return QColor(*COLORS['full'])
+            if column == 3:
+                if record.get('shape_status') == 'defective':
+                    return QColor(*COLORS['defective'])
+                return QColor(*COLORS['perfect'])
+        
+        if role == Qt.ItemDataRole.ForegroundRole:
+            if (column == 2 and record.get('water_level') == 'overflow') or \
+               (column == 3 and record.get('shape_status') == 'defective'):
+                return QColor(255, 255, 255)
+        
+        if role == Qt.ItemDataRole.TextAlignmentRole and column == 4:
+            return Qt.AlignmentFlag.AlignCenter
+        
+        return None
+
+class DefectImageModel(BottleHistoryModel):
+    """Bottle history with a thumbnail per row, for the review grid.
+    
+    Thumbnails are only requested for rows the view actually paints and are
+    decoded off the GUI thread; the view repaints once per batch of arrivals.
+    """
+    
+    thumbnail_loaded = pyqtSignal()
+    
+    def __init__(self, database, page_size=HISTORY_PAGE_SIZE):
+        super().__init__(database, page_size)
+        self.cache = ThumbnailCache()
+        self.loader = ThumbnailLoader(self.cache, lambda key, thumbnail: self.thumbnail_loaded.emit())
+        self.placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.placeholder.fill(QColor(222, 226, 230))
+        self.repaint_pending = False
+        self.thumbnail_loaded.connect(self.schedule_repaint, Qt.ConnectionType.QueuedConnection)
+    
+    def thumbnail_key(self, record):
+        # Stored images are named by their digest, so bottles sharing an
+        # image share a thumbnail; legacy blobs are keyed by bottle
+        image_path = record.get('image_path')
+        if image_path:
+            return image_path.rsplit('/', 1)[-1].split('.')[0]
+        return f"bottle{record['id']}"
+    
+    def image_fetcher(self, record):
+        """Callable returning the full-resolution image bytes of a bottle"""
+        image_path = record.get('image_path')
+        if image_path:
+            return lambda: self.database.image_store.get(image_path)
+        return lambda: self.database.get_bottle_image(record['id'])
+    
+    def schedule_repaint(self):
+        if not self.repaint_pending:
+            self.repaint_pending = True
+            QTimer.singleShot(50, self.repaint_thumbnails)
+    
+    def repaint_thumbnails(self):
+        self.repaint_pending = False
+        if self.rows:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.rows) - 1, 0),
+                                  [Qt.ItemDataRole.DecorationRole])
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.rows[index.row()]
+        
+        if role == Qt.ItemDataRole.DecorationRole and index.column() == 0:
+            key = self.thumbnail_key(record)
+            thumbnail = self.cache.get(key)
+            if thumbnail is not None:
+                height, width = thumbnail.shape[:2]
+                return QImage(thumbnail.data, width, height, 3 * width, QImage.Format.Format_RGB888).copy()
+            if not self.cache.is_missing(key):
+                self.loader.request(key, self.image_fetcher(record))
+            return self.placeholder
+        
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return (f"{record.get('serial_number') or 'N/A'}\n"
+                    f"Water level: {record.get('water_level') or 'N/A'}\n"
+                    f"Shape: {record.get('shape_status') or 'N/A'}\n"
+                    f"Confidence: {record.get('confidence_score') or 0:.2%}")
+        
+        if role == Qt.ItemDataRole.ForegroundRole and index.column() == 0 and record.get('is_defective'):
+            return QColor(220, 53, 69)
+        
+        return super().data(index, role)
+    
+    def stop(self):
+        super().stop()
+        self.loader.close()
+
+class ImageViewerDialog(QDialog):
+    """Full-resolution image of one bottle, with label correction when a database is given"""
+    
+    def __init__(self, record, image_bytes, parent=None, database=None):
+        super().__init__(parent)
+        self.record = record
+        self.database = database
+        self.setWindowTitle(f"Bottle {record.get('serial_number') or record['id']}")
+        layout = QVBoxLayout()
+        
+        pixmap = QPixmap()
+        pixmap.loadFromData(image_bytes)
+        image_label = QLabel()
+        image_label.setPixmap(pixmap)
+        image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        scroll = QScrollArea()
+        scroll.setWidget(image_label)
+        scroll.setWidgetResizable(True)
+        layout.addWidget(scroll)
+        
+        detected_at = record.get('detection_date')
+        details = QLabel(f"{detected_at} | Water level: {record.get('water_level') or 'N/A'} | "
+                         f"Shape: {record.get('shape_status') or 'N/A'} | "
+                         f"Confidence: {record.get('confidence_score') or 0:.2%}")
+        layout.addWidget(details)
+        
+        if database is not None:
+            # Corrected labels are collected for fine-tuning the models
+            label_layout = QHBoxLayout()
+            label_layout.addWidget(QLabel("Correct label:"))
+            self.water_combo = QComboBox()
+            self.water_combo.addItems(WATER_LEVEL_LABELS)
+            self.water_combo.setCurrentText(record.get('water_level') or WATER_LEVEL_LABELS[0])
+            label_layout.addWidget(self.water_combo)
+            self.shape_combo = QComboBox()
+            self.shape_combo.addItems(SHAPE_LABELS)
+            self.shape_combo.setCurrentText(record.get('shape_status') or SHAPE_LABELS[0])
+            label_layout.addWidget(self.shape_combo)
+            save_button = QPushButton("Save label")
+            save_button.clicked.connect(self.save_label)
+            label_layout.addWidget(save_button)
+            label_layout.addStretch()
+            layout.addLayout(label_layout)
+        
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+        self.resize(min(pixmap.width() + 60, 1200), min(pixmap.height() + 160, 900))
+    
+    def save_label(self):
+        if self.database.label_sample(self.record['id'], self.water_combo.currentText(),
+                                      self.shape_combo.currentText()):
+            QMessageBox.information(self, "Label saved", "The label will be used in the next fine-tuning run.")
+        else:
+            QMessageBox.warning(self, "Label not saved", "Could not save the label, see the log for details.")
+
 class DetectionHistoryWidget(QWidget):
-    def __init__(self):
+    TITLE = "Detection History"
+    DEFECTIVE_ONLY = False
+    
+    def __init__(self, database):
         super().__init__()
+        self.model = self.create_model(database)
         self.init_ui()
+        self.apply_filters()
+    
+    def create_model(self, database):
+        return BottleHistoryModel(database)
         
     def init_ui(self):
         layout = QVBoxLayout()
         
         # Title
-        title = QLabel("Recent Detections")
+        title = QLabel(self.TITLE)
         title.setStyleSheet("font-size: 16px; font-weight: bold; margin-bottom: 10px; color: #2c3e50;")
         layout.addWidget(title)
         
-        # Table
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)
-        self.table.setHorizontalHeaderLabels(["Time", "Serial", "Water Level", "Shape", "Confidence"])
+        # Filters
+        filter_layout = QHBoxLayout()
+        self.defective_check = QCheckBox("Defective only")
+        self.water_combo = QComboBox()
+        self.water_combo.addItem("All levels", None)
+        for label in WATER_LEVEL_LABELS:
+            self.water_combo.addItem(label, label)
+        self.shape_combo = QComboBox()
+        self.shape_combo.addItem("All shapes", None)
+        for label in SHAPE_LABELS:
+            self.shape_combo.addItem(label, label)
+        self.serial_edit = QLineEdit()
+        self.serial_edit.setPlaceholderText("Serial prefix")
+        self.defective_check.setChecked(self.DEFECTIVE_ONLY)
+        
+        self.defective_check.toggled.connect(self.apply_filters)
+        self.water_combo.currentIndexChanged.connect(self.apply_filters)
+        self.shape_combo.currentIndexChanged.connect(self.apply_filters)
+        self.serial_edit.editingFinished.connect(self.apply_filters)
+        
+        filter_layout.addWidget(self.defective_check)
+        filter_layout.addWidget(self.water_combo)
+        filter_layout.addWidget(self.shape_combo)
+        filter_layout.addWidget(self.serial_edit)
+        layout.addLayout(filter_layout)
+        
+        layout.addWidget(self.create_view())
+        self.setLayout(layout)
+    
+    def create_view(self):
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        self.table.verticalHeader().setVisible(False)
         self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.table.setAlternatingRowColors(True)
         self.table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 background-color: #f8f9fa;
                 alternate-background-color: #e9ecef;
                 gridline-color: #dee2e6;
@@ -157,63 +871,65 @@ class DetectionHistoryWidget(QWidget):
                 font-weight: bold;
             }
         """)
-        
-        layout.addWidget(self.table)
-        self.setLayout(layout)
+        return self.table
     
-    def update_history(self, history):
-        self.table.setRowCount(0)
-        
-        for i, record in enumerate(history):
-            self.table.insertRow(i)
-            
-            # Time
-            time_str = record['detection_date'].strftime("%H:%M:%S") if isinstance(record['detection_date'], datetime) else str(record['detection_date'])
-            time_item = QTableWidgetItem(time_str)
-            
-            # Serial
-            serial_item = QTableWidgetItem(record.get('serial_number', 'N/A'))
-            
-            # Water level with color coding
-            water_level = record.get('water_level', 'N/A')
-            water_item = QTableWidgetItem(water_level)
-            if water_level == 'overflow':
-                water_item.setBackground(QColor(*COLORS['overflow']))
-                water_item.setForeground(QColor(255, 255, 255))
-            elif water_level == 'low':
-                water_item.setBackground(QColor(*COLORS['low']))
-            else:
-                water_item.setBackground(QColor(*COLORS['full']))
-            
-            # Shape with color coding
-            shape_status = record.get('shape_status', 'N/A')
-            shape_item = QTableWidgetItem(shape_status)
-            if shape_status == 'defective':
-                shape_item.setBackground(QColor(*COLORS['defective']))
-                shape_item.setForeground(QColor(255, 255, 255))
-            else:
-                shape_item.setBackground(QColor(*COLORS['perfect']))
-            
-            # Confidence
-            confidence = record.get('confidence_score', 0)
-            conf_item = QTableWidgetItem(f"{confidence:.2%}")
-            conf_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            
-            # Add items to table
-            self.table.setItem(i, 0, time_item)
-            self.table.setItem(i, 1, serial_item)
-            self.table.setItem(i, 2, water_item)
-            self.table.setItem(i, 3, shape_item)
-            self.table.setItem(i, 4, conf_item)
-        
-        # Resize columns to content
-        self.table.resizeColumnsToContents()
+    def apply_filters(self):
+        self.model.set_filters(
+            defective_only=self.defective_check.isChecked(),
+            water_level=self.water_combo.currentData(),
+            shape_status=self.shape_combo.currentData(),
+            serial_prefix=self.serial_edit.text().strip()
+        )
+    
+    def refresh(self):
+        """Add newly detected bottles at the top"""
+        self.model.fetch_newer()
+    
+    def stop(self):
+        self.model.stop()
+
+class DefectReviewWidget(DetectionHistoryWidget):
+    """Thumbnail grid for reviewing detections, defective bottles by default.
+    
+    The grid is virtualized: rows are paged in as it scrolls and only the
+    visible thumbnails are loaded. Double-click opens the full image.
+    """
+    
+    TITLE = "Defect Review"
+    DEFECTIVE_ONLY = True
+    
+    def create_model(self, database):
+        return DefectImageModel(database)
+    
+    def create_view(self):
+        self.grid = QListView()
+        self.grid.setViewMode(QListView.ViewMode.IconMode)
+        self.grid.setResizeMode(QListView.ResizeMode.Adjust)
+        self.grid.setMovement(QListView.Movement.Static)
+        self.grid.setUniformItemSizes(True)
+        self.grid.setLayoutMode(QListView.LayoutMode.Batched)
+        self.grid.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.grid.setGridSize(QSize(THUMBNAIL_SIZE + 24, THUMBNAIL_SIZE + 36))
+        self.grid.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.grid.setModel(self.model)
+        self.grid.doubleClicked.connect(self.show_image)
+        return self.grid
+    
+    def show_image(self, index):
+        record = self.model.rows[index.row()]
+        image_bytes = self.model.image_fetcher(record)()
+        if not image_bytes:
+            QMessageBox.information(self, "Defect Review", "No image is stored for this bottle.")
+            return
+        ImageViewerDialog(record, image_bytes, self, self.model.database).exec()
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.detector = BottleDefectDetector()
         self.video_thread = None
+        self.export_thread = None
+        self.export_progress = None
         self.detection_enabled = True
         self.init_ui()
         self.start_camera()
@@ -339,6 +1055,10 @@ class MainWindow(QMainWindow):
         button_frame.setLayout(button_layout)
         left_panel.addWidget(button_frame)
         
+        # Performance (collapsed by default)
+        self.performance_panel = PerformancePanel()
+        left_panel.addWidget(self.performance_panel)
+        
         main_layout.addLayout(left_panel, 60)
         
         # Right panel - Information (40%)
@@ -393,22 +1113,45 @@ class MainWindow(QMainWindow):
         self.current_info_group.setLayout(current_info_layout)
         right_panel.addWidget(self.current_info_group)
         
-        # Detection history
-        self.history_widget = DetectionHistoryWidget()
-        right_panel.addWidget(self.history_widget)
+        # Detection history and trends
+        self.info_tabs = QTabWidget()
+        self.history_widget = DetectionHistoryWidget(self.detector.database)
+        self.info_tabs.addTab(self.history_widget, "History")
+        self.trend_widget = TrendWidget(self.detector.database)
+        self.info_tabs.addTab(self.trend_widget, "Trends")
+        self.review_widget = DefectReviewWidget(self.detector.database)
+        self.info_tabs.addTab(self.review_widget, "Review")
+        right_panel.addWidget(self.info_tabs)
         
         main_layout.addLayout(right_panel, 40)
         
-        # Timer for updating stats
-        self.stats_timer = QTimer()
-        self.stats_timer.timeout.connect(self.update_statistics)
-        self.stats_timer.start(3000)  # Update every 3 seconds
+        # Widgets are updated from detection events, at most once per
+        # display frame
+        self.frame_interval = int(1000 / FRAME_RATE)
+        self.events = DetectionEvents()
+        self.events.changed.connect(self.schedule_update, Qt.ConnectionType.QueuedConnection)
+        self.detector.database.add_listener(self.events)
+        self.info_tabs.currentChanged.connect(lambda index: self.update_trends())
+        self.info_tabs.currentChanged.connect(lambda index: self.update_review())
+        
+        # Slow reconciliation in case something changed without an event
+        self.reconcile_timer = QTimer()
+        self.reconcile_timer.timeout.connect(self.update_statistics)
+        self.reconcile_timer.start(GUI_RECONCILE_INTERVAL * 1000)
+        
+        # Pipeline/database/performance metrics are in memory; no queries involved
+        self.status_timer = QTimer()
+        self.status_timer.timeout.connect(self.update_pipeline_status)
+        self.status_timer.timeout.connect(self.update_performance)
+        self.status_timer.start(1000)
         
         # Update stats immediately
         self.update_statistics()
         
         # Status bar
         self.statusBar().showMessage("System Ready | MySQL Connected | Camera Active")
+        self.pipeline_label = QLabel("")
+        self.statusBar().addPermanentWidget(self.pipeline_label)
         
         # Menu bar
         self.create_menu_bar()
@@ -517,17 +1260,68 @@ class MainWindow(QMainWindow):
             # Update status bar
             self.statusBar().showMessage(f"Last detection: {detection_data['serial']} | {status}")
     
+    def schedule_update(self):
+        QTimer.singleShot(self.frame_interval, self.apply_updates)
+    
+    def apply_updates(self):
+        """Apply every detection event received since the last frame"""
+        dirty = self.events.take()
+        try:
+            if dirty & DetectionEvents.STATISTICS:
+                today_stats, overall_stats = self.detector.get_statistics()
+                self.stats_widget.update_stats(today_stats, overall_stats)
+            if dirty & DetectionEvents.HISTORY:
+                self.history_widget.refresh()
+                self.update_trends()
+                self.update_review()
+        except Exception as e:
+            print(f"Error updating statistics: {e}")
+    
+    def update_trends(self):
+        if self.trend_widget.isVisible():
+            self.trend_widget.refresh()
+    
+    def update_review(self):
+        if self.review_widget.isVisible():
+            self.review_widget.refresh()
+    
     def update_statistics(self):
         try:
             today_stats, overall_stats = self.detector.get_statistics()
             self.stats_widget.update_stats(today_stats, overall_stats)
             
-            # Update history
-            history = self.detector.get_recent_detections(10)
-            self.history_widget.update_history(history)
+            # Add new detections to the history
+            self.history_widget.refresh()
+            self.update_trends()
+            self.update_review()
         except Exception as e:
             print(f"Error updating statistics: {e}")
     
+    def update_pipeline_status(self):
+        metrics = self.video_thread.get_pipeline_metrics() if self.video_thread else None
+        if not metrics:
+            return
+        
+        stages = metrics['stages']
+        queues = metrics['queues']
+        stage_text = " | ".join(f"{name} {stats['utilization']:.0%}" for name, stats in stages.items())
+        queue_text = " ".join(f"{name} {stats['depth']}/{stats['maxsize']}" for name, stats in queues.items())
+        dropped = sum(stats['dropped'] for stats in queues.values())
+        db = self.detector.database.get_write_metrics()
+        pool = self.detector.database.get_pool_metrics()
+        pool_text = (f"Pool: {pool['in_use']}/{pool['pool_size']} wait {pool['avg_wait'] * 1000:.1f} ms | "
+                     if pool else "")
+        self.pipeline_label.setText(f"{stage_text} | Queues: {queue_text} | Dropped: {dropped} | "
+                                    f"DB queue: {db['queue_depth']}/{db['queue_size']} "
+                                    f"flush {db['last_flush_latency'] * 1000:.0f} ms | "
+                                    f"{pool_text}Bottleneck: {metrics['bottleneck']}")
+    
+    def update_performance(self):
+        if not self.performance_panel.isChecked():
+            return
+        frames = self.video_thread.get_frame_metrics() if self.video_thread else None
+        self.performance_panel.update_metrics(self.detector.get_performance_metrics(), frames)
+    
     def toggle_detection(self):
         self.detection_enabled = not self.detection_enabled
         if self.detection_enabled:
@@ -592,35 +1386,51 @@ class MainWindow(QMainWindow):
         """)
     
     def export_data(self):
-        from datetime import datetime
-        import csv
-        
-        filename = f"bottle_data_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        try:
-            history = self.detector.get_recent_detections(1000)  # Get all records
-            
-            with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['serial_number', 'detection_date', 'water_level', 
-                             'shape_status', 'confidence_score', 'is_defective']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                
-                writer.writeheader()
-                for record in history:
-                    writer.writerow({
-                        'serial_number': record['serial_number'],
-                        'detection_date': record['detection_date'],
-                        'water_level': record['water_level'],
-                        'shape_status': record['shape_status'],
-                        'confidence_score': record['confidence_score'],
-                        'is_defective': record['is_defective']
-                    })
-            
-            QMessageBox.information(self, "Export Successful", 
-                                  f"Data exported to {filename}\n\nTotal records: {len(history)}")
-        
-        except Exception as e:
-            QMessageBox.critical(self, "Export Failed", f"Error exporting data: {str(e)}")
+        if self.export_thread is not None and self.export_thread.isRunning():
+            QMessageBox.information(self, "Export Running", "An export is already in progress.")
+            return
+        
+        dialog = ExportDialog(self)
+        if dialog.exec() != QDialog.Accepted:
+            return
+        
+        suffix = dialog.get_suffix()
+        default_name = f"bottle_data_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Data", default_name, f"*{suffix}")
+        if not filename:
+            return
+        if not filename.endswith(suffix):
+            filename += suffix
+        
+        self.export_progress = QProgressDialog("Exporting bottle data...", "Cancel", 0, 0, self)
+        self.export_progress.setWindowTitle("Export Data")
+        self.export_progress.setMinimumDuration(0)
+        
+        self.export_thread = ExportThread(self.detector.database, filename, dialog.get_filters())
+        self.export_thread.progress.connect(self.update_export_progress)
+        self.export_thread.finished_export.connect(self.export_finished)
+        self.export_thread.cancelled.connect(self.export_cancelled)
+        self.export_thread.failed.connect(self.export_failed)
+        self.export_progress.canceled.connect(self.export_thread.cancel)
+        self.export_thread.start()
+    
+    def update_export_progress(self, written, total):
+        self.export_progress.setMaximum(total)
+        self.export_progress.setValue(min(written, total) if total else 0)
+        self.export_progress.setLabelText(f"Exported {written:,} of {total:,} records...")
+    
+    def export_finished(self, filename, written):
+        self.export_progress.reset()
+        QMessageBox.information(self, "Export Successful", 
+                              f"Data exported to {filename}\n\nTotal records: {written}")
+    
+    def export_cancelled(self):
+        self.export_progress.reset()
+        self.statusBar().showMessage("Export cancelled")
+    
+    def export_failed(self, error_msg):
+        self.export_progress.reset()
+        QMessageBox.critical(self, "Export Failed", f"Error exporting data: {error_msg}")
     
     def toggle_statistics(self, visible):
         self.stats_widget.setVisible(visible)
@@ -645,8 +1455,16 @@ class MainWindow(QMainWindow):
         self.status_label.setText("❌ Camera Error - Check connection")
     
     def closeEvent(self, event):
+        self.reconcile_timer.stop()
+        self.status_timer.stop()
+        self.history_widget.stop()
+        self.trend_widget.stop()
+        self.review_widget.stop()
         if self.video_thread:
             self.video_thread.stop()
+        if self.export_thread:
+            self.export_thread.cancel()
+            self.export_thread.wait()
         self.detector.close()
         
         reply = QMessageBox.question(
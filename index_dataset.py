@@ -0,0 +1,48 @@
+import sys
+import os
+import argparse
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.dataset_index import DatasetIndex, build_split, save_split
+from utils.training import TRAINING_JOBS
+from config import DATA_DIR, DEDUP_DUPLICATE_DISTANCE, DEDUP_GROUP_DISTANCE
+
+def index_dataset(jobs=None, validation_split=0.2, duplicate_distance=DEDUP_DUPLICATE_DISTANCE,
+                  group_distance=DEDUP_GROUP_DISTANCE):
+    """Update the dataset manifest and write a deduplicated split per model"""
+    train_data_dir = DATA_DIR / "train"
+    if not os.path.exists(train_data_dir):
+        print(f"Training data directory not found: {train_data_dir}")
+        return
+
+    started = time.monotonic()
+    index = DatasetIndex(train_data_dir)
+    inspected, removed = index.update()
+    print(f"Indexed {len(index.entries)} images ({inspected} new or changed, {removed} removed) "
+          f"in {time.monotonic() - started:.1f}s")
+    for path, error in index.corrupt():
+        print(f"Corrupt image {path}: {error}")
+
+    for name in jobs or TRAINING_JOBS:
+        split = build_split(index, name, validation_split, duplicate_distance, group_distance)
+        path = save_split(split)
+        print(f"[{name}] {split['images']} images, {split['duplicates_dropped']} near-duplicates dropped, "
+              f"{split['groups']} groups -> {len(split['train'])} train / {len(split['val'])} validation ({path})")
+        if split['label_conflicts']:
+            print(f"[{name}] {split['label_conflicts']} near-identical image pairs have different labels")
+
+def main():
+    parser = argparse.ArgumentParser(description='Index the training images and build deduplicated splits')
+    parser.add_argument('--jobs', nargs='+', choices=list(TRAINING_JOBS),
+                        help='Models to build splits for (default: all)')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--duplicate-distance', type=int, default=DEDUP_DUPLICATE_DISTANCE,
+                        help='Hamming distance (of 64 bits) at which images count as copies')
+    parser.add_argument('--group-distance', type=int, default=DEDUP_GROUP_DISTANCE,
+                        help='Hamming distance within which images stay on one side of the split')
+    args = parser.parse_args()
+    index_dataset(args.jobs, args.validation_split, args.duplicate_distance, args.group_distance)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import sys
 import os
 import argparse
+from datetime import date, timedelta
 from database.setup_database import setup_database
 
 
@@ -35,7 +36,28 @@ def main():
     parser = argparse.ArgumentParser(description='Water Bottle Defect Detection System')
     parser.add_argument('--setup-db', action='store_true', help='Set up database')
     parser.add_argument('--train', action='store_true', help='Train models')
+    parser.add_argument('--fine-tune', action='store_true',
+                        help='Fine-tune the model heads on operator-labelled production images')
+    parser.add_argument('--force', action='store_true',
+                        help='With --fine-tune, run even if no labels were added since the last run')
     parser.add_argument('--no-gui', action='store_true', help='Run without GUI (for testing)')
+    parser.add_argument('--migrate-images', action='store_true',
+                        help='Move image blobs from the bottles table into the image store')
+    parser.add_argument('--maintain-partitions', action='store_true',
+                        help='Create future partitions of the bottles table and apply retention')
+    parser.add_argument('--convert-partitions', action='store_true',
+                        help='With --maintain-partitions, first rebuild an unpartitioned bottles table as partitioned')
+    parser.add_argument('--export', metavar='FILE',
+                        help='Export bottles to FILE (.csv.gz, .jsonl.gz or .parquet)')
+    parser.add_argument('--print-labels', metavar='FILE',
+                        help='Write QR label sheets for bottles to FILE (.pdf, or .png for numbered pages)')
+    parser.add_argument('--from', dest='from_date', type=date.fromisoformat, metavar='DATE',
+                        help='First detection date to export/label (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='to_date', type=date.fromisoformat, metavar='DATE',
+                        help='Last detection date to export/label (YYYY-MM-DD)')
+    parser.add_argument('--defective-only', action='store_true', help='Export defective bottles only')
+    parser.add_argument('--rebuild-stats', nargs='+', type=date.fromisoformat, metavar='DATE',
+                        help='Rebuild daily statistics from the bottles table for START [END] (YYYY-MM-DD)')
 
     args = parser.parse_args()
 
@@ -44,16 +66,88 @@ def main():
         setup_database()
         return
 
+    if args.migrate_images:
+        from database.migrate_images import migrate_images
+        migrate_images()
+        return
+
+    if args.maintain_partitions:
+        from utils.database_handler import create_database_handler
+        database = create_database_handler(write_behind=False)
+        database.maintain_storage(convert=args.convert_partitions)
+        database.close()
+        return
+
+    filters = {
+        'start': args.from_date,
+        'end': args.to_date + timedelta(days=1) if args.to_date else None,
+        'defective_only': args.defective_only
+    }
+
+    if args.print_labels:
+        from utils.database_handler import create_database_handler
+        from utils.label_service import LabelService
+        database = create_database_handler(write_behind=False)
+        labels = LabelService()
+        try:
+            serials = (row['serial_number'] for rows in database.iter_bottles(**filters) for row in rows)
+            pages = labels.save_sheets(serials, args.print_labels)
+            print(f"Wrote {pages} label sheet(s) to {args.print_labels}")
+        except Exception as e:
+            print(f"Error printing labels: {e}")
+        finally:
+            labels.close()
+            database.close()
+        return
+
+    if args.export:
+        from utils.database_handler import create_database_handler
+        from utils.exporter import export_bottles
+        database = create_database_handler(write_behind=False)
+        try:
+            written = export_bottles(
+                database, args.export,
+                progress=lambda written, total: print(f"\rExported {written:,} of {total or 0:,} records",
+                                                      end='', flush=True),
+                **filters)
+            print(f"\nData exported to {args.export} ({written} records)")
+        except KeyboardInterrupt:
+            print("\nExport cancelled")
+        except Exception as e:
+            print(f"\nError exporting data: {e}")
+        finally:
+            database.close()
+        return
+
+    if args.rebuild_stats:
+        from utils.database_handler import create_database_handler
+        start_date = args.rebuild_stats[0]
+        end_date = args.rebuild_stats[-1]
+        database = create_database_handler(write_behind=False)
+        database.rebuild_daily_statistics(start_date, end_date)
+        database.close()
+        return
+
     # ✅ Allow training WITHOUT PyQt6
     if args.train:
         from train_models import train_models
         train_models()
         return
 
+    if args.fine_tune:
+        from utils.database_handler import create_database_handler
+        from utils.fine_tuning import FineTuner
+        database = create_database_handler(write_behind=False)
+        try:
+            FineTuner(database).run(force=args.force)
+        finally:
+            database.close()
+        return
+
     # ✅ Console mode WITHOUT PyQt6
     if args.no_gui:
         print("Running in console mode...")
-        from detector import BottleDefectDetector
+        from detector import BottleDefectDetector, InspectionPipeline
         from camera_stream import CameraStream
         import cv2
 
@@ -62,11 +156,13 @@ def main():
 
         if camera.start():
             print("Camera started. Press 'q' to quit, 's' to save current frame")
+            pipeline = InspectionPipeline(detector, camera)
+            pipeline.start()
             try:
                 while True:
-                    frame = camera.get_frame()
-                    if frame is not None:
-                        processed_frame, detection_data = detector.process_frame(frame)
+                    output = pipeline.next_frame(timeout=0.1)
+                    if output is not None:
+                        processed_frame, detection_data = output
 
                         if detection_data:
                             print(f"\nDetection: {detection_data['serial']}")
@@ -80,9 +176,10 @@ def main():
                         if key == ord('q'):
                             break
                         elif key == ord('s'):
-                            cv2.imwrite('capture.jpg', frame)
+                            cv2.imwrite('capture.jpg', processed_frame)
                             print("Frame saved as 'capture.jpg'")
             finally:
+                pipeline.stop()
                 camera.stop()
                 cv2.destroyAllWindows()
                 detector.close()
@@ -94,12 +191,14 @@ def main():
 
     app = QApplication(sys.argv)
 
-    # Database check
+    # Database check (the embedded SQLite backend needs no server)
     try:
-        import mysql.connector
-        from config import DB_CONFIG
-        conn = mysql.connector.connect(**DB_CONFIG)
-        conn.close()
+        from config import DB_BACKEND
+        if DB_BACKEND == 'mysql':
+            import mysql.connector
+            from config import DB_CONFIG
+            conn = mysql.connector.connect(**DB_CONFIG)
+            conn.close()
     except Exception as e:
         reply = QMessageBox.question(
             None,
@@ -0,0 +1,84 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.model_registry import ModelRegistry
+from config import MODELS_DIR, MODEL_VARIANT, MODEL_REGISTRY_POLL_SECONDS
+
+def publish(variant=MODEL_VARIANT, min_accuracy=None, evaluate=True, activate=True):
+    """Register the models in models/ as a new version, evaluate it and put it into service"""
+    registry = ModelRegistry()
+    version = registry.publish(MODELS_DIR, variant)
+    print(f"Published model version {version} ({variant})")
+
+    if evaluate:
+        # Evaluate the registered copy itself, before it goes into service
+        from utils.evaluation import evaluate_models
+        report = evaluate_models(models_dir=registry.version_dir(version), variant=variant,
+                                 report_path=os.path.join(registry.version_dir(version), 'evaluation.json'))
+        if report is None:
+            print(f"Version {version} could not be evaluated and was not activated")
+            return False
+        throughput = report.get('throughput') or {}
+        registry.set_metrics(version, {
+            'accuracy': {name: metrics['accuracy'] for name, metrics in report['models'].items()},
+            'recommended_threshold': report['recommended_threshold'],
+            'images_per_second': throughput.get('images_per_second'),
+            'images': report['images']
+        })
+        below = [name for name, metrics in report['models'].items()
+                 if min_accuracy is not None and metrics['accuracy'] < min_accuracy]
+        if below:
+            print(f"Version {version} not activated: below {min_accuracy:.2%} accuracy on {', '.join(below)}")
+            return False
+
+    if activate:
+        registry.activate(version)
+        print(f"Version {version} is active; running detectors switch to it within "
+              f"{MODEL_REGISTRY_POLL_SECONDS}s")
+    return True
+
+def list_versions():
+    registry = ModelRegistry()
+    current = registry.current()
+    for version in registry.versions():
+        metadata = registry.metadata(version)
+        accuracy = ' '.join(f"{name}={value:.2%}" for name, value in
+                            ((metadata.get('metrics') or {}).get('accuracy') or {}).items())
+        marker = '*' if version == current else '!' if registry.is_failed(version) else ' '
+        print(f"{marker} {version}  {metadata['variant']:8} {metadata['created']}  {accuracy}")
+    print("* active  ! failed to load")
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the versioned models used by the detector')
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish_parser = commands.add_parser('publish', help='Register, evaluate and activate the models in models/')
+    publish_parser.add_argument('--variant', choices=['teacher', 'student'], default=MODEL_VARIANT)
+    publish_parser.add_argument('--min-accuracy', type=float,
+                                help='Do not activate if any model is less accurate than this')
+    publish_parser.add_argument('--no-evaluate', action='store_true', help='Skip the evaluation')
+    publish_parser.add_argument('--no-activate', action='store_true', help='Register only')
+    commands.add_parser('list', help='List model versions')
+    activate_parser = commands.add_parser('activate', help='Put a version into service')
+    activate_parser.add_argument('version')
+    commands.add_parser('rollback', help='Return to the previously active version')
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == 'publish':
+        if not publish(args.variant, args.min_accuracy, not args.no_evaluate, not args.no_activate):
+            sys.exit(1)
+    elif args.command == 'list':
+        list_versions()
+    elif args.command == 'activate':
+        registry.activate(args.version)
+        print(f"Version {args.version} is active")
+    elif args.command == 'rollback':
+        version = registry.rollback()
+        print(f"Rolled back to version {version}" if version else "No earlier version to roll back to")
+        if version is None:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
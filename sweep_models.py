@@ -0,0 +1,34 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.model_sweep import run_sweep
+from utils.training import TRAINING_JOBS
+from config import DATA_DIR, EPOCHS, SWEEP_IMG_SIZES, SWEEP_ALPHAS, SWEEP_WORKERS, SWEEP_LATENCY_CORES
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure accuracy and latency of smaller classifier variants')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SWEEP_IMG_SIZES),
+                        help='Input sizes in pixels (default: %(default)s)')
+    parser.add_argument('--alphas', nargs='+', type=float, default=list(SWEEP_ALPHAS),
+                        help='MobileNetV2 width multipliers (default: %(default)s)')
+    parser.add_argument('--jobs', nargs='+', choices=list(TRAINING_JOBS),
+                        help='Models to evaluate (default: all)')
+    parser.add_argument('--workers', type=int, default=SWEEP_WORKERS, help='Trials run in parallel')
+    parser.add_argument('--latency-cores', type=int, default=SWEEP_LATENCY_CORES,
+                        help='CPU cores latency is measured on (default: %(default)s)')
+    parser.add_argument('--epochs', type=int, default=EPOCHS, help='Maximum head epochs per trial')
+    parser.add_argument('--min-accuracy', type=float,
+                        help='Accuracy spec, e.g. 0.95: report the fastest variant meeting it')
+    args = parser.parse_args()
+
+    train_data_dir = DATA_DIR / "train"
+    if not os.path.exists(train_data_dir):
+        print(f"Training data directory not found: {train_data_dir}")
+        return
+    run_sweep(train_data_dir, args.sizes, args.alphas, args.jobs, args.workers, args.latency_cores,
+              args.epochs, args.min_accuracy)
+
+if __name__ == "__main__":
+    main()
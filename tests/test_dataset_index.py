@@ -0,0 +1,70 @@
+import random
+from utils.dataset_index import MultiIndexHash, build_split, hamming
+
+
+class FakeIndex:
+    root = 'data'
+
+    def __init__(self, images):
+        self._images = images
+
+    def images(self, task):
+        return self._images
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_search_matches_brute_force():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # Near neighbours of the first few values, spread over every substring
+    values += [flip(values[i], *rng.sample(range(64), rng.randint(1, 12))) for i in range(50)]
+    index = MultiIndexHash()
+    for position, value in enumerate(values):
+        index.add(value, position)
+
+    for radius in (0, 3, 4, 10, 12):
+        for query in values[:60]:
+            expected = sorted((hamming(query, other), position) for position, other in enumerate(values)
+                              if hamming(query, other) <= radius)
+            assert sorted(index.search(query, radius)) == expected
+
+
+def test_build_split_drops_duplicates_and_keeps_groups_together():
+    rng = random.Random(3)
+    images = []
+    for label in (0, 1):
+        for i in range(20):
+            images.append((f"class{label}/img{i:02d}.jpg", label, rng.getrandbits(64)))
+    # A near-identical copy of the same class is dropped
+    images.append(('class0/img00_copy.jpg', 0, flip(images[0][2], 1)))
+    # A near-identical image of the other class is a label conflict, not a duplicate
+    images.append(('class1/img00_conflict.jpg', 1, flip(images[1][2], 2)))
+    # Augmented copies of one source photo stay on one side
+    for suffix in ('aaaa', 'bbbb', 'cccc'):
+        images.append((f"class0/photo_jpg.rf.{suffix}.jpg", 0, rng.getrandbits(64)))
+
+    split = build_split(FakeIndex(images), 'water_level', validation_split=0.25)
+
+    assert split['duplicates'] == ['class0/img00_copy.jpg']
+    assert split['duplicates_dropped'] == 1
+    assert split['label_conflicts'] == 1
+    train = {path for path, _ in split['train']}
+    val = {path for path, _ in split['val']}
+    assert not train & val
+    assert len(train) + len(val) == len(images) - 1
+    copies = {f"class0/photo_jpg.rf.{suffix}.jpg" for suffix in ('aaaa', 'bbbb', 'cccc')}
+    assert copies <= train or copies <= val
+    for label in (0, 1):
+        total = sum(1 for path, _, _ in images if path.startswith(f"class{label}/")) - (label == 0)
+        assert sum(1 for _, value in split['val'] if value == label) <= round(total * 0.25)
+
+
+def test_build_split_is_stable():
+    rng = random.Random(5)
+    images = [(f"class{i % 2}/img{i:02d}.jpg", i % 2, rng.getrandbits(64)) for i in range(40)]
+    assert build_split(FakeIndex(images), 'shape') == build_split(FakeIndex(list(reversed(images))), 'shape')
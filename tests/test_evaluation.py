@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from utils.evaluation import classification_metrics, defect_detection, tune_threshold
+
+
+def test_classification_metrics():
+    labels = np.array([0, 0, 1, 1, 2])
+    probabilities = np.array([[0.9, 0.1, 0.0],
+                              [0.2, 0.7, 0.1],
+                              [0.1, 0.8, 0.1],
+                              [0.1, 0.6, 0.3],
+                              [0.5, 0.2, 0.3]])
+    metrics = classification_metrics(labels, probabilities, ['empty', 'full', 'half'])
+
+    assert metrics['images'] == 5
+    assert metrics['accuracy'] == pytest.approx(0.6)
+    assert metrics['confusion_matrix'] == [[1, 1, 0], [0, 2, 0], [1, 0, 0]]
+    assert metrics['classes']['empty'] == {'precision': 0.5, 'recall': 0.5, 'f1': 0.5, 'support': 2}
+    assert metrics['classes']['full']['precision'] == pytest.approx(2 / 3)
+    assert metrics['classes']['full']['recall'] == 1.0
+    # Never predicted: no precision, and no F1 without it
+    assert metrics['classes']['half'] == {'precision': None, 'recall': 0.0, 'f1': None, 'support': 1}
+
+
+def test_tune_threshold_keeps_target_recall():
+    is_defect = np.array([True, True, True, True, False, False])
+    flagged = np.array([True, True, True, False, True, False])
+    confidence = np.array([0.95, 0.6, 0.8, 0.9, 0.7, 0.99])
+
+    threshold = tune_threshold(is_defect, flagged, confidence, 0.5)
+    assert 0.8 > threshold > 0.6
+    assert defect_detection(is_defect, flagged, confidence, threshold)['recall'] == 0.5
+
+    threshold = tune_threshold(is_defect, flagged, confidence, 0.75)
+    assert threshold < 0.6
+    assert defect_detection(is_defect, flagged, confidence, threshold)['recall'] == 0.75
+
+
+def test_tune_threshold_unreachable():
+    is_defect = np.array([True, True, False])
+    flagged = np.array([True, False, True])
+    confidence = np.array([0.9, 0.9, 0.9])
+    # Only one of the two defects is ever flagged
+    assert tune_threshold(is_defect, flagged, confidence, 0.9) is None
+    assert tune_threshold(np.array([False]), np.array([True]), np.array([0.9]), 0.9) is None
@@ -0,0 +1,24 @@
+from utils.model_sweep import pareto_front
+
+
+def variant(size, alpha, latency_ms, min_accuracy):
+    return {'size': size, 'alpha': alpha, 'latency_ms': latency_ms, 'min_accuracy': min_accuracy}
+
+
+def test_pareto_front():
+    results = [
+        variant(224, 1.0, 40.0, 0.95),
+        variant(160, 0.75, 20.0, 0.93),
+        variant(192, 1.0, 30.0, 0.90),   # slower and less accurate than 160 x0.75
+        variant(96, 0.35, 5.0, 0.80),
+        variant(128, 0.5, 10.0, 0.80),   # as accurate as 96 x0.35 but slower
+        variant(224, 1.4, 60.0, 0.95),   # as accurate as 224 x1.0 but slower
+    ]
+    front = pareto_front(results)
+    assert [(result['size'], result['alpha']) for result in front] == [(96, 0.35), (160, 0.75), (224, 1.0)]
+
+
+def test_pareto_front_same_latency_keeps_most_accurate():
+    front = pareto_front([variant(96, 0.35, 5.0, 0.7), variant(96, 0.5, 5.0, 0.8)])
+    assert [result['alpha'] for result in front] == [0.5]
+    assert pareto_front([]) == []
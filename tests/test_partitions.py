@@ -0,0 +1,45 @@
+from datetime import date
+from database.partitions import (from_days, next_period, partition_bounds, partition_definitions, partition_name,
+                                 period_start, to_days)
+
+
+def test_to_days_matches_mysql():
+    # Example from the MySQL manual: TO_DAYS('2007-10-07') = 733321
+    assert to_days(date(2007, 10, 7)) == 733321
+    assert from_days(733321) == date(2007, 10, 7)
+    assert from_days(to_days(date(2025, 2, 28))) == date(2025, 2, 28)
+
+
+def test_period_start():
+    assert period_start(date(2024, 2, 29), 'monthly') == date(2024, 2, 1)
+    assert period_start(date(2024, 2, 29), 'daily') == date(2024, 2, 29)
+
+
+def test_next_period():
+    assert next_period(date(2024, 1, 1), 'monthly') == date(2024, 2, 1)
+    assert next_period(date(2024, 12, 1), 'monthly') == date(2025, 1, 1)
+    assert next_period(date(2024, 2, 28), 'daily') == date(2024, 2, 29)
+    assert next_period(date(2024, 12, 31), 'daily') == date(2025, 1, 1)
+
+
+def test_partition_name():
+    assert partition_name(date(2024, 3, 1), 'monthly') == 'p202403'
+    assert partition_name(date(2024, 3, 7), 'daily') == 'p20240307'
+
+
+def test_partition_bounds_cover_range_without_gaps():
+    bounds = partition_bounds(date(2024, 11, 15), date(2025, 2, 1), 'monthly')
+    assert [name for name, _, _ in bounds] == ['p202411', 'p202412', 'p202501', 'p202502']
+    assert bounds[0][1] == date(2024, 11, 1)
+    assert bounds[-1][2] == date(2025, 3, 1)
+    for (_, _, end), (_, start, _) in zip(bounds, bounds[1:]):
+        assert end == start
+
+    daily = partition_bounds(date(2024, 2, 28), date(2024, 3, 1), 'daily')
+    assert [name for name, _, _ in daily] == ['p20240228', 'p20240229', 'p20240301']
+
+
+def test_partition_definitions():
+    definitions = partition_definitions(partition_bounds(date(2024, 1, 1), date(2024, 1, 1), 'monthly'))
+    assert f"PARTITION p202401 VALUES LESS THAN ({to_days(date(2024, 2, 1))})" in definitions
+    assert definitions.endswith("PARTITION p_future VALUES LESS THAN MAXVALUE")
@@ -0,0 +1,64 @@
+import threading
+import pytest
+from utils.pipeline import BLOCK, DROP_NEWEST, DROP_OLDEST, StageQueue
+
+
+def drain(queue):
+    items = []
+    while queue.qsize():
+        items.append(queue.get(timeout=0))
+    return items
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        StageQueue('frames', 2, policy='drop_all')
+
+
+def test_drop_oldest_keeps_newest_items():
+    queue = StageQueue('frames', 2, policy=DROP_OLDEST)
+    assert all(queue.put(item) for item in range(5))
+    assert queue.dropped == 3
+    assert drain(queue) == [3, 4]
+
+
+def test_drop_newest_rejects_new_items():
+    queue = StageQueue('frames', 2, policy=DROP_NEWEST)
+    assert [queue.put(item) for item in range(4)] == [True, True, False, False]
+    assert queue.dropped == 2
+    assert drain(queue) == [0, 1]
+
+
+def test_block_waits_for_space():
+    queue = StageQueue('results', 1, policy=BLOCK)
+    queue.put(0)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(queue.put(1)))
+    producer.start()
+    producer.join(timeout=0.2)
+    assert producer.is_alive()
+    assert queue.get(timeout=1) == 0
+    producer.join(timeout=1)
+    assert results == [True]
+    assert queue.get(timeout=1) == 1
+    assert queue.dropped == 0
+
+
+def test_close_wakes_blocked_producer_and_consumer():
+    queue = StageQueue('results', 1, policy=BLOCK)
+    queue.put(0)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(queue.put(1)))
+    producer.start()
+    producer.join(timeout=0.1)
+    queue.close()
+    producer.join(timeout=1)
+    assert results == [False]
+    assert not queue.put(2)
+    # Queued items are still handed out after close, then get returns None
+    assert queue.get(timeout=1) == 0
+    assert queue.get(timeout=1) is None
+
+
+def test_get_times_out():
+    assert StageQueue('frames', 1).get(timeout=0.01) is None
@@ -0,0 +1,110 @@
+import json
+import threading
+from utils.serial_allocator import SerialAllocator
+
+
+class FakeDatabaseError(Exception):
+    pass
+
+
+class FakeDatabase:
+    DATABASE_ERRORS = (FakeDatabaseError,)
+
+    def __init__(self, next_serial=1, stored=()):
+        self.next_serial = next_serial
+        self.stored = list(stored)
+        self.available = True
+        self.leases = 0
+        self._lock = threading.Lock()
+
+    def lease_serial_block(self, station_id, block_size):
+        if not self.available:
+            raise FakeDatabaseError("database is down")
+        with self._lock:
+            first = self.next_serial
+            self.next_serial += block_size
+            self.leases += 1
+        return first, first + block_size
+
+    def highest_serial(self, first_serial, last_serial):
+        found = [serial for serial in self.stored if first_serial <= serial <= last_serial]
+        return max(found) if found else None
+
+    def advance_serial_counter(self, station_id, next_serial):
+        self.next_serial = max(self.next_serial, next_serial)
+
+
+def allocator(database, tmp_path, **kwargs):
+    options = {'station_id': 'S01', 'block_size': 10, 'prefetch_threshold': 3, 'checkpoint_interval': 4,
+               'state_path': tmp_path / 'serial_state.json'}
+    options.update(kwargs)
+    return SerialAllocator(database, **options)
+
+
+def number(serial):
+    return int(serial.rsplit('-', 1)[1])
+
+
+def test_serials_are_unique_and_increasing(tmp_path):
+    database = FakeDatabase()
+    serials = allocator(database, tmp_path)
+    numbers = [number(serials.next_serial()) for _ in range(35)]
+    serials.close()
+    assert numbers == sorted(set(numbers))
+    assert database.leases >= 4
+    assert serials.next_serial().startswith('BTL-S01-')
+
+
+def test_stations_sharing_a_database_do_not_overlap(tmp_path):
+    database = FakeDatabase()
+    first = allocator(database, tmp_path, state_path=tmp_path / 'first.json')
+    second = allocator(database, tmp_path, state_path=tmp_path / 'second.json')
+    numbers = [number(serials.next_serial()) for _ in range(25) for serials in (first, second)]
+    first.close()
+    second.close()
+    assert len(numbers) == len(set(numbers))
+
+
+def test_restart_resumes_without_reusing(tmp_path):
+    database = FakeDatabase()
+    serials = allocator(database, tmp_path)
+    handed_out = [number(serials.next_serial()) for _ in range(5)]
+    serials.close()
+    leases = database.leases
+
+    # A crash loses what was handed out since the last checkpoint; those are skipped
+    restarted = allocator(database, tmp_path)
+    resumed = number(restarted.next_serial())
+    restarted.close()
+    assert resumed > max(handed_out)
+    assert resumed <= max(handed_out) + 4
+    state = json.loads((tmp_path / 'serial_state.json').read_text())
+    assert state['station_id'] == 'S01'
+    assert database.leases - leases <= 1
+
+
+def test_state_of_another_station_is_ignored(tmp_path):
+    database = FakeDatabase()
+    serials = allocator(database, tmp_path, station_id='S01')
+    serials.next_serial()
+    serials.close()
+    other = allocator(database, tmp_path, station_id='S02')
+    assert other.next_serial().startswith('BTL-S02-')
+    other.close()
+
+
+def test_skips_past_stored_serials(tmp_path):
+    # The counter was reset but bottles up to 120 are already stored
+    database = FakeDatabase(stored=['BTL-S01-0000000120', 'BTL-S02-0000000900'])
+    serials = allocator(database, tmp_path)
+    assert number(serials.next_serial()) == 121
+    serials.close()
+
+
+def test_database_down(tmp_path):
+    database = FakeDatabase()
+    database.available = False
+    serials = allocator(database, tmp_path)
+    assert serials.next_serial() is None
+    assert serials.get_metrics()['lease_failures'] >= 1
+    serials.close()
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from utils.image_store import ImageStore
+from utils.live_statistics import LiveStatistics
+from utils.sqlite_handler import SQLiteDatabaseHandler
+
+IMAGE = np.zeros((8, 8, 3), dtype=np.uint8)
+
+# (water level, shape status) -> defective
+BOTTLES = [('full', 'perfect'), ('low', 'perfect'), ('overflow', 'perfect'), ('full', 'defective'),
+           ('full', 'perfect')]
+
+
+@pytest.fixture
+def open_database(tmp_path):
+    handlers = []
+
+    def open_database(write_behind):
+        database = SQLiteDatabaseHandler(write_behind=write_behind, path=tmp_path / 'bottles.db')
+        database.image_store = ImageStore(tmp_path / 'images')
+        handlers.append(database)
+        return database
+
+    yield open_database
+    for database in handlers:
+        database.close()
+
+
+def save(database, serials):
+    for i, serial in enumerate(serials):
+        water_level, shape_status = BOTTLES[i % len(BOTTLES)]
+        database.save_bottle_data(serial, water_level, shape_status, 0.9, IMAGE)
+
+
+def test_write_behind_counts(open_database):
+    database = open_database(write_behind=True)
+    live = LiveStatistics(database)
+    save(database, [f"BTL-S01-{i:010d}" for i in range(10)])
+
+    # Counted while still queued
+    today, overall = live.get_statistics()
+    assert (today['total_today'], today['defective_today']) == (10, 6)
+
+    database.stop_writer()
+    assert database.write_stats['rows_written'] == 10
+    assert database.write_stats['rows_failed'] == 0
+    assert live.pending == {datetime.now().date(): [0, 0]}
+
+    today, overall = database.get_statistics()
+    assert (today['total_today'], today['perfect_today'], today['defective_today']) == (10, 4, 6)
+    assert overall['total'] == 10
+    totals, _ = database.get_statistics_totals()
+    assert totals['total_today'] == 10
+
+    assert live.reconcile()
+    assert live.get_statistics() == database.get_statistics_totals()
+
+    rows = database.get_rollups('minute', datetime.now() - timedelta(minutes=5))
+    assert sum(row['total_bottles'] for row in rows) == 10
+    assert sum(row['defective_bottles'] for row in rows) == 6
+    assert sum(row['low_count'] for row in rows) == 2
+    assert sum(row['overflow_count'] for row in rows) == 2
+    assert sum(row['shape_defective_count'] for row in rows) == 2
+    rows = database.get_rollups('hour', datetime.now() - timedelta(hours=2))
+    assert sum(row['confidence_sum'] for row in rows) == pytest.approx(9.0)
+
+
+def test_duplicate_serial_fails_only_its_row(open_database):
+    database = open_database(write_behind=True)
+    live = LiveStatistics(database)
+    save(database, ['BTL-S01-0000000001', 'BTL-S01-0000000002', 'BTL-S01-0000000001', 'BTL-S01-0000000003'])
+    database.stop_writer()
+
+    assert database.write_stats['rows_written'] == 3
+    assert database.write_stats['rows_failed'] == 1
+    assert database.count_bottles() == 3
+    # The rejected bottle is dropped from the live counts too
+    today, _ = live.get_statistics()
+    assert today['total_today'] == 3
+    totals, _ = database.get_statistics_totals()
+    assert totals['total_today'] == 3
+
+
+def test_bottle_pages(open_database):
+    database = open_database(write_behind=False)
+    # Bottles saved within the same timestamp are ordered by id
+    save(database, [f"BTL-S01-{i:010d}" for i in range(25)])
+
+    pages = []
+    before = None
+    while True:
+        page = database.get_bottle_page(before=before, limit=10)
+        if not page:
+            break
+        pages.append(page)
+        before = (page[-1]['detection_date'], page[-1]['id'])
+    assert [len(page) for page in pages] == [10, 10, 5]
+    rows = [row for page in pages for row in page]
+    keys = [(row['detection_date'], row['id']) for row in rows]
+    assert keys == sorted(keys, reverse=True)
+    assert len({row['serial_number'] for row in rows}) == 25
+
+    newest = (rows[0]['detection_date'], rows[0]['id'])
+    assert database.get_bottle_page(after=newest) == []
+    save(database, [f"BTL-S01-{i:010d}" for i in range(25, 30)])
+    # After pages hold the oldest of the newer rows, still newest first
+    page = database.get_bottle_page(after=newest, limit=3)
+    assert [row['serial_number'] for row in page] == [f"BTL-S01-{i:010d}" for i in (27, 26, 25)]
+
+    page = database.get_bottle_page(limit=10, water_level='low')
+    assert {row['water_level'] for row in page} == {'low'}
+    assert len(page) == 6
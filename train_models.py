@@ -1,62 +1,70 @@
 import sys
 import os
+import argparse
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from utils.model_loader import BottleDetectorModels
-from config import DATA_DIR
-import matplotlib.pyplot as plt
-
-def plot_training_history(history, title):
-    """Plot training history"""
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 4))
-    
-    # Plot accuracy
-    ax1.plot(history.history['accuracy'], label='Training Accuracy')
-    ax1.plot(history.history['val_accuracy'], label='Validation Accuracy')
-    ax1.set_title(f'{title} - Accuracy')
-    ax1.set_xlabel('Epoch')
-    ax1.set_ylabel('Accuracy')
-    ax1.legend()
-    ax1.grid(True)
-    
-    # Plot loss
-    ax2.plot(history.history['loss'], label='Training Loss')
-    ax2.plot(history.history['val_loss'], label='Validation Loss')
-    ax2.set_title(f'{title} - Loss')
-    ax2.set_xlabel('Epoch')
-    ax2.set_ylabel('Loss')
-    ax2.legend()
-    ax2.grid(True)
-    
-    plt.tight_layout()
-    plt.savefig(f'{title.lower().replace(" ", "_")}_training.png')
-    plt.show()
+from utils.training import TRAINING_JOBS, train_in_parallel
+from config import DATA_DIR, EPOCHS, TRAINING_CORES, TRAINING_MAX_MINUTES
 
-def main():
+def train_models(jobs=None, allotments=TRAINING_CORES, epochs=EPOCHS, resume=False, max_minutes=TRAINING_MAX_MINUTES):
+    """Train the classifiers side by side and save them to models/"""
     print("Starting model training...")
-    
-    # Initialize models
-    detector = BottleDetectorModels()
-    
+
     # Train models
     train_data_dir = DATA_DIR / "train"
-    
+
     if not os.path.exists(train_data_dir):
         print(f"Training data directory not found: {train_data_dir}")
         print("Please organize your images in the following structure:")
         print("data/train/water_level/[full, overflow, low]/")
         print("data/train/shape/[perfect, defective]/")
         return
-    
-    print("Training water level model...")
-    water_history, shape_history = detector.train_models(str(train_data_dir))
-    
-    # Plot training history
-    plot_training_history(water_history, "Water Level Model")
-    plot_training_history(shape_history, "Shape Model")
-    
-    print("Training completed successfully!")
-    print("Models saved in 'models/' directory")
+
+    histories = train_in_parallel(str(train_data_dir), jobs=jobs, allotments=allotments, epochs=epochs,
+                                  resume=resume, max_minutes=max_minutes)
+
+    if histories:
+        print("Training completed successfully!")
+        print("Models saved in 'models/' directory")
+
+        # Report how the new models do on the held-out images. They go into
+        # service only once published (manage_models.py publish)
+        from utils.evaluation import evaluate_models
+        evaluate_models()
+        print("Run 'python manage_models.py publish' to put them into service")
+    return histories
+
+def parse_cores(values):
+    """['shape=4', ...] -> {'shape': 4}"""
+    allotments = dict(TRAINING_CORES)
+    for value in values or []:
+        name, _, count = value.partition('=')
+        allotments[name] = int(count)
+    return allotments
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the bottle classifiers')
+    parser.add_argument('--jobs', nargs='+', choices=list(TRAINING_JOBS),
+                        help='Models to train (default: all)')
+    parser.add_argument('--cores', nargs='+', metavar='MODEL=N',
+                        help='CPU cores for a model, e.g. --cores water_level=10 shape=6')
+    parser.add_argument('--epochs', type=int, default=EPOCHS, help=f'Maximum epochs per model (default: {EPOCHS})')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue each model from its last checkpoint instead of starting over')
+    parser.add_argument('--max-minutes', type=float, default=TRAINING_MAX_MINUTES,
+                        help='Stop training before an epoch that would run past this many minutes')
+    parser.add_argument('--distill', action='store_true',
+                        help='Train the compact student from the current models instead')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare accuracy, latency and size of the student and the full models')
+    args = parser.parse_args()
+    if args.distill or args.compare:
+        from utils.distillation import compare_models, distill_student
+        if args.distill:
+            distill_student(epochs=args.epochs, resume=args.resume, max_minutes=args.max_minutes)
+        compare_models()
+        return
+    train_models(args.jobs, parse_cores(args.cores), args.epochs, args.resume, args.max_minutes)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import time
+import tensorflow as tf
+from config import (EARLY_STOPPING_MONITOR, EARLY_STOPPING_PATIENCE, EARLY_STOPPING_MIN_DELTA, LR_PATIENCE,
+                    LR_FACTOR, MIN_LEARNING_RATE)
+
+
+class TrainingCheckpoint(tf.keras.callbacks.Callback):
+    """Early stopping, learning-rate reduction, checkpoints and a time budget.
+
+    Keras' own callbacks start their patience counters from scratch on every
+    fit, so they are combined here with their state (epoch, best value,
+    epochs without improvement, learning rate, history) written next to the
+    checkpoint after every epoch. A resumed run continues exactly where the
+    interrupted one stopped.
+
+    The directory holds last.h5 (model and optimizer after the latest epoch),
+    best_weights.h5 (weights of the best epoch) and state.json.
+    """
+
+    def __init__(self, directory, monitor=EARLY_STOPPING_MONITOR, patience=EARLY_STOPPING_PATIENCE,
+                 min_delta=EARLY_STOPPING_MIN_DELTA, lr_patience=LR_PATIENCE, lr_factor=LR_FACTOR,
+                 min_lr=MIN_LEARNING_RATE, deadline=None):
+        super().__init__()
+        self.directory = str(directory)
+        self.last_path = os.path.join(self.directory, 'last.h5')
+        self.best_path = os.path.join(self.directory, 'best_weights.h5')
+        self.state_path = os.path.join(self.directory, 'state.json')
+        self.monitor = monitor
+        self.maximize = 'acc' in monitor
+        self.patience = patience
+        self.min_delta = min_delta
+        self.lr_patience = lr_patience
+        self.lr_factor = lr_factor
+        self.min_lr = min_lr
+        self.deadline = deadline  # time.time() by which training must stop
+        self.epoch_seconds = []
+        self.epoch_started = None
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable checkpoint state {self.state_path}: {e}")
+            return None
+
+    def can_resume(self):
+        return self.state is not None and os.path.exists(self.last_path)
+
+    def finished(self, epochs):
+        """Whether a resumed run has nothing left to do"""
+        return self.state['epoch'] >= epochs or self.state['stop_reason'] == 'early_stopping'
+
+    def reset(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        self.state = {
+            'epoch': 0,
+            'monitor': self.monitor,
+            'best': None,
+            'best_epoch': None,
+            'wait': 0,
+            'lr_wait': 0,
+            'learning_rate': None,
+            'stop_reason': None,
+            'history': {}
+        }
+
+    def _improved(self, value):
+        best = self.state['best']
+        if best is None:
+            return True
+        if self.maximize:
+            return value > best + self.min_delta
+        return value < best - self.min_delta
+
+    def _stop(self, reason):
+        self.state['stop_reason'] = reason
+        self.model.stop_training = True
+
+    def on_train_begin(self, logs=None):
+        self.state['stop_reason'] = None
+        if self.state['learning_rate'] is not None:
+            tf.keras.backend.set_value(self.model.optimizer.learning_rate, self.state['learning_rate'])
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_started = time.monotonic()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs if logs is not None else {}
+        state = self.state
+        learning_rate = float(tf.keras.backend.get_value(self.model.optimizer.learning_rate))
+        logs['learning_rate'] = learning_rate
+        for key, value in logs.items():
+            state['history'].setdefault(key, []).append(float(value))
+        state['epoch'] = epoch + 1
+
+        value = logs.get(self.monitor)
+        if value is None or self._improved(value):
+            state['best'] = None if value is None else float(value)
+            state['best_epoch'] = epoch + 1
+            state['wait'] = 0
+            state['lr_wait'] = 0
+            temp_path = self.best_path + '.tmp.h5'
+            self.model.save_weights(temp_path)
+            os.replace(temp_path, self.best_path)
+        else:
+            state['wait'] += 1
+            state['lr_wait'] += 1
+            if state['lr_wait'] >= self.lr_patience and learning_rate > self.min_lr:
+                learning_rate = max(learning_rate * self.lr_factor, self.min_lr)
+                tf.keras.backend.set_value(self.model.optimizer.learning_rate, learning_rate)
+                state['lr_wait'] = 0
+            if state['wait'] >= self.patience:
+                self._stop('early_stopping')
+        state['learning_rate'] = learning_rate
+
+        # Stop when the next epoch would not finish within the budget. Only
+        # checked here: an epoch cut short would be recorded as complete
+        self.epoch_seconds.append(time.monotonic() - self.epoch_started)
+        if self.deadline is not None and time.time() + max(self.epoch_seconds) > self.deadline:
+            if state['stop_reason'] is None:
+                self._stop('time_budget')
+
+        self._save()
+
+    def _save(self):
+        # The model goes first: state never refers to an epoch not on disk
+        temp_path = self.last_path + '.tmp.h5'
+        self.model.save(temp_path)
+        os.replace(temp_path, self.last_path)
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def restore_best(self, model):
+        if os.path.exists(self.best_path):
+            model.load_weights(self.best_path)
@@ -1,136 +1,922 @@
 import mysql.connector
 from mysql.connector import Error
-from datetime import datetime
+from mysql.connector import errors as mysql_errors
+from mysql.connector import pooling
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import threading
+import time
 import cv2
 import numpy as np
-from config import DB_CONFIG
-import qrcode
-from PIL import Image
-import io
+from config import (DB_BACKEND, DB_CONFIG, DB_WRITE_BEHIND, DB_WRITE_QUEUE_SIZE, DB_BATCH_SIZE,
+                    DB_FLUSH_INTERVAL, DB_RETRY_DELAY, DB_RETRY_MAX_DELAY, DB_SHUTDOWN_RETRIES,
+                    DB_POOL_SIZE, DB_POOL_TIMEOUT, EXPORT_CHUNK_SIZE,
+                    HISTORY_PAGE_SIZE, ROLLUP_MINUTE_RETENTION_DAYS)
+from utils.pipeline import StageQueue, BLOCK
+from utils.image_store import ImageStore
+from utils.performance import RollingStats
+from utils.serial_allocator import SerialAllocator
+from utils.label_service import make_qr_image
+from database.partitions import maintain_partitions
+
+# Errors after which the connection is re-established and the batch retried;
+# PoolError is a checkout timeout while every pooled connection is busy
+CONNECTION_ERRORS = (mysql_errors.InterfaceError, mysql_errors.OperationalError, mysql_errors.PoolError)
+
+# Rollup resolution -> (table, bucket width)
+ROLLUP_RESOLUTIONS = {
+    'minute': ('rollup_minute', timedelta(minutes=1)),
+    'hour': ('rollup_hour', timedelta(hours=1))
+}
+
+def rollup_bucket(detected_at, resolution):
+    """Start of the rollup bucket containing a detection time"""
+    if resolution == 'minute':
+        return detected_at.replace(second=0, microsecond=0)
+    return detected_at.replace(minute=0, second=0, microsecond=0)
+
+def is_defective_bottle(water_level, shape_status):
+    """A bottle is defective if its water level is wrong or its shape is defective"""
+    return water_level in ['low', 'overflow'] or shape_status == 'defective'
 
 class DatabaseHandler:
-    def __init__(self):
-        self.connection = None
+    """MySQL storage backend (see create_database_handler for selecting one)"""
+
+    # Error types raised by this backend's driver
+    DATABASE_ERRORS = Error
+    CONNECTION_ERRORS = CONNECTION_ERRORS
+
+    INSERT_BOTTLE_QUERY = """
+    INSERT INTO bottles (serial_number, detection_date, water_level, shape_status,
+                        confidence_score, image_path, is_defective)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """
+
+    # O(1) per bottle: add the batch's counts to the day's counters
+    INCREMENT_STATISTICS_QUERY = """
+    INSERT INTO defect_statistics (date, total_bottles, defective_bottles, perfect_bottles,
+                                   overflow_count, low_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        total_bottles = total_bottles + VALUES(total_bottles),
+        defective_bottles = defective_bottles + VALUES(defective_bottles),
+        perfect_bottles = perfect_bottles + VALUES(perfect_bottles),
+        overflow_count = overflow_count + VALUES(overflow_count),
+        low_count = low_count + VALUES(low_count)
+    """
+
+    DELETE_STATISTICS_QUERY = "DELETE FROM defect_statistics WHERE date >= %s AND date <= %s"
+
+    REBUILD_STATISTICS_QUERY = """
+    INSERT INTO defect_statistics (date, total_bottles, defective_bottles, perfect_bottles,
+                                   overflow_count, low_count)
+    SELECT
+        DATE(detection_date) as date,
+        COUNT(*) as total_bottles,
+        SUM(CASE WHEN is_defective = TRUE THEN 1 ELSE 0 END) as defective_bottles,
+        SUM(CASE WHEN is_defective = FALSE THEN 1 ELSE 0 END) as perfect_bottles,
+        SUM(CASE WHEN water_level = 'overflow' THEN 1 ELSE 0 END) as overflow_count,
+        SUM(CASE WHEN water_level = 'low' THEN 1 ELSE 0 END) as low_count
+    FROM bottles
+    WHERE detection_date >= %s AND detection_date < %s
+    GROUP BY DATE(detection_date)
+    """
+
+    # Per-minute/per-hour aggregates, incremented with every batch
+    INCREMENT_ROLLUP_QUERY = """
+    INSERT INTO {table} (bucket, total_bottles, defective_bottles, low_count, full_count,
+                         overflow_count, shape_defective_count, confidence_sum)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        total_bottles = total_bottles + VALUES(total_bottles),
+        defective_bottles = defective_bottles + VALUES(defective_bottles),
+        low_count = low_count + VALUES(low_count),
+        full_count = full_count + VALUES(full_count),
+        overflow_count = overflow_count + VALUES(overflow_count),
+        shape_defective_count = shape_defective_count + VALUES(shape_defective_count),
+        confidence_sum = confidence_sum + VALUES(confidence_sum)
+    """
+
+    ROLLUP_QUERY = """
+    SELECT bucket, total_bottles, defective_bottles, low_count, full_count, overflow_count,
+           shape_defective_count, confidence_sum
+    FROM {table}
+    WHERE bucket >= %s AND bucket < %s
+    ORDER BY bucket
+    """
+
+    # Columns shown in history/exports; never the legacy processed_image blob
+    HISTORY_COLUMNS = """id, serial_number, detection_date, water_level, shape_status,
+                         confidence_score, is_defective, image_path"""
+    HISTORY_QUERY = f"SELECT {HISTORY_COLUMNS} FROM bottles ORDER BY detection_date DESC LIMIT %s"
+    SERIAL_QUERY = (f"SELECT {HISTORY_COLUMNS} FROM bottles WHERE serial_number = %s "
+                    "ORDER BY detection_date DESC")
+
+    # Advance a station's counter and read the new value back from the OK
+    # packet (LAST_INSERT_ID(expr)), all in one statement
+    CREATE_SERIAL_COUNTER_QUERY = "INSERT IGNORE INTO serial_counters (station_id, next_serial) VALUES (%s, 1)"
+    LEASE_SERIALS_QUERY = """
+    UPDATE serial_counters SET next_serial = LAST_INSERT_ID(next_serial + %s) WHERE station_id = %s
+    """
+    ADVANCE_SERIAL_COUNTER_QUERY = """
+    UPDATE serial_counters SET next_serial = GREATEST(next_serial, %s) WHERE station_id = %s
+    """
+    HIGHEST_SERIAL_QUERY = "SELECT MAX(serial_number) FROM bottles WHERE serial_number BETWEEN %s AND %s"
+
+    LABEL_SAMPLE_QUERY = """
+    INSERT INTO sample_labels (bottle_id, water_level, shape_status, labelled_at)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        water_level = VALUES(water_level),
+        shape_status = VALUES(shape_status),
+        labelled_at = VALUES(labelled_at)
+    """
+
+    LABELLED_SAMPLES_QUERY = """
+    SELECT b.id, b.image_path, l.water_level, l.shape_status, l.labelled_at
+    FROM sample_labels l
+    JOIN bottles b ON b.id = l.bottle_id
+    ORDER BY l.bottle_id
+    """
+
+    IMAGE_PATH_QUERY = "SELECT image_path FROM bottles WHERE id = %s"
+    IMAGE_BLOB_QUERY = "SELECT processed_image FROM bottles WHERE id = %s"
+
+    TODAY_STATISTICS_QUERY = """
+    SELECT
+        SUM(CASE WHEN is_defective = FALSE THEN 1 ELSE 0 END) as perfect_today,
+        SUM(CASE WHEN is_defective = TRUE THEN 1 ELSE 0 END) as defective_today,
+        COUNT(*) as total_today
+    FROM bottles
+    WHERE detection_date >= CURDATE() AND detection_date < CURDATE() + INTERVAL 1 DAY
+    """
+
+    OVERALL_STATISTICS_QUERY = """
+    SELECT
+        COUNT(*) as total,
+        SUM(CASE WHEN is_defective = FALSE THEN 1 ELSE 0 END) as perfect_total,
+        SUM(CASE WHEN is_defective = TRUE THEN 1 ELSE 0 END) as defective_total
+    FROM bottles
+    """
+
+    TODAY_TOTALS_QUERY = """
+    SELECT total_bottles as total_today, perfect_bottles as perfect_today,
+           defective_bottles as defective_today
+    FROM defect_statistics
+    WHERE date = CURDATE()
+    """
+
+    OVERALL_TOTALS_QUERY = """
+    SELECT
+        SUM(total_bottles) as total,
+        SUM(perfect_bottles) as perfect_total,
+        SUM(defective_bottles) as defective_total
+    FROM defect_statistics
+    """
+
+    def __init__(self, write_behind=DB_WRITE_BEHIND, pool_size=DB_POOL_SIZE):
+        self.image_store = ImageStore()
+
+        # Connection pool shared by every thread; each thread checks out its
+        # own connection per operation (see _checkout)
+        self.pool = None
+        self.pool_size = pool_size
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._pool_slots = threading.BoundedSemaphore(pool_size)
+        self._local = threading.local()
+        self._retry_delay = DB_RETRY_DELAY
+        self._next_connect_attempt = 0.0
+        self.pool_stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+            'timeouts': 0,
+            'reconnects': 0
+        }
         self.connect()
-    
+
+        # Objects notified with bottle_saved(record) when a save is accepted and
+        # bottles_flushed(records, committed) once records leave the write path
+        self.listeners = []
+        # Held while a batch is committed and its listeners notified, so readers
+        # can see a consistent split between committed and pending bottles
+        self.flush_lock = threading.Lock()
+
+        # Write-behind state
+        self.write_behind = write_behind
+        self.write_queue = None
+        self.writer_thread = None
+        self.writer_running = False
+        self.write_stats = {
+            'batches': 0,
+            'rows_written': 0,
+            'rows_failed': 0,
+            'retries': 0,
+            'last_flush_latency': 0.0,
+            'total_flush_latency': 0.0,
+            'max_flush_latency': 0.0
+        }
+        # Latency of recent database writes (a batch, or one synchronous save)
+        self.write_latency = RollingStats()
+        if self.write_behind:
+            self.start_writer()
+
+        # Created on the first serial number, so commands that never record
+        # bottles neither lease serials nor touch the station's state file
+        self.serial_allocator = None
+        self._allocator_lock = threading.Lock()
+
     def connect(self):
         try:
-            self.connection = mysql.connector.connect(**DB_CONFIG)
+            self._create_pool()
             print("Database connection established")
         except Error as e:
+            self._connection_failed()
             print(f"Error connecting to database: {e}")
-    
+
+    def _create_pool(self):
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = pooling.MySQLConnectionPool(pool_name="bottle_pool",
+                                                        pool_size=self.pool_size, **DB_CONFIG)
+
+    def _check_backoff(self):
+        """Fail fast while backing off after a connection failure"""
+        remaining = self._next_connect_attempt - time.monotonic()
+        if remaining > 0:
+            raise mysql_errors.InterfaceError(f"Database unavailable, next reconnect in {remaining:.1f}s")
+
+    def _connection_failed(self):
+        """Back off exponentially before the next reconnect attempt"""
+        self._next_connect_attempt = time.monotonic() + self._retry_delay
+        self._retry_delay = min(self._retry_delay * 2, DB_RETRY_MAX_DELAY)
+
+    @contextmanager
+    def _checkout(self):
+        """Check out a healthy pooled connection for the current thread.
+
+        Nested checkouts on the same thread reuse the same connection.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            yield connection
+            return
+
+        self._check_backoff()
+        started = time.perf_counter()
+        if not self._pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            self.pool_stats['timeouts'] += 1
+            raise mysql_errors.PoolError(f"No free database connection after {DB_POOL_TIMEOUT}s")
+        wait = time.perf_counter() - started
+
+        try:
+            self._create_pool()
+            connection = self.pool.get_connection()
+        except Error:
+            self._pool_slots.release()
+            self._connection_failed()
+            raise
+
+        stats = self.pool_stats
+        with self._stats_lock:
+            stats['checkouts'] += 1
+            stats['in_use'] += 1
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+        try:
+            try:
+                self._health_check(connection)
+            except Error:
+                self._connection_failed()
+                raise
+            self._retry_delay = DB_RETRY_DELAY
+            self._local.connection = connection
+            yield connection
+        finally:
+            self._local.connection = None
+            with self._stats_lock:
+                stats['in_use'] -= 1
+            try:
+                connection.close()  # returns it to the pool
+            except Error:
+                pass
+            self._pool_slots.release()
+
+    def _health_check(self, connection):
+        """Ping the connection, reconnecting it once if the server went away"""
+        try:
+            connection.ping(reconnect=False)
+        except Error:
+            self.pool_stats['reconnects'] += 1
+            connection.ping(reconnect=True, attempts=2, delay=1)
+
+    def _cursor(self, connection, dictionary=False):
+        return connection.cursor(dictionary=dictionary)
+
+    def _prepared_cursor(self, connection, dictionary=False):
+        """Server-side prepared cursor for the hot single-row statements"""
+        return connection.cursor(prepared=True, dictionary=dictionary)
+
+    def get_pool_metrics(self):
+        """Pool wait time and utilization (None for backends without a pool)"""
+        with self._stats_lock:
+            metrics = dict(self.pool_stats)
+        metrics['pool_size'] = self.pool_size
+        metrics['utilization'] = metrics['in_use'] / self.pool_size
+        metrics['avg_wait'] = (metrics['total_wait'] / metrics['checkouts']
+                               if metrics['checkouts'] else 0.0)
+        return metrics
+
     def save_bottle_data(self, serial_number, water_level, shape_status, confidence, bottle_image):
+        # Timestamp now: with write-behind the row is inserted later
+        record = (serial_number, datetime.now(), water_level, shape_status, confidence, bottle_image)
+
+        # Notify first so listeners never see a flush before the save
+        self._notify_saved(record)
+
+        if self.write_behind:
+            # Blocks only when the queue is full, applying backpressure to the caller
+            if not self.write_queue.put(record):
+                print(f"Error saving data: write queue closed, bottle {serial_number} not saved")
+                self._notify_flushed([record], committed=False)
+                return False
+            return True
+
         try:
-            if not self.connection.is_connected():
-                self.connect()
-            
-            cursor = self.connection.cursor()
-            
-            # Convert image to binary
-            _, buffer = cv2.imencode('.jpg', bottle_image)
-            image_binary = buffer.tobytes()
-            
-            # Check if bottle is defective
-            is_defective = (water_level in ['low', 'overflow'] or shape_status == 'defective')
-            
-            # Insert data
-            query = """
-            INSERT INTO bottles (serial_number, water_level, shape_status, confidence_score, 
-                                processed_image, is_defective)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            values = (serial_number, water_level, shape_status, confidence, image_binary, is_defective)
-            
-            cursor.execute(query, values)
-            self.connection.commit()
-            
-            # Update daily statistics
-            cursor.callproc('UpdateDailyStatistics')
-            
+            started = time.perf_counter()
+            with self._checkout() as connection:
+                self._commit_records(connection, [record])
+            self.write_latency.add(time.perf_counter() - started)
             print(f"Data saved for bottle {serial_number}")
-            cursor.close()
             return True
-            
-        except Error as e:
+
+        except self.DATABASE_ERRORS as e:
             print(f"Error saving data: {e}")
+            self._notify_flushed([record], committed=False)
             return False
-    
-    def get_bottle_history(self, serial_number=None, limit=50):
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _notify_saved(self, record):
+        for listener in self.listeners:
+            listener.bottle_saved(record)
+
+    def _notify_flushed(self, records, committed=True):
+        for listener in self.listeners:
+            listener.bottles_flushed(records, committed)
+
+    def _bottle_row(self, record):
+        """Convert a queued record to an INSERT row (JPEG-encodes and stores the image)"""
+        serial_number, detected_at, water_level, shape_status, confidence, bottle_image = record
+
+        # Convert image to binary and keep it in the image store
+        _, buffer = cv2.imencode('.jpg', bottle_image)
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            
-            if serial_number:
-                query = "SELECT * FROM bottles WHERE serial_number = %s ORDER BY detection_date DESC"
-                cursor.execute(query, (serial_number,))
+            image_path = self.image_store.put(buffer.tobytes())
+        except OSError as e:
+            print(f"Error storing image for bottle {serial_number}: {e}")
+            image_path = None
+
+        # Check if bottle is defective
+        is_defective = is_defective_bottle(water_level, shape_status)
+
+        return (serial_number, detected_at, water_level, shape_status, confidence,
+                image_path, is_defective)
+
+    def _statistics_increments(self, rows):
+        """Per-day counter increments for a batch of INSERT rows"""
+        increments = {}
+        for row in rows:
+            detected_at, water_level, is_defective = row[1], row[2], row[6]
+            counts = increments.setdefault(detected_at.date(), [0, 0, 0, 0, 0])
+            counts[0] += 1
+            counts[1 if is_defective else 2] += 1
+            if water_level == 'overflow':
+                counts[3] += 1
+            elif water_level == 'low':
+                counts[4] += 1
+        return [(day, *counts) for day, counts in increments.items()]
+
+    def _rollup_increments(self, rows, resolution):
+        """Per-bucket rollup increments for a batch of INSERT rows"""
+        increments = {}
+        for row in rows:
+            detected_at, water_level, shape_status = row[1], row[2], row[3]
+            confidence, is_defective = row[4], row[6]
+            counts = increments.setdefault(rollup_bucket(detected_at, resolution),
+                                           [0, 0, 0, 0, 0, 0, 0.0])
+            counts[0] += 1
+            counts[1] += 1 if is_defective else 0
+            if water_level == 'low':
+                counts[2] += 1
+            elif water_level == 'overflow':
+                counts[4] += 1
             else:
-                query = "SELECT * FROM bottles ORDER BY detection_date DESC LIMIT %s"
-                cursor.execute(query, (limit,))
-            
-            results = cursor.fetchall()
+                counts[3] += 1
+            counts[5] += 1 if shape_status == 'defective' else 0
+            counts[6] += float(confidence or 0.0)
+        return [(bucket, *counts) for bucket, counts in increments.items()]
+
+    def _write_batch(self, connection, records):
+        """Insert records and increment daily statistics in a single transaction"""
+        rows = [self._bottle_row(record) for record in records]
+        increments = self._statistics_increments(rows)
+        if len(rows) == 1:
+            # Single bottle: reuse the prepared statements
+            cursor = self._prepared_cursor(connection)
+        else:
+            # Batch: executemany sends one multi-row INSERT
+            cursor = self._cursor(connection)
+        try:
+            cursor.executemany(self.INSERT_BOTTLE_QUERY, rows)
+
+            # Update daily statistics and the trend rollups
+            cursor.executemany(self.INCREMENT_STATISTICS_QUERY, increments)
+            for resolution, (table, width) in ROLLUP_RESOLUTIONS.items():
+                cursor.executemany(self.INCREMENT_ROLLUP_QUERY.format(table=table),
+                                   self._rollup_increments(rows, resolution))
+            connection.commit()
+        except self.DATABASE_ERRORS:
+            try:
+                connection.rollback()
+            except self.DATABASE_ERRORS:
+                pass
+            raise
+        finally:
             cursor.close()
+
+    def _commit_records(self, connection, records):
+        """Write records and notify listeners as one step under flush_lock"""
+        with self.flush_lock:
+            self._write_batch(connection, records)
+            self._notify_flushed(records)
+
+    # ------------------------------------------------------------------
+    # Write-behind writer
+    # ------------------------------------------------------------------
+    def start_writer(self):
+        """Start the background writer that flushes queued saves in batches"""
+        self.write_queue = StageQueue('db_writes', DB_WRITE_QUEUE_SIZE, BLOCK)
+        self.writer_running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop, name="db-writer")
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def stop_writer(self):
+        """Stop accepting saves and drain everything already queued"""
+        if self.writer_thread is None:
+            return
+        self.writer_running = False
+        self.write_queue.close()
+        self.writer_thread.join()
+        self.writer_thread = None
+
+    def _writer_loop(self):
+        batch = []
+        deadline = None
+        while True:
+            if batch:
+                timeout = max(0.0, deadline - time.monotonic())
+            else:
+                timeout = DB_FLUSH_INTERVAL
+            record = self.write_queue.get(timeout=timeout)
+
+            if record is not None:
+                if not batch:
+                    deadline = time.monotonic() + DB_FLUSH_INTERVAL
+                batch.append(record)
+
+            drained = record is None and self.write_queue.closed
+            if batch and (len(batch) >= DB_BATCH_SIZE or time.monotonic() >= deadline or drained):
+                self._flush(batch)
+                batch = []
+
+            if drained and self.write_queue.qsize() == 0:
+                break
+
+    def _flush(self, batch):
+        """Write one batch, reconnecting and retrying on connection loss"""
+        attempts = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                with self._checkout() as connection:
+                    self._commit_records(connection, batch)
+                self._record_flush(len(batch), time.perf_counter() - started)
+                return
+            except self.CONNECTION_ERRORS as e:
+                attempts += 1
+                self.write_stats['retries'] += 1
+                if not self.writer_running and attempts > DB_SHUTDOWN_RETRIES:
+                    print(f"Error saving data: giving up on {len(batch)} bottles after {attempts} attempts: {e}")
+                    self.write_stats['rows_failed'] += len(batch)
+                    self._notify_flushed(batch, committed=False)
+                    return
+                print(f"Database unavailable ({e}), retrying in {DB_RETRY_DELAY}s")
+                time.sleep(DB_RETRY_DELAY)
+            except self.DATABASE_ERRORS as e:
+                if len(batch) == 1:
+                    print(f"Error saving data for bottle {batch[0][0]}: {e}")
+                    self.write_stats['rows_failed'] += 1
+                    self._notify_flushed(batch, committed=False)
+                    return
+                # A bad row (e.g. duplicate serial) fails the whole batch; isolate it
+                print(f"Error saving batch: {e}, retrying rows individually")
+                self._flush_rows_individually(batch)
+                return
+
+    def _flush_rows_individually(self, batch):
+        # Each row still waits out connection errors; only rows the database rejects fail
+        for record in batch:
+            self._flush([record])
+
+    def _record_flush(self, rows, latency):
+        stats = self.write_stats
+        stats['batches'] += 1
+        stats['rows_written'] += rows
+        stats['last_flush_latency'] = latency
+        stats['total_flush_latency'] += latency
+        stats['max_flush_latency'] = max(stats['max_flush_latency'], latency)
+        self.write_latency.add(latency)
+
+    def get_write_metrics(self):
+        """Write-behind queue depth and flush latency"""
+        metrics = dict(self.write_stats)
+        metrics['avg_flush_latency'] = (metrics['total_flush_latency'] / metrics['batches']
+                                        if metrics['batches'] else 0.0)
+        if self.write_queue is not None:
+            queue_metrics = self.write_queue.get_metrics()
+            metrics['queue_depth'] = queue_metrics['depth']
+            metrics['queue_size'] = queue_metrics['maxsize']
+        else:
+            metrics['queue_depth'] = 0
+            metrics['queue_size'] = 0
+        return metrics
+
+    def rebuild_daily_statistics(self, start_date, end_date=None):
+        """Recompute defect_statistics from bottles for start_date..end_date (inclusive)"""
+        end_date = end_date or start_date
+        try:
+            with self._checkout() as connection:
+                cursor = self._cursor(connection)
+                try:
+                    cursor.execute(self.DELETE_STATISTICS_QUERY, (start_date, end_date))
+                    cursor.execute(self.REBUILD_STATISTICS_QUERY,
+                                   (start_date, end_date + timedelta(days=1)))
+                    days = cursor.rowcount
+                    connection.commit()
+                except self.DATABASE_ERRORS:
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+            print(f"Daily statistics rebuilt for {start_date} to {end_date} ({days} days with data)")
+            return True
+
+        except self.DATABASE_ERRORS as e:
+            print(f"Error rebuilding statistics: {e}")
+            return False
+
+    def maintain_storage(self, convert=False):
+        """Create future partitions and drop/export partitions past retention"""
+        try:
+            with self._checkout() as connection:
+                maintain_partitions(connection, convert)
+        except self.DATABASE_ERRORS as e:
+            print(f"Error maintaining partitions: {e}")
+            return False
+        return self.prune_rollups()
+
+    def prune_rollups(self, retention_days=ROLLUP_MINUTE_RETENTION_DAYS):
+        """Delete per-minute rollups older than retention_days"""
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        try:
+            with self._checkout() as connection:
+                cursor = self._cursor(connection)
+                cursor.execute("DELETE FROM rollup_minute WHERE bucket < %s", (cutoff,))
+                deleted = cursor.rowcount
+                connection.commit()
+                cursor.close()
+            print(f"Pruned {deleted} per-minute rollups before {cutoff:%Y-%m-%d %H:%M}")
+            return True
+        except self.DATABASE_ERRORS as e:
+            print(f"Error pruning rollups: {e}")
+            return False
+
+    def get_rollups(self, resolution, start, end=None):
+        """Rollup rows (dicts) for buckets in [start, end), oldest first.
+
+        Trend views read these instead of scanning bottles; mean confidence
+        is confidence_sum / total_bottles.
+        """
+        table, width = ROLLUP_RESOLUTIONS[resolution]
+        end = end or datetime.now() + width
+        try:
+            with self._checkout() as connection:
+                cursor = self._cursor(connection, dictionary=True)
+                cursor.execute(self.ROLLUP_QUERY.format(table=table), (start, end))
+                rows = cursor.fetchall()
+                cursor.close()
+            return rows
+        except self.DATABASE_ERRORS as e:
+            print(f"Error fetching rollups: {e}")
+            return []
+
+    def get_bottle_history(self, serial_number=None, limit=50):
+        try:
+            with self._checkout() as connection:
+                cursor = self._prepared_cursor(connection, dictionary=True)
+
+                if serial_number:
+                    cursor.execute(self.SERIAL_QUERY, (serial_number,))
+                else:
+                    cursor.execute(self.HISTORY_QUERY, (limit,))
+
+                results = cursor.fetchall()
+                cursor.close()
             return results
-            
-        except Error as e:
+
+        except self.DATABASE_ERRORS as e:
             print(f"Error fetching data: {e}")
             return []
-    
+
+    def _bottle_filters(self, start=None, end=None, defective_only=False, water_level=None,
+                        shape_status=None, serial_prefix=None):
+        """WHERE clause and parameters for the history/export filters.
+
+        start is inclusive and end exclusive so the date index (and the
+        partitions) can be range scanned.
+        """
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("detection_date >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append("detection_date < %s")
+            params.append(end)
+        if defective_only:
+            conditions.append("is_defective = TRUE")
+        if water_level:
+            conditions.append("water_level = %s")
+            params.append(water_level)
+        if shape_status:
+            conditions.append("shape_status = %s")
+            params.append(shape_status)
+        if serial_prefix:
+            escaped = serial_prefix.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+            conditions.append("serial_number LIKE %s ESCAPE '!'")
+            params.append(escaped + '%')
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, params
+
+    def get_bottle_page(self, before=None, after=None, limit=HISTORY_PAGE_SIZE, **filters):
+        """One page of bottle history, newest first, by keyset pagination.
+
+        before/after are (detection_date, id) cursors taken from the last or
+        first row of a previous page: before pages back through older rows,
+        after returns the rows newer than the first one shown (at most limit,
+        the oldest of them). Each page is an index range scan, however deep.
+        """
+        where, params = self._bottle_filters(**filters)
+        conditions = [where[len(" WHERE "):]] if where else []
+        if before is not None:
+            conditions.append("detection_date <= %s AND (detection_date < %s OR id < %s)")
+            params += [before[0], before[0], before[1]]
+        if after is not None:
+            conditions.append("detection_date >= %s AND (detection_date > %s OR id > %s)")
+            params += [after[0], after[0], after[1]]
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        order = "ASC" if after is not None else "DESC"
+        query = (f"SELECT {self.HISTORY_COLUMNS} FROM bottles{where} "
+                 f"ORDER BY detection_date {order}, id {order} LIMIT %s")
+        params.append(limit)
+
+        try:
+            with self._checkout() as connection:
+                cursor = self._cursor(connection, dictionary=True)
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                cursor.close()
+        except self.DATABASE_ERRORS as e:
+            print(f"Error fetching history page: {e}")
+            return []
+
+        if after is not None:
+            rows.reverse()
+        return rows
+
+    def count_bottles(self, **filters):
+        """Number of bottles matching the filters, or None on error"""
+        where, params = self._bottle_filters(**filters)
+        try:
+            with self._checkout() as connection:
+                cursor = self._cursor(connection)
+                cursor.execute(f"SELECT COUNT(*) FROM bottles{where}", params)
+                count = cursor.fetchone()[0]
+                cursor.close()
+            return count
+        except self.DATABASE_ERRORS as e:
+            print(f"Error counting bottles: {e}")
+            return None
+
+    def iter_bottles(self, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+        """Yield lists of bottle rows (dicts) oldest first, chunk_size at a time.
+
+        Rows are streamed from an unbuffered cursor, so memory stays constant
+        however large the range. Errors propagate to the caller.
+        """
+        where, params = self._bottle_filters(**filters)
+        query = f"SELECT {self.HISTORY_COLUMNS} FROM bottles{where} ORDER BY detection_date, id"
+        with self._checkout() as connection:
+            cursor = self._streaming_cursor(connection)
+            try:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                self._close_stream(connection, cursor)
+
+    def _streaming_cursor(self, connection):
+        return connection.cursor(dictionary=True, buffered=False)
+
+    def _close_stream(self, connection, cursor):
+        # An abandoned unbuffered result must be read off the wire before the
+        # connection can be reused
+        if connection.unread_result:
+            connection.consume_results()
+        cursor.close()
+
+    def label_sample(self, bottle_id, water_level, shape_status):
+        """Record the operator's (confirmed or corrected) labels for a bottle"""
+        try:
+            with self._checkout() as connection:
+                cursor = self._prepared_cursor(connection)
+                cursor.execute(self.LABEL_SAMPLE_QUERY, (bottle_id, water_level, shape_status, datetime.now()))
+                connection.commit()
+                cursor.close()
+            return True
+
+        except self.DATABASE_ERRORS as e:
+            print(f"Error saving label: {e}")
+            return False
+
+    def get_labelled_samples(self):
+        """Every labelled bottle: id, image_path, water_level, shape_status, labelled_at"""
+        try:
+            with self._checkout() as connection:
+                cursor = self._cursor(connection, dictionary=True)
+                cursor.execute(self.LABELLED_SAMPLES_QUERY)
+                samples = cursor.fetchall()
+                cursor.close()
+            return samples
+
+        except self.DATABASE_ERRORS as e:
+            print(f"Error fetching labelled samples: {e}")
+            return []
+
+    def get_bottle_image(self, bottle_id):
+        """JPEG bytes for a bottle, from the image store or a not yet migrated blob"""
+        try:
+            with self._checkout() as connection:
+                cursor = self._prepared_cursor(connection)
+                cursor.execute(self.IMAGE_PATH_QUERY, (bottle_id,))
+                row = cursor.fetchone()
+                if row and row[0]:
+                    cursor.close()
+                    return self.image_store.get(row[0])
+
+                cursor.execute(self.IMAGE_BLOB_QUERY, (bottle_id,))
+                row = cursor.fetchone()
+                cursor.close()
+            return bytes(row[0]) if row and row[0] is not None else None
+
+        except self.DATABASE_ERRORS as e:
+            print(f"Error fetching image: {e}")
+            return None
+
     def get_statistics(self):
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            
-            # Get today's statistics
-            query = """
-            SELECT 
-                SUM(CASE WHEN is_defective = FALSE THEN 1 ELSE 0 END) as perfect_today,
-                SUM(CASE WHEN is_defective = TRUE THEN 1 ELSE 0 END) as defective_today,
-                COUNT(*) as total_today
-            FROM bottles 
-            WHERE DATE(detection_date) = CURDATE()
-            """
-            cursor.execute(query)
-            today_stats = cursor.fetchone()
-            
-            # Get overall statistics
-            query = """
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN is_defective = FALSE THEN 1 ELSE 0 END) as perfect_total,
-                SUM(CASE WHEN is_defective = TRUE THEN 1 ELSE 0 END) as defective_total
-            FROM bottles
-            """
-            cursor.execute(query)
-            overall_stats = cursor.fetchone()
-            
-            cursor.close()
+            with self._checkout() as connection:
+                cursor = self._prepared_cursor(connection, dictionary=True)
+
+                # Get today's statistics
+                cursor.execute(self.TODAY_STATISTICS_QUERY)
+                today_stats = cursor.fetchone()
+
+                # Get overall statistics
+                cursor.execute(self.OVERALL_STATISTICS_QUERY)
+                overall_stats = cursor.fetchone()
+
+                cursor.close()
             return today_stats, overall_stats
-            
-        except Error as e:
+
+        except self.DATABASE_ERRORS as e:
             print(f"Error getting statistics: {e}")
             return None, None
-    
+
+    def get_statistics_totals(self):
+        """Today/overall counts from the incrementally maintained defect_statistics"""
+        try:
+            with self._checkout() as connection:
+                cursor = self._prepared_cursor(connection, dictionary=True)
+                cursor.execute(self.TODAY_TOTALS_QUERY)
+                today_stats = cursor.fetchone() or {'total_today': 0, 'perfect_today': 0, 'defective_today': 0}
+
+                cursor.execute(self.OVERALL_TOTALS_QUERY)
+                overall_stats = cursor.fetchone()
+                cursor.close()
+                # End the read transaction so the next call sees new commits
+                connection.commit()
+
+            today_stats = {key: int(value or 0) for key, value in today_stats.items()}
+            overall_stats = {key: int(value or 0) for key, value in overall_stats.items()}
+            return today_stats, overall_stats
+
+        except self.DATABASE_ERRORS as e:
+            print(f"Error getting statistics: {e}")
+            return None, None
+
     def generate_serial_number(self):
-        """Generate a unique serial number for each bottle"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        import random
-        random_str = ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
-        return f"BTL-{timestamp}-{random_str}"
-    
+        """Next unique serial number for this station (None if none could be leased)"""
+        with self._allocator_lock:
+            if self.serial_allocator is None:
+                self.serial_allocator = SerialAllocator(self)
+        return self.serial_allocator.next_serial()
+
+    def _close_serial_allocator(self):
+        with self._allocator_lock:
+            if self.serial_allocator is not None:
+                self.serial_allocator.close()
+
+    def lease_serial_block(self, station_id, size):
+        """Reserve size serial numbers for a station: returns (first, end), end exclusive"""
+        with self._checkout() as connection:
+            cursor = self._cursor(connection)
+            try:
+                end = self._lease_serials(cursor, station_id, size)
+                if end is None:
+                    # First lease of this station
+                    cursor.execute(self.CREATE_SERIAL_COUNTER_QUERY, (station_id,))
+                    end = self._lease_serials(cursor, station_id, size)
+                connection.commit()
+            except self.DATABASE_ERRORS:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        return end - size, end
+
+    def _lease_serials(self, cursor, station_id, size):
+        cursor.execute(self.LEASE_SERIALS_QUERY, (size, station_id))
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def advance_serial_counter(self, station_id, next_serial):
+        """Move a station's counter forward to next_serial (never backwards)"""
+        with self._checkout() as connection:
+            cursor = self._cursor(connection)
+            try:
+                cursor.execute(self.ADVANCE_SERIAL_COUNTER_QUERY, (next_serial, station_id))
+                connection.commit()
+            except self.DATABASE_ERRORS:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def highest_serial(self, first_serial, last_serial):
+        """Highest stored serial number between first_serial and last_serial, or None"""
+        with self._checkout() as connection:
+            cursor = self._cursor(connection)
+            try:
+                cursor.execute(self.HIGHEST_SERIAL_QUERY, (first_serial, last_serial))
+                return cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
     def create_qr_code(self, serial_number):
-        """Generate QR code for bottle serial number"""
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(serial_number)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        return img
-    
+        """Generate QR code for bottle serial number (see LabelService for batches)"""
+        return make_qr_image(serial_number)
+
     def close(self):
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            print("Database connection closed")
\ No newline at end of file
+        self._close_serial_allocator()
+        self.stop_writer()
+        if self.pool is not None:
+            self.pool._remove_connections()
+            self.pool = None
+            print("Database connection closed")
+
+
+def create_database_handler(backend=DB_BACKEND, **kwargs):
+    """Create the storage backend selected by DB_BACKEND in config.py"""
+    if backend == 'mysql':
+        return DatabaseHandler(**kwargs)
+    if backend == 'sqlite':
+        from utils.sqlite_handler import SQLiteDatabaseHandler
+        return SQLiteDatabaseHandler(**kwargs)
+    raise ValueError(f"Unknown database backend '{backend}' (expected 'mysql' or 'sqlite')")
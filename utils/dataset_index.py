@@ -0,0 +1,411 @@
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+from config import (DATA_DIR, DATASET_INDEX_PATH, DATASET_SPLIT_DIR, DATASET_INDEX_WORKERS,
+                    DEDUP_DUPLICATE_DISTANCE, DEDUP_GROUP_DISTANCE)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+# Bumped when entries gain fields, so older manifests are rebuilt
+MANIFEST_VERSION = 2
+
+# Roboflow exports name augmented copies <source>_jpg.rf.<hash>.jpg; copies
+# of one source photo must never straddle the train/validation split
+ROBOFLOW_SOURCE = re.compile(r'^(?P<source>.+)_(jpe?g|png|bmp)\.rf\.[0-9a-f]+\.', re.IGNORECASE)
+
+
+def perceptual_hash(image):
+    """64-bit DCT perceptual hash of a grayscale image"""
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:8, :8].flatten()
+    # Compare against the median, leaving out the DC term (overall brightness)
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def inspect_image(path):
+    """Manifest fields of one image file: content hash, dimensions and
+    perceptual hash, or an 'error' saying why it is unusable.
+
+    The file is read once. Module level so it can run in a worker process.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        return {'error': str(e)}
+
+    record = {'sha256': hashlib.sha256(data).hexdigest()}
+    try:
+        # Only parses the header
+        with Image.open(io.BytesIO(data)) as image:
+            record['width'], record['height'] = image.size
+    except (OSError, SyntaxError) as e:
+        record['error'] = f"unreadable: {e}"
+        return record
+
+    # Decoders silently fill in a cut-off JPEG; a missing end marker gives it away
+    if data[:2] == b'\xff\xd8' and not data.rstrip(b'\x00').endswith(b'\xff\xd9'):
+        record['error'] = "truncated"
+        return record
+
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        record['error'] = "undecodable"
+        return record
+    record['phash'] = f"{perceptual_hash(gray):016x}"
+    return record
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MultiIndexHash:
+    """Hamming radius search over 64-bit hashes by multi-index hashing.
+
+    Hashes are cut into `chunks` substrings, each indexed in its own table.
+    Two hashes within radius r differ in at most r // chunks bits of at
+    least one substring (pigeonhole), so a query only probes the entries
+    within that many bits of its own substrings, then checks the full
+    distance of those candidates.
+    """
+
+    def __init__(self, chunks=4):
+        self.chunks = chunks
+        self.bits = 64 // chunks
+        self.mask = (1 << self.bits) - 1
+        self.tables = [{} for _ in range(chunks)]
+        self.values = []
+        self._flips = {}
+
+    def _substrings(self, value):
+        return [(value >> (chunk * self.bits)) & self.mask for chunk in range(self.chunks)]
+
+    def add(self, value, item):
+        position = len(self.values)
+        self.values.append((value, item))
+        for table, key in zip(self.tables, self._substrings(value)):
+            table.setdefault(key, []).append(position)
+
+    def _flip_masks(self, radius):
+        """Every substring mask with at most radius bits set"""
+        masks = self._flips.get(radius)
+        if masks is None:
+            masks = [0]
+            for count in range(1, radius + 1):
+                masks.extend(sum(1 << bit for bit in bits)
+                             for bits in itertools.combinations(range(self.bits), count))
+            self._flips[radius] = masks
+        return masks
+
+    def search(self, value, radius):
+        """[(distance, item)] for every item within radius of value"""
+        masks = self._flip_masks(radius // self.chunks)
+        seen = set()
+        found = []
+        for table, key in zip(self.tables, self._substrings(value)):
+            for mask in masks:
+                for position in table.get(key ^ mask, ()):
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    other, item = self.values[position]
+                    distance = hamming(value, other)
+                    if distance <= radius:
+                        found.append((distance, item))
+        return found
+
+
+class _DisjointSet:
+    def __init__(self, items):
+        self.parent = {item: item for item in items}
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            # Smallest path as root, so group keys are stable between runs
+            if b < a:
+                a, b = b, a
+            self.parent[b] = a
+
+    def groups(self):
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return groups
+
+
+class DatasetIndex:
+    """Persistent manifest of the training images.
+
+    Each entry records a file's class, size, mtime, dimensions, content and
+    perceptual hashes, or the error that makes it unusable. Entries are
+    keyed by path relative to the data root and reused while the file's
+    size and mtime are unchanged, so after the first run an update is one
+    scandir walk plus inspecting the new files (in parallel processes).
+    Training and the report read class lists and counts from here instead
+    of walking the folders themselves.
+    """
+
+    def __init__(self, root=DATA_DIR / "train", path=DATASET_INDEX_PATH):
+        self.root = str(root)
+        self.path = str(path)
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+            return
+        except (OSError, ValueError) as e:
+            print(f"Rebuilding unreadable dataset manifest {self.path}: {e}")
+            self.entries = {}
+            return
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('root') != self.root:
+            self.entries = {}
+            return
+        self.entries = manifest['entries']
+
+    def save(self):
+        directory = os.path.dirname(self.path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'root': self.root, 'entries': self.entries}, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def scan(self):
+        """{relative path: os.stat_result} for every image under root"""
+        files = {}
+        stack = [self.root]
+        while stack:
+            for entry in os.scandir(stack.pop()):
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    relative_path = os.path.relpath(entry.path, self.root).replace(os.sep, '/')
+                    files[relative_path] = entry.stat()
+        return files
+
+    def update(self, workers=DATASET_INDEX_WORKERS):
+        """Inspect new and changed images, forget deleted ones. Returns (inspected, removed)"""
+        files = self.scan()
+        removed = [path for path in self.entries if path not in files]
+        for path in removed:
+            del self.entries[path]
+
+        changed = [path for path, stat in files.items()
+                   if path not in self.entries
+                   or self.entries[path]['size'] != stat.st_size
+                   or self.entries[path]['mtime_ns'] != stat.st_mtime_ns]
+        if changed:
+            full_paths = [os.path.join(self.root, *path.split('/')) for path in changed]
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                records = executor.map(inspect_image, full_paths, chunksize=64)
+                for path, record in zip(changed, records):
+                    stat = files[path]
+                    parts = path.split('/')
+                    record.update({
+                        'class': parts[1] if len(parts) == 3 else None,
+                        'size': stat.st_size,
+                        'mtime_ns': stat.st_mtime_ns
+                    })
+                    self.entries[path] = record
+        if changed or removed:
+            self.save()
+        return len(changed), len(removed)
+
+    def images(self, task):
+        """[(relative path, class, hash)] of the usable images of one task"""
+        prefix = f"{task}/"
+        images = []
+        for path, entry in sorted(self.entries.items()):
+            if not path.startswith(prefix) or 'error' in entry or entry['class'] is None:
+                continue
+            images.append((path, entry['class'], int(entry['phash'], 16)))
+        return images
+
+    def class_counts(self, task):
+        """{class: usable images} of one task"""
+        counts = {}
+        for _, label, _ in self.images(task):
+            counts[label] = counts.get(label, 0) + 1
+        return counts
+
+    def corrupt(self):
+        """[(relative path, error)] of the images that cannot be used"""
+        return sorted((path, entry['error']) for path, entry in self.entries.items() if 'error' in entry)
+
+
+def source_name(path):
+    """Source photo of a Roboflow augmented copy, or None"""
+    match = ROBOFLOW_SOURCE.match(path.rsplit('/', 1)[-1])
+    return match.group('source') if match else None
+
+
+def build_split(index, task, validation_split=0.2, duplicate_distance=DEDUP_DUPLICATE_DISTANCE,
+                group_distance=DEDUP_GROUP_DISTANCE):
+    """Deduplicated, group-aware train/validation split of one task.
+
+    Images of the same class within duplicate_distance bits of each other
+    are near-identical copies: only the first is kept. Images within
+    group_distance bits, or augmented from the same source photo, form a
+    group, and whole groups go to either training or validation so no
+    near-duplicate leaks across. Groups are assigned in a stable hashed
+    order, filling validation up to validation_split of each class.
+
+    A distance of None skips that step; with both None this is a plain
+    split of the manifest that only keeps Roboflow copies together.
+    """
+    images = index.images(task)
+    classes = {path: label for path, label, _ in images}
+    hashes = {path: value for path, _, value in images}
+
+    hashes_index = MultiIndexHash()
+    for path, _, value in images:
+        hashes_index.add(value, path)
+
+    # Drop near-identical copies within a class, keeping the first path
+    duplicates = set()
+    conflicts = 0
+    for path, label, value in images if duplicate_distance is not None else []:
+        if path in duplicates:
+            continue
+        for _, other in hashes_index.search(value, duplicate_distance):
+            if other <= path or other in duplicates:
+                continue
+            if classes[other] == label:
+                duplicates.add(other)
+            else:
+                conflicts += 1
+    kept = [path for path, _, _ in images if path not in duplicates]
+
+    groups = _DisjointSet(kept)
+    by_source = {}
+    for path in kept:
+        source = source_name(path)
+        if source is not None:
+            if source in by_source:
+                groups.union(by_source[source], path)
+            else:
+                by_source[source] = path
+    kept_set = set(kept)
+    for path in kept if group_distance is not None else []:
+        for _, other in hashes_index.search(hashes[path], group_distance):
+            if other in kept_set and other != path:
+                groups.union(path, other)
+
+    class_totals = {}
+    for path in kept:
+        class_totals[classes[path]] = class_totals.get(classes[path], 0) + 1
+    targets = {label: round(total * validation_split) for label, total in class_totals.items()}
+    val_counts = {label: 0 for label in class_totals}
+
+    train, val = [], []
+    ordered = sorted(groups.groups().items(), key=lambda group: hashlib.sha1(group[0].encode()).hexdigest())
+    for _, members in ordered:
+        counts = {}
+        for path in members:
+            counts[classes[path]] = counts.get(classes[path], 0) + 1
+        fits = all(val_counts[label] + count <= targets[label] for label, count in counts.items())
+        destination = val if fits else train
+        if fits:
+            for label, count in counts.items():
+                val_counts[label] += count
+        destination.extend([path, classes[path]] for path in sorted(members))
+
+    return {
+        'task': task,
+        'root': index.root,
+        'classes': sorted(class_totals),
+        'train': train,
+        'val': val,
+        'images': len(images),
+        'duplicates_dropped': len(duplicates),
+        'duplicates': sorted(duplicates),
+        'label_conflicts': conflicts,
+        'groups': len(ordered)
+    }
+
+
+def split_path(task, split_dir=DATASET_SPLIT_DIR):
+    return os.path.join(str(split_dir), f"{task}.json")
+
+
+def save_split(split, split_dir=DATASET_SPLIT_DIR):
+    os.makedirs(str(split_dir), exist_ok=True)
+    path = split_path(split['task'], split_dir)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(split, f, indent=1)
+    return path
+
+
+def load_split(task, split_dir=DATASET_SPLIT_DIR):
+    """The saved split of a task, or None if there is none"""
+    try:
+        with open(split_path(task, split_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+
+def task_split(index, task, labels, validation_split=0.2, split_dir=DATASET_SPLIT_DIR):
+    """(split, items) of one task, for everything that trains or evaluates.
+
+    The split is the one saved by index_dataset.py, checked against the
+    manifest: images that are gone or unusable are left out, and images
+    added since it was saved (which are on neither side) are reported.
+    Without a saved split the manifest is split plainly; split['saved']
+    tells which it is. items is {'train': [...], 'val': [...]} of
+    (relative path, class index) for the images whose class is in labels.
+    """
+    usable = {path: label for path, label, _ in index.images(task)}
+    split = load_split(task, split_dir)
+    if split is None:
+        split = build_split(index, task, validation_split, duplicate_distance=None, group_distance=None)
+        split['saved'] = False
+    else:
+        split['saved'] = True
+        listed = set(split.get('duplicates', []))
+        missing = 0
+        for subset in ('train', 'val'):
+            listed.update(path for path, _ in split[subset])
+            kept = [[path, label] for path, label in split[subset] if usable.get(path) == label]
+            missing += len(split[subset]) - len(kept)
+            split[subset] = kept
+        added = sum(1 for path in usable if path not in listed)
+        if missing or added:
+            print(f"[{task}] Saved split is out of date ({missing} images gone or unusable, {added} not in it); "
+                  f"run index_dataset.py to rebuild it")
+
+    class_index = {label: i for i, label in enumerate(labels)}
+    items = {subset: [(path, class_index[label]) for path, label in split[subset] if label in class_index]
+             for subset in ('train', 'val')}
+    return split, items
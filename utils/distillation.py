@@ -0,0 +1,287 @@
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import MobileNetV2
+from tensorflow.keras.layers import Activation, Dense, Dropout, GlobalAveragePooling2D, Rescaling
+from tensorflow.keras.models import Model, load_model
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.preprocessing.image import ImageDataGenerator, img_to_array, load_img
+from config import (DATA_DIR, IMG_SIZE, MODELS_DIR, EPOCHS, LEARNING_RATE, BATCH_SIZE, CHECKPOINT_DIR,
+                    STUDENT_MODEL_FILE, STUDENT_IMG_SIZE, STUDENT_ALPHA, DISTILLATION_TEMPERATURE,
+                    DISTILLATION_SOFT_WEIGHT, DISTILLATION_REPORT_PATH)
+from utils.checkpoints import TrainingCheckpoint
+from utils.dataset_index import DatasetIndex, task_split
+from utils.training import TRAINING_JOBS
+
+
+def build_student(tasks=TRAINING_JOBS, image_size=STUDENT_IMG_SIZE, alpha=STUDENT_ALPHA,
+                  temperature=DISTILLATION_TEMPERATURE):
+    """(student, training model) sharing their layers.
+
+    The student is a narrow MobileNetV2 at reduced resolution with one
+    softmax output per task, in TRAINING_JOBS order. The training model adds
+    a temperature-softened copy of each output ('<task>_soft') to fit the
+    teachers' softened predictions.
+    """
+    backbone = MobileNetV2(weights='imagenet', include_top=False, alpha=alpha,
+                           input_shape=(image_size[0], image_size[1], 3))
+    x = GlobalAveragePooling2D()(backbone.output)
+    x = Dropout(0.2)(x)
+
+    outputs = []
+    soft_outputs = []
+    for name, job in tasks.items():
+        logits = Dense(len(job['labels']), name=f'{name}_logits')(x)
+        outputs.append(Activation('softmax', name=name)(logits))
+        tempered = Rescaling(1.0 / temperature, name=f'{name}_tempered')(logits)
+        soft_outputs.append(Activation('softmax', name=f'{name}_soft')(tempered))
+
+    student = Model(backbone.input, outputs, name='student')
+    training_model = Model(backbone.input, outputs + soft_outputs, name='student_training')
+    return student, training_model
+
+
+def compile_training_model(model, tasks=TRAINING_JOBS, learning_rate=LEARNING_RATE,
+                           temperature=DISTILLATION_TEMPERATURE, soft_weight=DISTILLATION_SOFT_WEIGHT):
+    # Soft-target gradients scale with 1/T^2, hence the T^2 weight
+    losses = {}
+    loss_weights = {}
+    for name in tasks:
+        losses[name] = 'categorical_crossentropy'
+        loss_weights[name] = 1.0 - soft_weight
+        losses[f'{name}_soft'] = 'categorical_crossentropy'
+        loss_weights[f'{name}_soft'] = soft_weight * temperature ** 2
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss=losses, loss_weights=loss_weights,
+                  metrics={name: ['accuracy'] for name in tasks})
+
+
+def soften(probabilities, temperature):
+    """Teacher softmax output re-softened at a temperature: softmax(log(p) / T)"""
+    tempered = np.power(np.clip(probabilities, 1e-8, 1.0), 1.0 / temperature)
+    return tempered / tempered.sum(axis=1, keepdims=True)
+
+
+def load_teachers(models_dir=MODELS_DIR, tasks=TRAINING_JOBS):
+    teachers = {}
+    for name, job in tasks.items():
+        path = os.path.join(str(models_dir), job['model_file'])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Teacher model not found at {path}; train the models first")
+        teachers[name] = load_model(path)
+    return teachers
+
+
+def load_items(train_data_dir, subset, tasks=TRAINING_JOBS, index=None):
+    """[(image path, task, class index)] from every task's split"""
+    index = index or DatasetIndex(train_data_dir)
+    items = []
+    for name, job in tasks.items():
+        _, split_items = task_split(index, name, job['labels'])
+        items.extend((os.path.join(str(train_data_dir), *path.split('/')), name, class_index)
+                     for path, class_index in split_items[subset])
+    return items
+
+
+class DistillationSequence(tf.keras.utils.Sequence):
+    """Student batches with teacher targets for every task.
+
+    Each image carries a ground-truth label for its own task only, so the
+    hard outputs of the other tasks get a zero sample weight; the teachers
+    label every image for every task. Teachers see the same augmented image
+    as the student, at their own resolution.
+    """
+
+    def __init__(self, items, teachers, tasks=TRAINING_JOBS, image_size=STUDENT_IMG_SIZE,
+                 batch_size=BATCH_SIZE, datagen=None, shuffle=True, temperature=DISTILLATION_TEMPERATURE):
+        super().__init__()
+        self.items = list(items)
+        self.teachers = teachers
+        self.tasks = tasks
+        self.image_size = image_size
+        self.batch_size = batch_size
+        self.datagen = datagen
+        self.shuffle = shuffle
+        self.temperature = temperature
+        self.samples = len(self.items)
+        # Without augmentation the teacher targets never change
+        self.soft_targets = {} if datagen is None and not shuffle else None
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(self.samples / self.batch_size))
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.items)
+
+    def __getitem__(self, index):
+        batch = self.items[index * self.batch_size:(index + 1) * self.batch_size]
+        images = np.empty((len(batch), IMG_SIZE[0], IMG_SIZE[1], 3), dtype=np.float32)
+        for i, (path, _, _) in enumerate(batch):
+            image = img_to_array(load_img(path, target_size=IMG_SIZE))
+            if self.datagen is not None:
+                image = self.datagen.random_transform(image)
+            images[i] = image / 255.0
+
+        if self.soft_targets is not None and index in self.soft_targets:
+            soft = self.soft_targets[index]
+        else:
+            soft = {name: soften(self.teachers[name](images, training=False).numpy(), self.temperature)
+                    for name in self.tasks}
+            if self.soft_targets is not None:
+                self.soft_targets[index] = soft
+
+        targets = {}
+        weights = {}
+        for name, job in self.tasks.items():
+            labels = np.zeros((len(batch), len(job['labels'])), dtype=np.float32)
+            labelled = np.zeros(len(batch), dtype=np.float32)
+            for i, (_, task, class_index) in enumerate(batch):
+                if task == name:
+                    labels[i, class_index] = 1.0
+                    labelled[i] = 1.0
+            targets[name] = labels
+            weights[name] = labelled
+            targets[f'{name}_soft'] = soft[name]
+            weights[f'{name}_soft'] = np.ones(len(batch), dtype=np.float32)
+
+        student_images = tf.image.resize(images, self.image_size).numpy()
+        return student_images, targets, weights
+
+
+def distill_student(train_data_dir=DATA_DIR / "train", models_dir=MODELS_DIR, epochs=EPOCHS, resume=False,
+                    max_minutes=None, checkpoint_dir=CHECKPOINT_DIR):
+    """Train the student on the teachers' predictions and save it to models/.
+
+    Early stopping, checkpoints, resume and the time budget work as for the
+    teachers (see utils.checkpoints). Returns the saved path.
+    """
+    started = time.monotonic()
+    teachers = load_teachers(models_dir)
+    index = DatasetIndex(train_data_dir)
+    index.update()
+    train_items = load_items(train_data_dir, 'train', index=index)
+    val_items = load_items(train_data_dir, 'val', index=index)
+    augmentation = ImageDataGenerator(rotation_range=20, width_shift_range=0.2, height_shift_range=0.2,
+                                      shear_range=0.2, zoom_range=0.2, horizontal_flip=True, fill_mode='nearest')
+    train_sequence = DistillationSequence(train_items, teachers, datagen=augmentation)
+    val_sequence = DistillationSequence(val_items, teachers, shuffle=False)
+    print(f"Distilling on {len(train_items)} images ({len(val_items)} validation)")
+
+    deadline = time.time() + max_minutes * 60 if max_minutes else None
+    checkpoint = TrainingCheckpoint(os.path.join(str(checkpoint_dir), 'student'), deadline=deadline)
+    if resume and checkpoint.can_resume():
+        training_model = load_model(checkpoint.last_path)
+        print(f"Resuming after epoch {checkpoint.state['epoch']}")
+    else:
+        checkpoint.reset()
+        _, training_model = build_student()
+        compile_training_model(training_model)
+    student = Model(training_model.input, [training_model.get_layer(name).output for name in TRAINING_JOBS],
+                    name='student')
+
+    class ProgressCallback(tf.keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            logs = logs or {}
+            accuracy = ' '.join(f"{name}={logs.get(f'val_{name}_accuracy', 0):.4f}" for name in TRAINING_JOBS)
+            print(f"[student] epoch {epoch + 1}/{epochs} val_loss={logs.get('val_loss', 0):.4f} "
+                  f"val accuracy {accuracy} ({time.monotonic() - started:.0f}s)")
+
+    if not checkpoint.finished(epochs):
+        training_model.fit(train_sequence, validation_data=val_sequence, initial_epoch=checkpoint.state['epoch'],
+                           epochs=epochs, callbacks=[checkpoint, ProgressCallback()], verbose=0)
+    checkpoint.restore_best(training_model)
+
+    path = os.path.join(str(models_dir), STUDENT_MODEL_FILE)
+    temp_path = path + '.tmp.h5'
+    student.save(temp_path, include_optimizer=False)
+    os.replace(temp_path, path)
+    print(f"Saved student (epoch {checkpoint.state['best_epoch']}) to {path} "
+          f"({time.monotonic() - started:.0f}s)")
+    return path
+
+
+def measure_latency(predict, image_size, runs=50, warmup=5):
+    """Median and 95th percentile milliseconds for one single-image call"""
+    image = tf.constant(np.random.rand(1, image_size[0], image_size[1], 3).astype(np.float32))
+    for _ in range(warmup):
+        predict(image)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        predict(image)
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings)), float(np.percentile(timings, 95))
+
+
+def accuracy_by_task(predict, items, image_size, batch_size=BATCH_SIZE):
+    """{task: accuracy} of predict(batch) -> {task: probabilities} on labelled items"""
+    correct = {}
+    total = {}
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        images = np.stack([img_to_array(load_img(path, target_size=IMG_SIZE)) / 255.0 for path, _, _ in batch])
+        predictions = predict(tf.image.resize(images, image_size))
+        for i, (_, task, class_index) in enumerate(batch):
+            total[task] = total.get(task, 0) + 1
+            correct[task] = correct.get(task, 0) + int(np.argmax(predictions[task][i]) == class_index)
+    return {task: correct[task] / total[task] for task in total}
+
+
+def compare_models(train_data_dir=DATA_DIR / "train", models_dir=MODELS_DIR, report_path=DISTILLATION_REPORT_PATH,
+                   runs=50):
+    """Validation accuracy, single-image latency and size of the teachers against the student.
+
+    Writes the figures to report_path as JSON and returns them.
+    """
+    teachers = load_teachers(models_dir)
+    student_path = os.path.join(str(models_dir), STUDENT_MODEL_FILE)
+    student = load_model(student_path, compile=False)
+    student_size = tuple(student.input_shape[1:3])
+    items = load_items(train_data_dir, 'val')
+    names = list(TRAINING_JOBS)
+
+    def teachers_predict(images):
+        return {name: teachers[name](images, training=False).numpy() for name in names}
+
+    def student_predict(images):
+        return dict(zip(names, (output.numpy() for output in student(images, training=False))))
+
+    teacher_latency = measure_latency(teachers_predict, IMG_SIZE, runs)
+    student_latency = measure_latency(student_predict, student_size, runs)
+    report = {
+        'validation_images': len(items),
+        'teacher': {
+            'accuracy': accuracy_by_task(teachers_predict, items, IMG_SIZE),
+            'latency_ms': teacher_latency[0],
+            'latency_p95_ms': teacher_latency[1],
+            'parameters': sum(model.count_params() for model in teachers.values()),
+            'file_bytes': sum(os.path.getsize(os.path.join(str(models_dir), job['model_file']))
+                              for job in TRAINING_JOBS.values()),
+            'input_size': list(IMG_SIZE)
+        },
+        'student': {
+            'accuracy': accuracy_by_task(student_predict, items, student_size),
+            'latency_ms': student_latency[0],
+            'latency_p95_ms': student_latency[1],
+            'parameters': student.count_params(),
+            'file_bytes': os.path.getsize(student_path),
+            'input_size': list(student_size)
+        }
+    }
+    report['speedup'] = report['teacher']['latency_ms'] / report['student']['latency_ms']
+
+    print(f"{'':10} {'latency ms':>11} {'p95 ms':>8} {'params':>10} {'MB':>7}  accuracy")
+    for name in ('teacher', 'student'):
+        row = report[name]
+        accuracy = ' '.join(f"{task}={value:.2%}" for task, value in row['accuracy'].items())
+        print(f"{name:10} {row['latency_ms']:11.1f} {row['latency_p95_ms']:8.1f} {row['parameters']:10,} "
+              f"{row['file_bytes'] / 1e6:7.1f}  {accuracy}")
+    print(f"Student is {report['speedup']:.1f}x faster")
+
+    os.makedirs(os.path.dirname(str(report_path)), exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,310 @@
+import html
+import json
+import math
+import multiprocessing
+import os
+import time
+import traceback
+import numpy as np
+from utils.dataset_index import IMAGE_EXTENSIONS, DatasetIndex, task_split
+from utils.training import TRAINING_JOBS, _import_tensorflow, allot_cores, available_cores, run_worker_processes
+from config import (DATA_DIR, IMG_SIZE, MODELS_DIR, MODEL_VARIANT, CONFIDENCE_THRESHOLD, EVALUATION_WORKERS,
+                    EVALUATION_BATCH_SIZE, TARGET_DEFECT_RECALL, EVALUATION_REPORT_PATH)
+
+
+def labelled_images(data_dir=None, tasks=TRAINING_JOBS):
+    """[(image path, task, class index)] to evaluate on.
+
+    From data_dir laid out like the training data (<task>/<class>/image),
+    or by default the validation side of each model's training split.
+    """
+    items = []
+    if data_dir is None:
+        train_data_dir = DATA_DIR / "train"
+        index = DatasetIndex(train_data_dir)
+        index.update()
+        for name, job in tasks.items():
+            _, split_items = task_split(index, name, job['labels'])
+            items.extend((os.path.join(str(train_data_dir), *path.split('/')), name, class_index)
+                         for path, class_index in split_items['val'])
+        return items
+
+    for name, job in tasks.items():
+        for class_index, label in enumerate(job['labels']):
+            class_dir = os.path.join(str(data_dir), name, label)
+            if not os.path.isdir(class_dir):
+                continue
+            for entry in sorted(os.scandir(class_dir), key=lambda entry: entry.name):
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    items.append((entry.path, name, class_index))
+    return items
+
+
+def _evaluation_worker(worker, items, cores, models_dir, variant, batch_size, messages):
+    """Class probabilities of (position, path) items, a batch per message"""
+    try:
+        _import_tensorflow(cores)
+        from PIL import Image
+        from utils.model_loader import BottleDetectorModels
+
+        loading = time.monotonic()
+        models = BottleDetectorModels(models_dir, variant)
+        load_seconds = time.monotonic() - loading
+
+        started = time.time()
+        for start in range(0, len(items), batch_size):
+            images = []
+            positions = []
+            failed = []
+            for position, path in items[start:start + batch_size]:
+                try:
+                    with Image.open(path) as image:
+                        image = image.convert('RGB').resize((IMG_SIZE[1], IMG_SIZE[0]), Image.NEAREST)
+                        images.append(np.asarray(image))
+                    positions.append(position)
+                except OSError as e:
+                    failed.append((path, str(e)))
+            predictions = dict(zip(TRAINING_JOBS, models.predict_batch(np.stack(images)))) if images else {}
+            messages.put({'event': 'batch', 'positions': positions, 'predictions': predictions, 'failed': failed})
+        messages.put({'event': 'finished', 'worker': worker, 'images': len(items), 'load_seconds': load_seconds,
+                      'started': started, 'finished': time.time()})
+    except Exception as e:
+        messages.put({'event': 'failed', 'worker': worker, 'error': str(e), 'traceback': traceback.format_exc()})
+    messages.put({'event': 'done', 'worker': worker})
+
+
+def classification_metrics(labels, probabilities, class_names):
+    """Accuracy, confusion matrix (rows: true class) and per-class precision/recall/F1"""
+    predicted = np.argmax(probabilities, axis=1)
+    confusion = np.zeros((len(class_names), len(class_names)), dtype=int)
+    np.add.at(confusion, (labels, predicted), 1)
+    classes = {}
+    for i, name in enumerate(class_names):
+        true_positives = confusion[i, i]
+        precision = float(true_positives / confusion[:, i].sum()) if confusion[:, i].sum() else None
+        recall = float(true_positives / confusion[i].sum()) if confusion[i].sum() else None
+        f1 = 2 * precision * recall / (precision + recall) if precision and recall else None
+        classes[name] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': int(confusion[i].sum())}
+    return {'images': int(len(labels)), 'accuracy': float(np.trace(confusion) / max(1, len(labels))),
+            'confusion_matrix': confusion.tolist(), 'classes': classes}
+
+
+def defect_detection(is_defect, flagged, confidence, threshold):
+    """Recall and precision on defects when classifications at or below threshold are dropped.
+
+    That is what the detector does with CONFIDENCE_THRESHOLD: a defective
+    bottle classified with low confidence is never recorded.
+    """
+    accepted = confidence > threshold
+    caught = int(np.sum(is_defect & flagged & accepted))
+    reported = int(np.sum(flagged & accepted))
+    defects = int(np.sum(is_defect))
+    return {'threshold': float(threshold),
+            'recall': caught / defects if defects else None,
+            'precision': caught / reported if reported else None,
+            'coverage': float(np.mean(accepted)) if len(accepted) else None}
+
+
+def tune_threshold(is_defect, flagged, confidence, target_recall):
+    """Highest confidence threshold that still catches target_recall of defects, or None"""
+    defects = int(np.sum(is_defect))
+    if not defects:
+        return None
+    caught = np.sort(confidence[is_defect & flagged])[::-1]
+    needed = math.ceil(target_recall * defects)
+    if needed > len(caught):
+        return None
+    # Just below the confidence of the needed-th most confident catch
+    return float(np.nextafter(caught[needed - 1], 0))
+
+
+def evaluate_models(data_dir=None, models_dir=MODELS_DIR, variant=MODEL_VARIANT, workers=EVALUATION_WORKERS,
+                    batch_size=EVALUATION_BATCH_SIZE, target_recall=TARGET_DEFECT_RECALL,
+                    report_path=EVALUATION_REPORT_PATH):
+    """Run the deployed models over labelled images and report how they do.
+
+    Images are split across worker processes, each pinned to its own cores
+    and predicting in large batches. The report (returned, and written as
+    JSON and HTML) holds per-model accuracy, per-class precision/recall,
+    confusion matrices, throughput, and the confidence threshold that keeps
+    target_recall of defective bottles.
+    """
+    started = time.monotonic()
+    items = labelled_images(data_dir)
+    if not items:
+        print(f"No labelled images found in {data_dir or 'the validation splits'}")
+        return None
+
+    cores = available_cores()
+    workers = max(1, min(len(items) // batch_size + 1, workers or len(cores) // 4))
+    slots = allot_cores(list(range(workers)), {}, cores)
+    positioned = [(position, path) for position, (path, _, _) in enumerate(items)]
+    predictions = {name: np.full((len(items), len(job['labels'])), np.nan, dtype=np.float32)
+                   for name, job in TRAINING_JOBS.items()}
+    failed = []
+    timings = []
+    print(f"Evaluating {len(items)} images with {workers} worker processes")
+
+    def handle(message):
+        if message['event'] == 'batch':
+            for name, probabilities in message['predictions'].items():
+                predictions[name][message['positions']] = probabilities
+            failed.extend(message['failed'])
+        elif message['event'] == 'finished':
+            timings.append(message)
+        elif message['event'] == 'failed':
+            print(f"Evaluation worker {message['worker']} failed: {message['error']}")
+            print(message['traceback'])
+
+    # Spawn, not fork: every worker sets up its own thread pools before importing TensorFlow
+    context = multiprocessing.get_context('spawn')
+    run_worker_processes(context, _evaluation_worker,
+                         [(positioned[worker::workers], slots[worker], str(models_dir), variant, batch_size)
+                          for worker in range(workers)], handle, cores=slots)
+    for path, error in failed:
+        print(f"Unreadable image {path}: {error}")
+
+    evaluated = ~np.isnan(predictions[next(iter(TRAINING_JOBS))][:, 0])
+    if not np.any(evaluated):
+        print("No images were evaluated")
+        return None
+
+    # The detector's confidence: mean of both models' top probabilities
+    confidence = np.mean([np.nan_to_num(probabilities).max(axis=1) for probabilities in predictions.values()],
+                         axis=0)
+    tasks = np.array([task for _, task, _ in items])
+    labels = np.array([class_index for _, _, class_index in items])
+
+    report = {
+        'variant': variant,
+        'models_dir': str(models_dir),
+        'data': str(data_dir) if data_dir else 'validation splits',
+        'images': int(np.sum(evaluated)),
+        'unreadable': len(failed),
+        'confidence_threshold': CONFIDENCE_THRESHOLD,
+        'target_recall': target_recall,
+        'models': {}
+    }
+    thresholds = []
+    for name, job in TRAINING_JOBS.items():
+        selected = evaluated & (tasks == name)
+        if not np.any(selected):
+            continue
+        probabilities = predictions[name][selected]
+        metrics = classification_metrics(labels[selected], probabilities, job['labels'])
+
+        defect_classes = [job['labels'].index(label) for label in job['defect_labels']]
+        is_defect = np.isin(labels[selected], defect_classes)
+        flagged = np.isin(np.argmax(probabilities, axis=1), defect_classes)
+        tuned = tune_threshold(is_defect, flagged, confidence[selected], target_recall)
+        thresholds.append(tuned)
+        metrics['defects'] = {
+            'current': defect_detection(is_defect, flagged, confidence[selected], CONFIDENCE_THRESHOLD),
+            'tuned': defect_detection(is_defect, flagged, confidence[selected], tuned) if tuned is not None else None,
+            'max_recall': defect_detection(is_defect, flagged, confidence[selected], -1.0)['recall']
+        }
+        report['models'][name] = metrics
+
+    # One threshold serves every model, so it is the lowest of theirs
+    report['recommended_threshold'] = (min(thresholds) if thresholds and None not in thresholds else None)
+
+    if timings:
+        wall = max(timing['finished'] for timing in timings) - min(timing['started'] for timing in timings)
+        report['throughput'] = {
+            'images_per_second': report['images'] / wall if wall > 0 else None,
+            'inference_seconds': wall,
+            'model_load_seconds': max(timing['load_seconds'] for timing in timings),
+            'workers': workers,
+            'batch_size': batch_size
+        }
+    report['elapsed'] = time.monotonic() - started
+
+    print_report(report)
+    save_report(report, report_path)
+    return report
+
+
+def print_report(report):
+    for name, metrics in report['models'].items():
+        print(f"\n{TRAINING_JOBS[name]['title']}: accuracy {metrics['accuracy']:.2%} on {metrics['images']} images")
+        print(f"  {'class':12} {'precision':>9} {'recall':>9} {'f1':>9} {'images':>7}")
+        for label, values in metrics['classes'].items():
+            cells = ' '.join('      n/a' if values[key] is None else f"{values[key]:9.2%}"
+                             for key in ('precision', 'recall', 'f1'))
+            print(f"  {label:12} {cells} {values['support']:7}")
+        current = metrics['defects']['current']
+        print(f"  defect recall at threshold {current['threshold']:.2f}: "
+              f"{current['recall'] if current['recall'] is None else format(current['recall'], '.2%')}")
+
+    throughput = report.get('throughput')
+    if throughput and throughput['images_per_second']:
+        print(f"\nThroughput: {throughput['images_per_second']:.1f} images/s "
+              f"({throughput['workers']} workers, batches of {throughput['batch_size']})")
+    if report['recommended_threshold'] is None:
+        print(f"No confidence threshold reaches {report['target_recall']:.2%} defect recall on every model")
+    else:
+        print(f"Confidence threshold for {report['target_recall']:.2%} defect recall: "
+              f"{report['recommended_threshold']:.4f} (configured: {report['confidence_threshold']})")
+
+
+def _percent(value):
+    return 'n/a' if value is None else f"{value:.2%}"
+
+
+def render_html(report):
+    """Self-contained HTML page of an evaluation report"""
+    escape = html.escape
+    unreadable = f", {report['unreadable']} unreadable" if report['unreadable'] else ""
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Model evaluation</title>",
+        "<style>body{font-family:Arial,sans-serif;margin:24px;color:#2c3e50}"
+        "table{border-collapse:collapse;margin:8px 0 24px}td,th{border:1px solid #bdc3c7;padding:4px 10px;"
+        "text-align:right}th{background:#ecf0f1}td.label,th.label{text-align:left}</style></head><body>",
+        f"<h1>Model evaluation</h1><p>{escape(report['variant'])} models from {escape(report['models_dir'])}, "
+        f"{report['images']} images from {escape(report['data'])}{unreadable}.</p>"
+    ]
+    throughput = report.get('throughput')
+    if throughput and throughput['images_per_second']:
+        parts.append(f"<p>Throughput: {throughput['images_per_second']:.1f} images/s with "
+                     f"{throughput['workers']} workers, batches of {throughput['batch_size']}.</p>")
+    recommended = report['recommended_threshold']
+    recommended = 'not reachable' if recommended is None else f"{recommended:.4f}"
+    parts.append(f"<p>Confidence threshold for {report['target_recall']:.2%} defect recall: <b>{recommended}</b> "
+                 f"(configured: {report['confidence_threshold']}).</p>")
+
+    for name, metrics in report['models'].items():
+        labels = list(metrics['classes'])
+        parts.append(f"<h2>{escape(TRAINING_JOBS[name]['title'])}: {metrics['accuracy']:.2%} accuracy</h2>")
+        parts.append("<table><tr><th class='label'>Class</th><th>Precision</th><th>Recall</th><th>F1</th>"
+                     "<th>Images</th></tr>")
+        for label, values in metrics['classes'].items():
+            parts.append(f"<tr><td class='label'>{escape(label)}</td><td>{_percent(values['precision'])}</td>"
+                         f"<td>{_percent(values['recall'])}</td><td>{_percent(values['f1'])}</td>"
+                         f"<td>{values['support']}</td></tr>")
+        parts.append("</table><table><tr><th class='label'>True \\ predicted</th>" +
+                     ''.join(f"<th>{escape(label)}</th>" for label in labels) + "</tr>")
+        for label, row in zip(labels, metrics['confusion_matrix']):
+            parts.append(f"<tr><th class='label'>{escape(label)}</th>" +
+                         ''.join(f"<td>{count}</td>" for count in row) + "</tr>")
+        parts.append("</table><table><tr><th class='label'>Defects</th><th>Threshold</th><th>Recall</th>"
+                     "<th>Precision</th><th>Images kept</th></tr>")
+        for setting in ('current', 'tuned'):
+            values = metrics['defects'][setting]
+            if values is not None:
+                parts.append(f"<tr><td class='label'>{setting}</td><td>{values['threshold']:.4f}</td>"
+                             f"<td>{_percent(values['recall'])}</td><td>{_percent(values['precision'])}</td>"
+                             f"<td>{_percent(values['coverage'])}</td></tr>")
+        parts.append("</table>")
+    parts.append("</body></html>")
+    return '\n'.join(parts)
+
+
+def save_report(report, path=EVALUATION_REPORT_PATH):
+    path = str(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    html_path = os.path.splitext(path)[0] + '.html'
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(render_html(report))
+    print(f"Evaluation report saved to {path} and {html_path}")
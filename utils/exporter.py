@@ -0,0 +1,141 @@
+import csv
+import gzip
+import json
+import os
+from datetime import date, datetime
+from config import EXPORT_CHUNK_SIZE
+
+EXPORT_COLUMNS = ['id', 'serial_number', 'detection_date', 'water_level', 'shape_status',
+                  'confidence_score', 'is_defective', 'image_path']
+
+# File suffix -> format name
+EXPORT_FORMATS = {
+    '.csv.gz': 'csv',
+    '.jsonl.gz': 'jsonl',
+    '.parquet': 'parquet'
+}
+
+
+def export_format(path):
+    """Format name for an export file name, from its suffix"""
+    for suffix, name in EXPORT_FORMATS.items():
+        if str(path).endswith(suffix):
+            return name
+    raise ValueError(f"Unknown export format for '{path}' (use one of {', '.join(EXPORT_FORMATS)})")
+
+
+class CsvExportWriter:
+    """Gzip-compressed CSV, one row per bottle"""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlExportWriter:
+    """Gzip-compressed JSON lines, one object per bottle"""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def write(self, rows):
+        for row in rows:
+            record = {column: row[column] for column in EXPORT_COLUMNS}
+            self.file.write(json.dumps(record, default=_json_value) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """Parquet file with one row group per chunk (needs pyarrow)"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ('id', pa.int64()),
+            ('serial_number', pa.string()),
+            ('detection_date', pa.timestamp('us')),
+            ('water_level', pa.string()),
+            ('shape_status', pa.string()),
+            ('confidence_score', pa.float64()),
+            ('is_defective', pa.bool_()),
+            ('image_path', pa.string())
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='snappy')
+
+    def write(self, rows):
+        columns = {column: [row[column] for row in rows] for column in EXPORT_COLUMNS}
+        columns['is_defective'] = [None if value is None else bool(value)
+                                   for value in columns['is_defective']]
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    'csv': CsvExportWriter,
+    'jsonl': JsonlExportWriter,
+    'parquet': ParquetExportWriter
+}
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def export_bottles(database, path, fmt=None, chunk_size=EXPORT_CHUNK_SIZE,
+                   progress=None, cancel_event=None, **filters):
+    """Stream every bottle matching the filters to path.
+
+    Memory use is bounded by chunk_size whatever the range. progress is
+    called as progress(written, total) after each chunk; setting
+    cancel_event stops the export. The file is written under a temporary
+    name and only renamed into place once complete.
+
+    Returns the number of rows written, or None if cancelled.
+    """
+    fmt = fmt or export_format(path)
+    total = database.count_bottles(**filters)
+
+    temp_path = f"{path}.part"
+    writer = EXPORT_WRITERS[fmt](temp_path)
+    chunks = database.iter_bottles(chunk_size, **filters)
+    written = 0
+    completed = False
+    try:
+        for rows in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            writer.write(rows)
+            written += len(rows)
+            if progress:
+                progress(written, total)
+        else:
+            completed = True
+    finally:
+        # Release the database connection even when stopping early
+        chunks.close()
+        writer.close()
+        if completed:
+            os.replace(temp_path, path)
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return written if completed else None
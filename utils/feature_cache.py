@@ -0,0 +1,60 @@
+import hashlib
+import os
+import numpy as np
+from config import FEATURE_CACHE_DIR
+
+
+def weights_fingerprint(weights):
+    """Short hash of a list of weight arrays, e.g. a backbone's get_weights()"""
+    digest = hashlib.sha1()
+    for array in weights:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class FeatureCache:
+    """Backbone features of images, keyed by image content hash, on disk.
+
+    A feature vector only depends on the image and the backbone weights, and
+    the backbone is frozen when the heads are trained, so features are kept
+    per backbone fingerprint and reused by every run on top of it. Only
+    images not seen before go through the backbone.
+    """
+
+    def __init__(self, fingerprint, cache_dir=FEATURE_CACHE_DIR):
+        self.path = os.path.join(str(cache_dir), f"{fingerprint}.npz")
+        self.features = {}
+        self.added = 0
+        try:
+            with np.load(self.path) as cached:
+                self.features = dict(zip(cached['keys'].tolist(), cached['features']))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable feature cache {self.path}: {e}")
+
+    def get_many(self, keys, load, extract, batch_size=32):
+        """Features of keys as an (N, D) array.
+
+        On a miss load(key) gives the model input for that image and
+        extract(batch) runs a batch of inputs through the backbone.
+        """
+        missing = [key for key in dict.fromkeys(keys) if key not in self.features]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            for key, feature in zip(batch, extract(np.stack([load(key) for key in batch]))):
+                self.features[key] = np.asarray(feature, dtype=np.float32)
+            self.added += len(batch)
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([self.features[key] for key in keys])
+
+    def save(self):
+        if not self.added:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp.npz'
+        keys = list(self.features)
+        np.savez(temp_path, keys=np.array(keys), features=np.stack([self.features[key] for key in keys]))
+        os.replace(temp_path, self.path)
+        self.added = 0
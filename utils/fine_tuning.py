@@ -0,0 +1,296 @@
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tensorflow.keras.layers import GlobalAveragePooling2D, Input
+from tensorflow.keras.models import Model, clone_model, load_model
+from tensorflow.keras.optimizers import Adam
+from config import (DATA_DIR, IMG_SIZE, TRAINING_LOG_PATH, FINETUNE_EPOCHS,
+                    FINETUNE_LEARNING_RATE, FINETUNE_REPLAY_SAMPLES, FINETUNE_VALIDATION_SAMPLES,
+                    FINETUNE_HOLDOUT_FRACTION, FINETUNE_MAX_REGRESSION, FINETUNE_STATE_PATH)
+from utils.dataset_index import DatasetIndex, task_split
+from utils.feature_cache import FeatureCache, weights_fingerprint
+from utils.model_registry import ModelRegistry, model_files
+from utils.training import TRAINING_JOBS, TrainingLog
+
+
+def image_array(image_bytes):
+    """Model input for encoded image bytes, prepared as in training (RGB, nearest resize, 0-1)"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert('RGB').resize((IMG_SIZE[1], IMG_SIZE[0]), Image.NEAREST)
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def split_head(model):
+    """(backbone, head) of a classifier, sharing its layers.
+
+    The backbone runs up to the global pooling layer, the head from there to
+    the output; training the head updates the model's own weights.
+    """
+    pooling = max(index for index, layer in enumerate(model.layers)
+                  if isinstance(layer, GlobalAveragePooling2D))
+    features = model.layers[pooling].output
+    backbone = Model(model.input, features)
+    head_input = Input(shape=features.shape[1:])
+    x = head_input
+    for layer in model.layers[pooling + 1:]:
+        x = layer(x)
+    return backbone, Model(head_input, x)
+
+
+def is_held_out(bottle_id, fraction=FINETUNE_HOLDOUT_FRACTION):
+    """Stable choice of the production samples kept for validation"""
+    return int(hashlib.sha1(str(bottle_id).encode()).hexdigest()[:8], 16) < fraction * 0x100000000
+
+
+def accuracy(model, features, labels):
+    if len(labels) == 0:
+        return None
+    predictions = model.predict(features, batch_size=256, verbose=0)
+    return float(np.mean(np.argmax(predictions, axis=1) == labels))
+
+
+class FineTuner:
+    """Adapts the active classifiers to operator-labelled production images.
+
+    Only the classification heads are trained, from the weights of the
+    model version in service (see utils.model_registry), on
+    the labelled production samples mixed with a replay sample of the
+    original training images. Backbone features come from a content-keyed
+    cache, so a run costs a few head epochs on feature vectors plus one
+    backbone pass over images not seen before: minutes on a CPU.
+
+    A model is replaced only if it is at least as accurate on the held-out
+    production samples and loses no more than max_regression on held-out
+    original images. The replacements, with the unchanged models, are
+    published as a new registry version and activated; running detectors
+    switch to it and the previous version stays available for rollback.
+    """
+
+    def __init__(self, database, registry=None, train_data_dir=DATA_DIR / "train",
+                 state_path=FINETUNE_STATE_PATH, log_path=TRAINING_LOG_PATH,
+                 max_regression=FINETUNE_MAX_REGRESSION):
+        self.database = database
+        self.registry = registry or ModelRegistry()
+        self.train_data_dir = str(train_data_dir)
+        self.state_path = str(state_path)
+        self.log = TrainingLog(log_path)
+        self.max_regression = max_regression
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable fine-tuning state {self.state_path}: {e}")
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def run(self, force=False):
+        """Fine-tune every model if there are labels newer than the last run.
+
+        Returns {model name: result}.
+        """
+        samples = self.database.get_labelled_samples()
+        if not samples:
+            print("No labelled production samples to fine-tune on")
+            return {}
+
+        newest = max(sample['labelled_at'] for sample in samples)
+        last = self.state.get('labelled_at')
+        if not force and last and newest <= datetime.fromisoformat(last):
+            print("No new labels since the last fine-tuning run")
+            return {}
+
+        base = self.registry.current()
+        if base is None or self.registry.metadata(base)['variant'] != 'teacher':
+            print("Fine-tuning needs an active teacher model version; publish one with manage_models.py")
+            return {}
+
+        images = {}
+        for sample in samples:
+            if sample['image_path']:
+                image_bytes = self.database.image_store.get(sample['image_path'])
+            else:
+                image_bytes = self.database.get_bottle_image(sample['id'])
+            if image_bytes:
+                images[sample['id']] = image_bytes
+        print(f"Fine-tuning on {len(images)} labelled production images "
+              f"({len(samples) - len(images)} without an image)")
+
+        index = DatasetIndex(self.train_data_dir)
+        index.update()
+
+        results = {}
+        failed = []
+        with tempfile.TemporaryDirectory() as staging_dir:
+            for name, job in TRAINING_JOBS.items():
+                try:
+                    results[name] = self.fine_tune(name, job, samples, images, index,
+                                                   self.registry.version_dir(base), staging_dir)
+                except Exception as e:
+                    print(f"[{name}] fine-tuning failed: {e}")
+                    results[name] = {'published': False, 'reason': str(e)}
+                    failed.append(name)
+            if any(result['published'] for result in results.values()):
+                version = self.publish(base, results, staging_dir)
+                for result in results.values():
+                    if result['published']:
+                        result['version'] = version
+        for name, result in results.items():
+            self.log.write({'event': 'fine_tune', 'job': name, 'base_version': base, **result})
+
+        # A crashed model is retried on the next run, with the same labels
+        if failed:
+            print(f"Fine-tuning of {', '.join(failed)} failed; the labels are kept for the next run")
+            return results
+        self.state['labelled_at'] = newest.isoformat()
+        self._save_state()
+        return results
+
+    def publish(self, base, results, staging_dir):
+        """Register the fine-tuned models, with the unchanged ones of base, as a
+        new version and activate it. Returns the version.
+        """
+        base_dir = self.registry.version_dir(base)
+        for file_name in model_files('teacher').values():
+            if not os.path.exists(os.path.join(staging_dir, file_name)):
+                shutil.copy2(os.path.join(base_dir, file_name), os.path.join(staging_dir, file_name))
+        version = self.registry.publish(staging_dir, 'teacher', source=f"fine-tuned from {base}")
+        self.registry.set_metrics(version, {'fine_tuning': {
+            name: {'before': result['before'], 'after': result['after']}
+            for name, result in results.items() if result['published']}})
+
+        # Never replace a version activated while this run was going on
+        if self.registry.current() != base:
+            print(f"Published model version {version} but did not activate it: "
+                  f"{self.registry.current()} was activated meanwhile")
+            return version
+        self.registry.activate(version)
+        print(f"Model version {version} (fine-tuned from {base}) is active")
+        return version
+
+    def fine_tune(self, name, job, samples, images, index, base_dir, staging_dir):
+        """Fine-tune one model of base_dir; an improved model is saved to staging_dir"""
+        started = time.monotonic()
+        path = os.path.join(base_dir, job['model_file'])
+        if not os.path.exists(path):
+            print(f"[{name}] no model at {path} to fine-tune; train one first")
+            return {'published': False, 'reason': 'no model'}
+
+        class_index = {label: i for i, label in enumerate(job['labels'])}
+        production = [sample for sample in samples
+                      if sample[job['label_column']] in class_index and sample['id'] in images]
+        production_train = [sample for sample in production if not is_held_out(sample['id'])]
+        production_holdout = [sample for sample in production if is_held_out(sample['id'])]
+        if not production_train:
+            print(f"[{name}] no labelled production samples for training")
+            return {'published': False, 'reason': 'no samples'}
+
+        # Replay and validation images from the original dataset
+        _, split_items = task_split(index, name, job['labels'])
+        rng = random.Random(0)
+        dataset_train, dataset_val = split_items['train'], split_items['val']
+        replay = rng.sample(dataset_train, min(FINETUNE_REPLAY_SAMPLES, len(dataset_train)))
+        validation = rng.sample(dataset_val, min(FINETUNE_VALIDATION_SAMPLES, len(dataset_val)))
+
+        model = load_model(path)
+        backbone, head = split_head(model)
+        cache = FeatureCache(weights_fingerprint(backbone.get_weights()))
+
+        # Everything is keyed by image content, so the cache also serves
+        # identical images seen under another name
+        readers = {}
+
+        def dataset_keys(items):
+            keys = []
+            for relative_path, _ in items:
+                key = index.entries[relative_path]['sha256']
+                full_path = os.path.join(self.train_data_dir, *relative_path.split('/'))
+                readers[key] = lambda full_path=full_path: Path(full_path).read_bytes()
+                keys.append(key)
+            return keys
+
+        def production_keys(items):
+            keys = []
+            for sample in items:
+                image_bytes = images[sample['id']]
+                key = hashlib.sha256(image_bytes).hexdigest()
+                readers[key] = lambda image_bytes=image_bytes: image_bytes
+                keys.append(key)
+            return keys
+
+        def features(keys):
+            return cache.get_many(keys, lambda key: image_array(readers[key]()),
+                                  lambda batch: backbone.predict(batch, verbose=0))
+
+        x_production = features(production_keys(production_train))
+        y_production = np.array([class_index[sample[job['label_column']]] for sample in production_train])
+        x_replay = features(dataset_keys(replay))
+        y_replay = np.array([label for _, label in replay], dtype=int)
+        x_holdout = features(production_keys(production_holdout))
+        y_holdout = np.array([class_index[sample[job['label_column']]] for sample in production_holdout])
+        x_val = features(dataset_keys(validation))
+        y_val = np.array([label for _, label in validation], dtype=int)
+        cache.save()
+
+        x_train = np.concatenate([x for x in (x_production, x_replay) if len(x)])
+        y_train = np.concatenate([y_production, y_replay]).astype(int)
+        # The few production samples carry as much weight as the replay, up to 10x each
+        production_weight = min(10.0, max(1.0, len(replay) / len(production_train)))
+        weights = np.concatenate([np.full(len(production_train), production_weight), np.ones(len(replay))])
+
+        candidate = clone_model(head)
+        candidate.set_weights(head.get_weights())
+        candidate.compile(optimizer=Adam(learning_rate=FINETUNE_LEARNING_RATE),
+                          loss='categorical_crossentropy', metrics=['accuracy'])
+        candidate.fit(x_train, tf.keras.utils.to_categorical(y_train, len(class_index)),
+                      sample_weight=weights, epochs=FINETUNE_EPOCHS, batch_size=32, shuffle=True, verbose=0)
+
+        before = {'validation': accuracy(head, x_val, y_val), 'production': accuracy(head, x_holdout, y_holdout)}
+        after = {'validation': accuracy(candidate, x_val, y_val),
+                 'production': accuracy(candidate, x_holdout, y_holdout)}
+        regressions = []
+        if before['validation'] is not None and after['validation'] < before['validation'] - self.max_regression:
+            regressions.append('validation')
+        if before['production'] is not None and after['production'] < before['production']:
+            regressions.append('production')
+
+        result = {
+            'published': not regressions,
+            'before': before,
+            'after': after,
+            'samples': len(production_train),
+            'holdout': len(production_holdout),
+            'replay': len(replay),
+            'validation_images': len(validation),
+            'elapsed': time.monotonic() - started
+        }
+        if regressions:
+            result['reason'] = f"regressed on held-out {' and '.join(regressions)} images"
+            print(f"[{name}] not published: {result['reason']} "
+                  f"(before {before}, after {after})")
+            return result
+
+        head.set_weights(candidate.get_weights())
+        model.save(os.path.join(staging_dir, job['model_file']))
+        print(f"[{name}] improved (held-out accuracy {before} -> {after}, {result['elapsed']:.0f}s)")
+        return result
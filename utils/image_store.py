@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+from config import IMAGE_STORE_DIR
+
+
+class ImageStore:
+    """Content-addressed on-disk store for bottle ROI images.
+
+    Images are named by the SHA-256 of their bytes and sharded into two
+    directory levels (ab/cd/abcd....jpg), so identical images are stored
+    once and no directory grows too large. The relative path is what goes
+    into bottles.image_path.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR, extension='.jpg'):
+        self.root = str(root)
+        self.extension = extension
+        os.makedirs(self.root, exist_ok=True)
+
+    def relative_path(self, digest):
+        return os.path.join(digest[:2], digest[2:4], digest + self.extension).replace(os.sep, '/')
+
+    def full_path(self, relative_path):
+        return os.path.join(self.root, *relative_path.split('/'))
+
+    def put(self, image_bytes):
+        """Store image bytes atomically and return their relative path"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        relative_path = self.relative_path(digest)
+        path = self.full_path(relative_path)
+        if os.path.exists(path):
+            return relative_path
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temp file in the same directory, then rename over the
+        # final name, so readers never see a partially written image
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return relative_path
+
+    def get(self, relative_path):
+        """Return the stored bytes, or None if missing"""
+        try:
+            with open(self.full_path(relative_path), 'rb') as f:
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def exists(self, relative_path):
+        return os.path.exists(self.full_path(relative_path))
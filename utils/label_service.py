@@ -0,0 +1,270 @@
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+from config import (LABEL_WORKERS, LABEL_CACHE_BYTES, LABEL_BOX_SIZE, LABEL_SHEET_GRID, LABEL_SHEET_DPI,
+                    LABEL_SPOOL_DIR, LABEL_QUEUE_SIZE, LABEL_BATCH_SIZE)
+from utils.pipeline import StageQueue, DROP_NEWEST
+
+# A4 portrait, in inches
+SHEET_SIZE = (8.27, 11.69)
+
+
+def make_qr_image(serial_number, box_size=LABEL_BOX_SIZE, border=4):
+    """QR code image for a bottle serial number"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(serial_number)
+    qr.make(fit=True)
+
+    return qr.make_image(fill_color="black", back_color="white")
+
+
+def render_label(serial_number, box_size=LABEL_BOX_SIZE):
+    """PNG bytes of a label: the QR code with the serial printed underneath.
+
+    Module level so it can run in a worker process.
+    """
+    qr_image = make_qr_image(serial_number, box_size).get_image().convert('L')
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", box_size * 2)
+    except OSError:
+        font = ImageFont.load_default()
+    text_height = box_size * 3
+
+    label = Image.new('L', (qr_image.width, qr_image.height + text_height), 255)
+    label.paste(qr_image, (0, 0))
+    draw = ImageDraw.Draw(label)
+    text_width = draw.textlength(serial_number, font=font)
+    draw.text(((label.width - text_width) / 2, qr_image.height), serial_number, fill=0, font=font)
+
+    buffer = io.BytesIO()
+    label.save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+class LabelCache:
+    """LRU cache of rendered labels, bounded by total bytes"""
+
+    def __init__(self, max_bytes=LABEL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._labels = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, serial_number):
+        with self._lock:
+            label = self._labels.get(serial_number)
+            if label is None:
+                self.misses += 1
+                return None
+            self._labels.move_to_end(serial_number)
+            self.hits += 1
+            return label
+
+    def put(self, serial_number, label):
+        with self._lock:
+            if serial_number in self._labels:
+                self.size -= len(self._labels.pop(serial_number))
+            if len(label) > self.max_bytes:
+                return
+            self._labels[serial_number] = label
+            self.size += len(label)
+            while self.size > self.max_bytes:
+                _, evicted = self._labels.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_metrics(self):
+        with self._lock:
+            return {'labels': len(self._labels), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class LabelService:
+    """Renders bottle labels in a process pool and lays them out on sheets.
+
+    stream() yields labels in order as they are rendered, for printers that
+    take one label at a time; save_sheets() writes PNG or PDF sheet pages.
+    After start_spooling(), as a DatabaseHandler listener it renders a label
+    for every bottle once its batch is committed, on its own thread into
+    the spool directory, so the inspection pipeline only pays for a queue
+    put and no label is printed for a bottle that was never stored.
+    """
+
+    def __init__(self, workers=LABEL_WORKERS, cache=None, box_size=LABEL_BOX_SIZE):
+        self.workers = workers
+        self.cache = cache or LabelCache()
+        self.box_size = box_size
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # Spooling of labels for saved bottles
+        self.spool_dir = None
+        self.spool_queue = None
+        self.spool_thread = None
+        self.spool_stats = {'spooled': 0, 'errors': 0}
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawn, not fork: the process has camera, database and Qt threads running
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def render(self, serial_number):
+        """PNG bytes of one label (rendered in this process)"""
+        label = self.cache.get(serial_number)
+        if label is None:
+            label = render_label(serial_number, self.box_size)
+            self.cache.put(serial_number, label)
+        return label
+
+    def stream(self, serial_numbers, batch_size=LABEL_BATCH_SIZE):
+        """Yield (serial, PNG bytes) in order, rendering batches in the pool.
+
+        serial_numbers may be any iterable (e.g. a generator over a large
+        export); at most one batch of labels is held in memory.
+        """
+        batch = []
+        for serial_number in serial_numbers:
+            batch.append(serial_number)
+            if len(batch) >= batch_size:
+                yield from self._render_batch(batch)
+                batch = []
+        if batch:
+            yield from self._render_batch(batch)
+
+    def render_batch(self, serial_numbers):
+        """{serial: PNG bytes} for a list of serials"""
+        return dict(self.stream(serial_numbers))
+
+    def _render_batch(self, serial_numbers):
+        labels = {serial_number: self.cache.get(serial_number) for serial_number in serial_numbers}
+        missing = [serial_number for serial_number, label in labels.items() if label is None]
+        if missing:
+            chunksize = max(1, len(missing) // (self.workers * 4))
+            rendered = self._get_executor().map(render_label, missing,
+                                                [self.box_size] * len(missing), chunksize=chunksize)
+            for serial_number, label in zip(missing, rendered):
+                self.cache.put(serial_number, label)
+                labels[serial_number] = label
+        for serial_number in serial_numbers:
+            yield serial_number, labels[serial_number]
+
+    def sheets(self, serial_numbers, grid=LABEL_SHEET_GRID, dpi=LABEL_SHEET_DPI):
+        """Yield printable sheet images with grid (columns, rows) labels each"""
+        columns, rows = grid
+        width, height = int(SHEET_SIZE[0] * dpi), int(SHEET_SIZE[1] * dpi)
+        cell_width, cell_height = width // columns, height // rows
+        per_sheet = columns * rows
+
+        sheet = None
+        position = 0
+        for serial_number, label in self.stream(serial_numbers, batch_size=per_sheet):
+            if sheet is None:
+                sheet = Image.new('L', (width, height), 255)
+            image = Image.open(io.BytesIO(label))
+            # Nearest neighbour keeps the QR modules sharp
+            scale = 0.9 * min(cell_width / image.width, cell_height / image.height)
+            image = image.resize((int(image.width * scale), int(image.height * scale)), Image.NEAREST)
+            column, row = position % columns, position // columns
+            sheet.paste(image, (column * cell_width + (cell_width - image.width) // 2,
+                                row * cell_height + (cell_height - image.height) // 2))
+            position += 1
+            if position == per_sheet:
+                yield sheet
+                sheet, position = None, 0
+        if sheet is not None:
+            yield sheet
+
+    def save_sheets(self, serial_numbers, path, grid=LABEL_SHEET_GRID, dpi=LABEL_SHEET_DPI):
+        """Write label sheets to a PDF (one page per sheet) or numbered PNGs.
+
+        Pages are written as they are laid out. Returns the number of pages.
+        """
+        base, extension = os.path.splitext(str(path))
+        pages = 0
+        for sheet in self.sheets(serial_numbers, grid, dpi):
+            if extension.lower() == '.pdf':
+                sheet.save(path, format='PDF', resolution=dpi, append=pages > 0)
+            else:
+                sheet.save(f"{base}_{pages + 1:03d}.png", format='PNG', dpi=(dpi, dpi))
+            pages += 1
+        return pages
+
+    # Spooling labels for saved bottles
+    def start_spooling(self, spool_dir=LABEL_SPOOL_DIR, queue_size=LABEL_QUEUE_SIZE):
+        self.spool_dir = str(spool_dir)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        # Never block the persist stage; dropped labels show up in get_metrics
+        self.spool_queue = StageQueue('labels', queue_size, DROP_NEWEST)
+        self.spool_thread = threading.Thread(target=self._spool_loop, name="label-spool")
+        self.spool_thread.daemon = True
+        self.spool_thread.start()
+
+    def _spool_loop(self):
+        while True:
+            serial_number = self.spool_queue.get(timeout=0.5)
+            if serial_number is None:
+                if self.spool_queue.closed:
+                    return
+                continue
+
+            # Render whatever queued up meanwhile as one batch
+            batch = [serial_number]
+            while len(batch) < LABEL_BATCH_SIZE:
+                serial_number = self.spool_queue.get(timeout=0)
+                if serial_number is None:
+                    break
+                batch.append(serial_number)
+
+            try:
+                for serial_number, label in self._render_batch(batch):
+                    self._spool(serial_number, label)
+            except Exception as e:
+                self.spool_stats['errors'] += len(batch)
+                print(f"Error rendering labels: {e}")
+
+    def _spool(self, serial_number, label):
+        # Written under a temporary name so the printer never picks up half a file
+        path = os.path.join(self.spool_dir, f"{serial_number}.png")
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(label)
+        os.replace(temp_path, path)
+        self.spool_stats['spooled'] += 1
+
+    def get_metrics(self):
+        metrics = {'cache': self.cache.get_metrics(), 'spool': dict(self.spool_stats)}
+        if self.spool_queue is not None:
+            metrics['spool'].update(self.spool_queue.get_metrics())
+        return metrics
+
+    # DatabaseHandler listener interface
+    def bottle_saved(self, record):
+        pass
+
+    def bottles_flushed(self, records, committed=True):
+        if self.spool_queue is not None and committed:
+            for record in records:
+                self.spool_queue.put(record[0])
+
+    def close(self):
+        if self.spool_queue is not None:
+            self.spool_queue.close()
+            self.spool_thread.join(timeout=10)
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,126 @@
+import threading
+from datetime import date
+from config import STATS_RECONCILE_INTERVAL
+from utils.database_handler import is_defective_bottle
+
+
+class LiveStatistics:
+    """In-process today/overall bottle counts served without SQL.
+
+    Seeded from the database once, then updated in O(1) from every saved
+    bottle. Bottles still waiting in the write-behind queue are tracked
+    separately so that a background reconciliation with the database
+    neither loses nor double counts them.
+    """
+
+    def __init__(self, database, reconcile_interval=STATS_RECONCILE_INTERVAL):
+        self.database = database
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.thread = None
+
+        # Committed counts as of the last reconciliation
+        self.base_day = date.today()
+        self.base_today = [0, 0]    # [perfect, defective]
+        self.base_overall = [0, 0]
+        # Counts saved since, keyed by day: committed ones until the next
+        # reconciliation, pending ones until the writer flushes them
+        self.committed = {}
+        self.pending = {}
+        self.flushes = 0    # committed batches seen, to detect one during reconcile
+
+        database.add_listener(self)
+
+    def start(self):
+        """Seed from the database and start periodic reconciliation"""
+        self.reconcile()
+        self.thread = threading.Thread(target=self._reconcile_loop, name="stats-reconcile")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def _reconcile_loop(self):
+        while not self._stop_event.wait(self.reconcile_interval):
+            self.reconcile()
+
+    def reconcile(self, attempts=3):
+        """Replace the committed counts with the database's.
+
+        The writer is never held up: if a batch was committed while the
+        totals were read, it is unknown whether they include it, so they are
+        read again. Without such a batch every bottle is either in the
+        result or still pending.
+        """
+        for _ in range(attempts):
+            with self._lock:
+                flushes = self.flushes
+            today_stats, overall_stats = self.database.get_statistics_totals()
+            if today_stats is None:
+                return False
+            with self._lock:
+                # A batch committed but not yet reported still holds flush_lock
+                if self.flushes != flushes or self.database.flush_lock.locked():
+                    continue
+                self.base_day = date.today()
+                self.base_today = [today_stats['perfect_today'], today_stats['defective_today']]
+                self.base_overall = [overall_stats['perfect_total'], overall_stats['defective_total']]
+                self.committed = {}
+                self.pending = {day: counts for day, counts in self.pending.items() if any(counts)}
+            return True
+        return False
+
+    # DatabaseHandler listener interface
+    def bottle_saved(self, record):
+        day, index = self._key(record)
+        with self._lock:
+            counts = self.pending.setdefault(day, [0, 0])
+            counts[index] += 1
+
+    def bottles_flushed(self, records, committed=True):
+        with self._lock:
+            if committed:
+                self.flushes += 1
+            for record in records:
+                day, index = self._key(record)
+                pending = self.pending.get(day)
+                if pending and pending[index] > 0:
+                    pending[index] -= 1
+                # Bottles that failed to save simply disappear from the counts
+                if committed:
+                    counts = self.committed.setdefault(day, [0, 0])
+                    counts[index] += 1
+
+    def _key(self, record):
+        detected_at, water_level, shape_status = record[1], record[2], record[3]
+        return detected_at.date(), 1 if is_defective_bottle(water_level, shape_status) else 0
+
+    def get_statistics(self):
+        """Today/overall counts in the same shape as DatabaseHandler.get_statistics"""
+        today = date.today()
+        with self._lock:
+            perfect_today, defective_today = self.base_today if self.base_day == today else (0, 0)
+            perfect_total, defective_total = self.base_overall
+            for counts in (self.committed, self.pending):
+                for day, (perfect, defective) in counts.items():
+                    perfect_total += perfect
+                    defective_total += defective
+                    if day == today:
+                        perfect_today += perfect
+                        defective_today += defective
+
+        today_stats = {
+            'perfect_today': perfect_today,
+            'defective_today': defective_today,
+            'total_today': perfect_today + defective_today
+        }
+        overall_stats = {
+            'total': perfect_total + defective_total,
+            'perfect_total': perfect_total,
+            'defective_total': defective_total
+        }
+        return today_stats, overall_stats
@@ -1,188 +1,344 @@
 import tensorflow as tf
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
 from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 import numpy as np
-from config import IMG_SIZE, WATER_LEVEL_LABELS, SHAPE_LABELS
+from config import (IMG_SIZE, WATER_LEVEL_LABELS, SHAPE_LABELS, MODEL_VARIANT, STUDENT_MODEL_FILE,
+                    MODEL_REGISTRY_POLL_SECONDS, MODEL_WARMUP_RUNS)
+import math
 import os
+import threading
+import time
+
+def build_classifier(num_classes, learning_rate=0.001):
+    """MobileNetV2 (frozen, ImageNet weights) with a small classification head"""
+    base_model = MobileNetV2(weights='imagenet', include_top=False,
+                             input_shape=(IMG_SIZE[0], IMG_SIZE[1], 3))
+    
+    # Freeze base model layers
+    for layer in base_model.layers:
+        layer.trainable = False
+    
+    x = base_model.output
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(128, activation='relu')(x)
+    x = Dropout(0.5)(x)
+    predictions = Dense(num_classes, activation='softmax')(x)
+    
+    model = Model(inputs=base_model.input, outputs=predictions)
+    model.compile(
+        optimizer=Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    return model
+
+class FileListSequence(tf.keras.utils.Sequence):
+    """Batches from an explicit list of (image path, class index), e.g. a saved split"""
+    
+    def __init__(self, items, num_classes, batch_size=32, datagen=None, shuffle=True):
+        super().__init__()
+        self.items = list(items)
+        self.num_classes = num_classes
+        self.batch_size = batch_size
+        self.datagen = datagen
+        self.shuffle = shuffle
+        self.samples = len(self.items)
+        self.on_epoch_end()
+    
+    def __len__(self):
+        return math.ceil(self.samples / self.batch_size)
+    
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.items)
+    
+    def __getitem__(self, index):
+        batch = self.items[index * self.batch_size:(index + 1) * self.batch_size]
+        images = np.empty((len(batch), IMG_SIZE[0], IMG_SIZE[1], 3), dtype=np.float32)
+        for i, (path, _) in enumerate(batch):
+            image = img_to_array(load_img(path, target_size=IMG_SIZE))
+            if self.datagen is not None:
+                image = self.datagen.random_transform(image)
+            images[i] = image / 255.0
+        labels = tf.keras.utils.to_categorical([label for _, label in batch], self.num_classes)
+        return images, labels
+
+def create_data_generators(data_dir, validation_split=0.2, batch_size=32, classes=None, split=None):
+    """Augmented training and validation generators for one class-per-folder directory.
+    
+    Pass classes (folder names) to fix the output index order, e.g. to the
+    label order predict() uses; otherwise folders are taken alphabetically.
+    
+    With a split (see utils.dataset_index) the images and the train/validation
+    assignment come from it instead: deduplicated, near-duplicates kept on
+    one side, and validation images are not augmented.
+    """
+    augmentation = dict(
+        rotation_range=20,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        fill_mode='nearest'
+    )
+    if split is not None:
+        classes = classes or split['classes']
+        index = {label: i for i, label in enumerate(classes)}
+        root = os.path.dirname(os.path.normpath(data_dir))
+        items = {subset: [(os.path.join(root, *path.split('/')), index[label])
+                          for path, label in split[subset] if label in index]
+                 for subset in ('train', 'val')}
+        return (FileListSequence(items['train'], len(classes), batch_size, ImageDataGenerator(**augmentation)),
+                FileListSequence(items['val'], len(classes), batch_size, shuffle=False))
+    
+    datagen = ImageDataGenerator(rescale=1./255, validation_split=validation_split, **augmentation)
+    
+    train_generator = datagen.flow_from_directory(
+        data_dir,
+        target_size=IMG_SIZE,
+        batch_size=batch_size,
+        class_mode='categorical',
+        classes=classes,
+        subset='training'
+    )
+    
+    val_generator = datagen.flow_from_directory(
+        data_dir,
+        target_size=IMG_SIZE,
+        batch_size=batch_size,
+        class_mode='categorical',
+        classes=classes,
+        subset='validation'
+    )
+    return train_generator, val_generator
+
+class LoadedModels:
+    """The models of one version, replaced as a whole so no prediction mixes versions"""
+    
+    def __init__(self, water_level_model=None, shape_model=None, student_model=None, version=None):
+        self.water_level_model = water_level_model
+        self.shape_model = shape_model
+        self.student_model = student_model
+        self.version = version
+    
+    def input_size(self):
+        if self.student_model is not None:
+            return tuple(self.student_model.input_shape[1:3])
+        return IMG_SIZE
 
 class BottleDetectorModels:
-    def __init__(self, models_dir='models'):
+    def __init__(self, models_dir='models', variant=MODEL_VARIANT, registry=None):
         self.models_dir = models_dir
-        self.water_level_model = None
-        self.shape_model = None
+        self.variant = variant
+        self.registry = registry
+        self.active = LoadedModels()
+        self._watcher = None
+        self._stop_watching = threading.Event()
         self.load_models()
     
+    # The active version's models; assigning replaces the whole set
+    @property
+    def water_level_model(self):
+        return self.active.water_level_model
+    
+    @property
+    def shape_model(self):
+        return self.active.shape_model
+    
+    @property
+    def student_model(self):
+        return self.active.student_model
+    
     def load_models(self):
-        """Load pre-trained models"""
+        """Load pre-trained models.
+        
+        With a registry, its active version is loaded; a version that fails
+        to load is marked failed and the registry rolled back to the one
+        before it. Without one (or if no version loads) the models are read
+        from models_dir.
+        """
+        if self.registry is not None:
+            version = self.registry.current()
+            while version is not None:
+                try:
+                    self.active = self.load_version(version)
+                    print(f"Model version {version} loaded successfully")
+                    return
+                except Exception as e:
+                    print(f"Error loading model version {version}: {e}")
+                    self.registry.mark_failed(version, str(e))
+                    version = self.registry.rollback()
+            print(f"No usable model version in the registry, loading models from {self.models_dir}")
+        self.active = self.load_directory(self.models_dir, self.variant)
+    
+    def load_directory(self, models_dir, variant, required=False):
+        """LoadedModels from the model files in models_dir.
+        
+        With the 'student' variant the distilled model predicts both labels;
+        if it is missing the two full-size models are used. With required,
+        missing files and load errors raise instead of being reported.
+        """
+        loaded = LoadedModels()
         try:
-            water_level_path = os.path.join(self.models_dir, 'water_level_model.h5')
-            shape_path = os.path.join(self.models_dir, 'shape_model.h5')
+            if variant == 'student':
+                student_path = os.path.join(models_dir, STUDENT_MODEL_FILE)
+                if os.path.exists(student_path):
+                    loaded.student_model = load_model(student_path, compile=False)
+                    print("Student model loaded successfully")
+                    return loaded
+                if required:
+                    raise FileNotFoundError(f"Student model not found at {student_path}")
+                print(f"Student model not found at {student_path}, using the full models")
+            
+            water_level_path = os.path.join(models_dir, 'water_level_model.h5')
+            shape_path = os.path.join(models_dir, 'shape_model.h5')
             
             if os.path.exists(water_level_path):
-                self.water_level_model = load_model(water_level_path)
+                loaded.water_level_model = load_model(water_level_path)
                 print("Water level model loaded successfully")
+            elif required:
+                raise FileNotFoundError(f"Water level model not found at {water_level_path}")
             else:
                 print(f"Water level model not found at {water_level_path}")
                 
             if os.path.exists(shape_path):
-                self.shape_model = load_model(shape_path)
+                loaded.shape_model = load_model(shape_path)
                 print("Shape model loaded successfully")
+            elif required:
+                raise FileNotFoundError(f"Shape model not found at {shape_path}")
             else:
                 print(f"Shape model not found at {shape_path}")
                 
         except Exception as e:
+            if required:
+                raise
             print(f"Error loading models: {e}")
+        return loaded
     
-    def create_models(self):
-        """Create models from scratch"""
-        # Water level model
-        base_model1 = MobileNetV2(weights='imagenet', include_top=False, 
-                                 input_shape=(IMG_SIZE[0], IMG_SIZE[1], 3))
-        
-        # Freeze base model layers
-        for layer in base_model1.layers:
-            layer.trainable = False
-        
-        x = base_model1.output
-        x = GlobalAveragePooling2D()(x)
-        x = Dense(128, activation='relu')(x)
-        x = Dropout(0.5)(x)
-        predictions = Dense(len(WATER_LEVEL_LABELS), activation='softmax')(x)
+    def load_version(self, version, warmup_runs=MODEL_WARMUP_RUNS):
+        """LoadedModels of a registry version, checked and warmed up.
         
-        self.water_level_model = Model(inputs=base_model1.input, outputs=predictions)
+        The first calls of a freshly loaded model build its graph and are
+        much slower than the rest, so they are made here rather than on
+        the first bottle after a swap.
+        """
+        metadata = self.registry.verify(version)
+        loaded = self.load_directory(self.registry.version_dir(version), metadata['variant'], required=True)
+        loaded.version = version
         
-        # Shape model
-        base_model2 = MobileNetV2(weights='imagenet', include_top=False,
-                                 input_shape=(IMG_SIZE[0], IMG_SIZE[1], 3))
-        
-        for layer in base_model2.layers:
-            layer.trainable = False
-        
-        y = base_model2.output
-        y = GlobalAveragePooling2D()(y)
-        y = Dense(128, activation='relu')(y)
-        y = Dropout(0.5)(y)
-        shape_predictions = Dense(len(SHAPE_LABELS), activation='softmax')(y)
-        
-        self.shape_model = Model(inputs=base_model2.input, outputs=shape_predictions)
-        
-        # Compile models
-        self.water_level_model.compile(
-            optimizer=Adam(learning_rate=0.001),
-            loss='categorical_crossentropy',
-            metrics=['accuracy']
-        )
-        
-        self.shape_model.compile(
-            optimizer=Adam(learning_rate=0.001),
-            loss='categorical_crossentropy',
-            metrics=['accuracy']
-        )
+        image = np.random.randint(0, 256, (*loaded.input_size(), 3)).astype(np.float32)
+        for _ in range(warmup_runs):
+            result = self._predict_with(loaded, image)
+        if not np.isfinite(result['overall_confidence']):
+            raise ValueError(f"Model version {version} gives non-finite predictions")
+        return loaded
+    
+    def reload(self, version):
+        """Load and warm up a registry version, then swap it in.
         
+        The swap is a single assignment: a prediction in progress finishes
+        on the old models and the next frame uses the new ones. A version
+        that fails is marked failed and, if it is the active one, the
+        registry is rolled back. Returns whether the swap happened.
+        """
+        started = time.monotonic()
+        try:
+            loaded = self.load_version(version)
+        except Exception as e:
+            print(f"Model version {version} failed, keeping {self.active.version or 'the current models'}: {e}")
+            self.registry.mark_failed(version, str(e))
+            if self.registry.current() == version:
+                self.registry.rollback()
+            return False
+        self.active = loaded
+        print(f"Switched to model version {version} ({time.monotonic() - started:.1f}s to load and warm up)")
+        return True
+    
+    def start_watching(self, interval=MODEL_REGISTRY_POLL_SECONDS):
+        """Poll the registry and swap in newly activated versions, from a background thread"""
+        if self.registry is None or self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="model-watcher", daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        if self._watcher is None:
+            return
+        self._stop_watching.set()
+        self._watcher.join()
+        self._watcher = None
+    
+    def _watch(self, interval):
+        while not self._stop_watching.wait(interval):
+            try:
+                version = self.registry.current()
+                if version is not None and version != self.active.version and not self.registry.is_failed(version):
+                    self.reload(version)
+            except Exception as e:
+                print(f"Error checking the model registry: {e}")
+    
+    def create_models(self):
+        """Create models from scratch"""
+        self.active = LoadedModels(build_classifier(len(WATER_LEVEL_LABELS)), build_classifier(len(SHAPE_LABELS)))
         print("Models created successfully")
     
     def train_models(self, train_data_dir, validation_split=0.2):
-        """Train both models"""
-        if self.water_level_model is None or self.shape_model is None:
-            self.create_models()
-        
-        # Data augmentation
-        datagen = ImageDataGenerator(
-            rescale=1./255,
-            rotation_range=20,
-            width_shift_range=0.2,
-            height_shift_range=0.2,
-            shear_range=0.2,
-            zoom_range=0.2,
-            horizontal_flip=True,
-            validation_split=validation_split,
-            fill_mode='nearest'
-        )
+        """Train both models, in parallel processes, and load the results.
         
-        # Train water level model
-        water_level_train_dir = os.path.join(train_data_dir, 'water_level')
-        water_level_train_generator = datagen.flow_from_directory(
-            water_level_train_dir,
-            target_size=IMG_SIZE,
-            batch_size=32,
-            class_mode='categorical',
-            subset='training'
-        )
-        
-        water_level_val_generator = datagen.flow_from_directory(
-            water_level_train_dir,
-            target_size=IMG_SIZE,
-            batch_size=32,
-            class_mode='categorical',
-            subset='validation'
-        )
-        
-        # Train shape model
-        shape_train_dir = os.path.join(train_data_dir, 'shape')
-        shape_train_generator = datagen.flow_from_directory(
-            shape_train_dir,
-            target_size=IMG_SIZE,
-            batch_size=32,
-            class_mode='categorical',
-            subset='training'
-        )
-        
-        shape_val_generator = datagen.flow_from_directory(
-            shape_train_dir,
-            target_size=IMG_SIZE,
-            batch_size=32,
-            class_mode='categorical',
-            subset='validation'
-        )
-        
-        # Train water level model
-        print("Training water level model...")
-        water_level_history = self.water_level_model.fit(
-            water_level_train_generator,
-            steps_per_epoch=water_level_train_generator.samples // 32,
-            validation_data=water_level_val_generator,
-            validation_steps=water_level_val_generator.samples // 32,
-            epochs=50,
-            verbose=1
-        )
-        
-        # Train shape model
-        print("Training shape model...")
-        shape_history = self.shape_model.fit(
-            shape_train_generator,
-            steps_per_epoch=shape_train_generator.samples // 32,
-            validation_data=shape_val_generator,
-            validation_steps=shape_val_generator.samples // 32,
-            epochs=50,
-            verbose=1
-        )
-        
-        # Save models
-        os.makedirs(self.models_dir, exist_ok=True)
-        self.water_level_model.save(os.path.join(self.models_dir, 'water_level_model.h5'))
-        self.shape_model.save(os.path.join(self.models_dir, 'shape_model.h5'))
-        
-        print("Models trained and saved successfully")
+        Returns {model name: history dict}.
+        """
+        from utils.training import train_in_parallel
+        histories = train_in_parallel(train_data_dir, models_dir=self.models_dir,
+                                      validation_split=validation_split)
+        self.load_models()
+        return histories
+    
+    def predict_batch(self, images):
+        """Class probabilities for a batch of RGB images (N, H, W, 3) in 0-255.
         
-        return water_level_history, shape_history
+        Returns (water level probabilities, shape probabilities), a row per image.
+        """
+        models = self.active
+        if models.student_model is not None:
+            batch = tf.image.resize(images, models.student_model.input_shape[1:3]) / 255.0
+            water_level_pred, shape_pred = models.student_model(batch, training=False)
+            return water_level_pred.numpy(), shape_pred.numpy()
+        if models.water_level_model is None or models.shape_model is None:
+            raise ValueError("Models not loaded or created")
+        batch = tf.image.resize(images, IMG_SIZE) / 255.0
+        return (models.water_level_model(batch, training=False).numpy(),
+                models.shape_model(batch, training=False).numpy())
     
     def predict(self, image):
         """Make predictions on an image"""
-        if self.water_level_model is None or self.shape_model is None:
+        return self._predict_with(self.active, image)
+    
+    @staticmethod
+    def _predict_with(models, image):
+        if models.student_model is not None:
+            # One call for both labels, at the student's own input size;
+            # calling the model directly avoids predict()'s per-call overhead
+            image_resized = tf.image.resize(image, models.student_model.input_shape[1:3])
+            image_expanded = tf.expand_dims(image_resized / 255.0, axis=0)
+            water_level_pred, shape_pred = (output.numpy() for output in
+                                            models.student_model(image_expanded, training=False))
+        elif models.water_level_model is None or models.shape_model is None:
             raise ValueError("Models not loaded or created")
-        
-        # Preprocess image
-        image_resized = tf.image.resize(image, IMG_SIZE)
-        image_normalized = image_resized / 255.0
-        image_expanded = tf.expand_dims(image_normalized, axis=0)
-        
-        # Make predictions
-        water_level_pred = self.water_level_model.predict(image_expanded, verbose=0)
-        shape_pred = self.shape_model.predict(image_expanded, verbose=0)
+        else:
+            # Preprocess image
+            image_resized = tf.image.resize(image, IMG_SIZE)
+            image_normalized = image_resized / 255.0
+            image_expanded = tf.expand_dims(image_normalized, axis=0)
+            
+            # Make predictions
+            water_level_pred = models.water_level_model.predict(image_expanded, verbose=0)
+            shape_pred = models.shape_model.predict(image_expanded, verbose=0)
         
         # Get labels and confidence
         water_level_idx = np.argmax(water_level_pred[0])
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from utils.training import TRAINING_JOBS
+from config import IMG_SIZE, MODELS_DIR, MODEL_REGISTRY_DIR, STUDENT_IMG_SIZE, STUDENT_MODEL_FILE
+
+HISTORY_LENGTH = 20
+
+
+def model_files(variant):
+    """{role: file name} of the files that make up a model set"""
+    if variant == 'student':
+        return {'student': STUDENT_MODEL_FILE}
+    return {name: job['model_file'] for name, job in TRAINING_JOBS.items()}
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+class ModelRegistry:
+    """Versioned model sets and the pointer to the one in service.
+
+    <root>/<version>/ holds a set's model files and metadata.json (variant,
+    format, input size, labels, file digests, metrics); <root>/current.json
+    names the active version, the ones active before it and versions that
+    failed to load. Model files never change once published, so a running
+    detector can load a version while another one is being published.
+    """
+
+    def __init__(self, root=MODEL_REGISTRY_DIR):
+        self.root = str(root)
+        self.state_path = os.path.join(self.root, 'current.json')
+
+    def version_dir(self, version):
+        return os.path.join(self.root, version)
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        # Dot names are versions still being assembled by publish()
+        return sorted(entry.name for entry in os.scandir(self.root)
+                      if entry.is_dir() and not entry.name.startswith('.')
+                      and os.path.exists(os.path.join(entry.path, 'metadata.json')))
+
+    def metadata(self, version):
+        with open(os.path.join(self.version_dir(version), 'metadata.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'current': None, 'history': [], 'failed': {}}
+
+    def current(self):
+        return self._read_state()['current']
+
+    def is_failed(self, version):
+        return version in self._read_state()['failed']
+
+    def publish(self, models_dir=MODELS_DIR, variant='teacher', source=None):
+        """Copy a model set from models_dir into a new version; returns its name.
+
+        The version is not put into service; see activate().
+        """
+        files = model_files(variant)
+        for name in files.values():
+            if not os.path.exists(os.path.join(str(models_dir), name)):
+                raise FileNotFoundError(f"Model file {name} not found in {models_dir}")
+
+        version = datetime.now().strftime('%Y%m%d-%H%M%S')
+        suffix = 1
+        while os.path.exists(self.version_dir(version)):
+            suffix += 1
+            version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}"
+
+        # Assemble under a temporary name so a half-copied version is never listed
+        temp_dir = self.version_dir(f".{version}.tmp")
+        os.makedirs(temp_dir)
+        try:
+            for name in files.values():
+                shutil.copy2(os.path.join(str(models_dir), name), os.path.join(temp_dir, name))
+            if variant == 'student':
+                labels = {name: job['labels'] for name, job in TRAINING_JOBS.items()}
+            else:
+                labels = {name: TRAINING_JOBS[name]['labels'] for name in files}
+            _write_json(os.path.join(temp_dir, 'metadata.json'), {
+                'version': version,
+                'variant': variant,
+                'format': 'keras-h5',
+                'input_size': list(STUDENT_IMG_SIZE if variant == 'student' else IMG_SIZE),
+                'labels': labels,
+                'files': files,
+                'sha256': {name: _file_digest(os.path.join(temp_dir, name)) for name in files.values()},
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'source': source or str(models_dir),
+                'metrics': None
+            })
+            os.rename(temp_dir, self.version_dir(version))
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        return version
+
+    def set_metrics(self, version, metrics):
+        metadata = self.metadata(version)
+        metadata['metrics'] = metrics
+        _write_json(os.path.join(self.version_dir(version), 'metadata.json'), metadata)
+
+    def verify(self, version):
+        """Raise ValueError unless every file of a version is present and intact"""
+        metadata = self.metadata(version)
+        for name, digest in metadata['sha256'].items():
+            path = os.path.join(self.version_dir(version), name)
+            if not os.path.exists(path):
+                raise ValueError(f"{name} is missing from model version {version}")
+            if _file_digest(path) != digest:
+                raise ValueError(f"{name} of model version {version} does not match its digest")
+        return metadata
+
+    def activate(self, version):
+        """Put a version into service; running detectors pick it up on their next poll"""
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version {version}")
+        state = self._read_state()
+        if state['current'] and state['current'] != version:
+            state['history'] = (state['history'] + [state['current']])[-HISTORY_LENGTH:]
+        state['current'] = version
+        state['failed'].pop(version, None)
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self.state_path, state)
+
+    def rollback(self):
+        """Return to the most recent earlier version that has not failed; returns it, or None"""
+        state = self._read_state()
+        available = set(self.versions())
+        while state['history']:
+            version = state['history'].pop()
+            if version in available and version not in state['failed']:
+                state['current'] = version
+                _write_json(self.state_path, state)
+                return version
+        return None
+
+    def mark_failed(self, version, error):
+        state = self._read_state()
+        state['failed'][version] = error
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self.state_path, state)
@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from matplotlib.figure import Figure
+from utils.dataset_index import DatasetIndex, task_split
+from utils.training import TRAINING_JOBS, _import_tensorflow, allot_cores, available_cores, run_worker_processes
+from config import (BASE_DIR, BATCH_SIZE, EPOCHS, EARLY_STOPPING_PATIENCE, SWEEP_IMG_SIZES, SWEEP_ALPHAS,
+                    SWEEP_WORKERS, SWEEP_LATENCY_CORES, SWEEP_REPORT_PATH)
+
+
+def _classifier_head(tf, num_classes):
+    """The head build_classifier puts on the pooled backbone features"""
+    return [tf.keras.layers.Dense(128, activation='relu'),
+            tf.keras.layers.Dropout(0.5),
+            tf.keras.layers.Dense(num_classes, activation='softmax')]
+
+
+def _trial_worker(worker, variants, cores, items, epochs, messages):
+    """Validation accuracy of each (size, alpha) variant, for every task.
+
+    Backbones are frozen, so each one turns every image into a feature
+    vector once (cached on disk across sweeps) and only the heads are
+    trained, on the features. Augmentation is left out for the same reason.
+    """
+    try:
+        tf = _import_tensorflow(cores)
+        import numpy as np
+        from tensorflow.keras.applications import MobileNetV2
+        from tensorflow.keras.preprocessing.image import img_to_array, load_img
+        from utils.feature_cache import FeatureCache, weights_fingerprint
+
+        for size, alpha in variants:
+            started = time.monotonic()
+            try:
+                backbone = tf.keras.Sequential([
+                    MobileNetV2(weights='imagenet', include_top=False, alpha=alpha, input_shape=(size, size, 3)),
+                    tf.keras.layers.GlobalAveragePooling2D()
+                ])
+                cache = FeatureCache(f"{weights_fingerprint(backbone.get_weights())}_{size}")
+                paths = {key: path for subsets in items.values() for entries in subsets.values()
+                         for path, _, key in entries}
+
+                def features(entries):
+                    return cache.get_many(
+                        [key for _, _, key in entries],
+                        lambda key: img_to_array(load_img(paths[key], target_size=(size, size))) / 255.0,
+                        lambda batch: backbone(batch, training=False).numpy())
+
+                accuracy = {}
+                for task, subsets in items.items():
+                    num_classes = len(TRAINING_JOBS[task]['labels'])
+                    x_train, x_val = features(subsets['train']), features(subsets['val'])
+                    y_train = np.array([label for _, label, _ in subsets['train']])
+                    y_val = np.array([label for _, label, _ in subsets['val']])
+                    head = tf.keras.Sequential([tf.keras.Input(shape=x_train.shape[1:])] +
+                                               _classifier_head(tf, num_classes))
+                    head.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+                    head.fit(x_train, tf.keras.utils.to_categorical(y_train, num_classes),
+                             validation_data=(x_val, tf.keras.utils.to_categorical(y_val, num_classes)),
+                             epochs=epochs, batch_size=BATCH_SIZE, verbose=0,
+                             callbacks=[tf.keras.callbacks.EarlyStopping(patience=EARLY_STOPPING_PATIENCE,
+                                                                         restore_best_weights=True)])
+                    predictions = head.predict(x_val, batch_size=256, verbose=0)
+                    accuracy[task] = float(np.mean(np.argmax(predictions, axis=1) == y_val))
+                new_features = cache.added
+                cache.save()
+                messages.put({'event': 'trial', 'size': size, 'alpha': alpha, 'accuracy': accuracy,
+                              'new_features': new_features, 'elapsed': time.monotonic() - started})
+            except Exception as e:
+                messages.put({'event': 'failed', 'size': size, 'alpha': alpha, 'error': str(e),
+                              'traceback': traceback.format_exc()})
+    except Exception as e:
+        messages.put({'event': 'failed', 'size': None, 'alpha': None, 'error': str(e),
+                      'traceback': traceback.format_exc()})
+    messages.put({'event': 'done', 'worker': worker})
+
+
+def _latency_worker(worker, variants, cores, num_classes, runs, messages):
+    """Single-image latency of one complete classifier per variant (weights do not matter)"""
+    try:
+        tf = _import_tensorflow(cores)
+        from tensorflow.keras.applications import MobileNetV2
+        from utils.distillation import measure_latency
+
+        for size, alpha in variants:
+            model = tf.keras.Sequential([
+                MobileNetV2(weights=None, include_top=False, alpha=alpha, input_shape=(size, size, 3)),
+                tf.keras.layers.GlobalAveragePooling2D()
+            ] + _classifier_head(tf, num_classes))
+            median, p95 = measure_latency(lambda images: model(images, training=False), (size, size), runs)
+            messages.put({'event': 'latency', 'size': size, 'alpha': alpha, 'latency_ms': median,
+                          'latency_p95_ms': p95, 'parameters': model.count_params()})
+    except Exception as e:
+        messages.put({'event': 'failed', 'size': None, 'alpha': None, 'error': str(e),
+                      'traceback': traceback.format_exc()})
+    messages.put({'event': 'done', 'worker': worker})
+
+
+def pareto_front(results):
+    """Variants no other one beats on both latency and accuracy, fastest first"""
+    front = []
+    best = -1.0
+    for result in sorted(results, key=lambda result: (result['latency_ms'], -result['min_accuracy'])):
+        if result['min_accuracy'] > best:
+            front.append(result)
+            best = result['min_accuracy']
+    return front
+
+
+def save_sweep_plot(results, front, path):
+    figure = Figure(figsize=(9, 6))
+    ax = figure.subplots()
+    ax.scatter([result['latency_ms'] for result in results], [result['min_accuracy'] for result in results],
+               color='#95a5a6', label='Variant')
+    ax.step([result['latency_ms'] for result in front], [result['min_accuracy'] for result in front],
+            where='post', color='#e74c3c', marker='o', label='Pareto front')
+    for result in results:
+        ax.annotate(f"{result['size']}px x{result['alpha']}", (result['latency_ms'], result['min_accuracy']),
+                    textcoords='offset points', xytext=(4, 4), fontsize=7)
+    ax.set_xlabel('Latency per classifier (ms, median)')
+    ax.set_ylabel('Validation accuracy (worst model)')
+    ax.set_title('MobileNetV2 input size and width: accuracy vs latency')
+    ax.grid(True)
+    ax.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def run_sweep(train_data_dir, sizes=SWEEP_IMG_SIZES, alphas=SWEEP_ALPHAS, jobs=None, workers=SWEEP_WORKERS,
+              latency_cores=SWEEP_LATENCY_CORES, epochs=EPOCHS, min_accuracy=None, runs=50,
+              report_path=SWEEP_REPORT_PATH, plot_path=BASE_DIR / "model_sweep.png"):
+    """Train and time every input size x width variant; report the Pareto front.
+
+    Accuracy trials run in parallel processes on their own cores. Latency is
+    measured afterwards, one variant at a time on latency_cores cores, so
+    the trials do not disturb the timings. Returns the report dict.
+    """
+    started = time.monotonic()
+    tasks = list(jobs or TRAINING_JOBS)
+    index = DatasetIndex(train_data_dir)
+    index.update()
+    items = {}
+    for task in tasks:
+        _, split_items = task_split(index, task, TRAINING_JOBS[task]['labels'])
+        items[task] = {subset: [(os.path.join(str(train_data_dir), *path.split('/')), class_index,
+                                 index.entries[path]['sha256'])
+                                for path, class_index in entries]
+                       for subset, entries in split_items.items()}
+
+    variants = [(size, alpha) for size in sizes for alpha in alphas]
+    cores = available_cores()
+    workers = max(1, min(len(variants), workers or len(cores) // 4))
+    slots = allot_cores(list(range(workers)), {}, cores)
+    print(f"Sweeping {len(variants)} variants over {', '.join(tasks)} with {workers} parallel trials")
+
+    results = {}
+
+    def handle(message):
+        key = (message['size'], message['alpha'])
+        if message['event'] == 'failed':
+            print(f"Variant {message['size']}px x{message['alpha']} failed: {message['error']}")
+            print(message['traceback'])
+        elif message['event'] == 'trial':
+            accuracy = ' '.join(f"{task}={value:.2%}" for task, value in message['accuracy'].items())
+            print(f"{message['size']}px x{message['alpha']}: {accuracy} "
+                  f"({message['new_features']} images encoded, {message['elapsed']:.0f}s)")
+            results[key] = {'size': message['size'], 'alpha': message['alpha'], 'accuracy': message['accuracy'],
+                            'min_accuracy': min(message['accuracy'].values())}
+        elif message['event'] == 'latency' and key in results:
+            results[key].update({name: message[name] for name in ('latency_ms', 'latency_p95_ms', 'parameters')})
+
+    # Spawn, not fork: every worker sets up its own thread pools before importing TensorFlow
+    context = multiprocessing.get_context('spawn')
+    run_worker_processes(context, _trial_worker,
+                         [(variants[worker::workers], slots[worker], items, epochs) for worker in range(workers)],
+                         handle, cores=slots)
+    num_classes = max(len(TRAINING_JOBS[task]['labels']) for task in tasks)
+    run_worker_processes(context, _latency_worker,
+                         [([key for key in variants if key in results], cores[:latency_cores], num_classes, runs)],
+                         handle, cores=[cores[:latency_cores]])
+
+    measured = [result for result in results.values() if 'latency_ms' in result]
+    front = pareto_front(measured)
+    report = {
+        'tasks': tasks,
+        'latency_cores': min(latency_cores, len(cores)),
+        'variants': sorted(measured, key=lambda result: result['latency_ms']),
+        'pareto_front': [[result['size'], result['alpha']] for result in front],
+        'elapsed': time.monotonic() - started
+    }
+
+    print(f"\n{'variant':>14} {'ms':>7} {'p95 ms':>7} {'params':>10}  {' '.join(f'{task:>12}' for task in tasks)}")
+    for result in report['variants']:
+        marker = '*' if result in front else ' '
+        accuracy = ' '.join(f"{result['accuracy'][task]:12.2%}" for task in tasks)
+        print(f"{marker}{result['size']:>6}px x{result['alpha']:<5} {result['latency_ms']:7.1f} "
+              f"{result['latency_p95_ms']:7.1f} {result['parameters']:10,}  {accuracy}")
+    print("* Pareto front (no variant is both faster and more accurate)")
+    if min_accuracy is not None:
+        passing = [result for result in front if result['min_accuracy'] >= min_accuracy]
+        if passing:
+            report['recommended'] = [passing[0]['size'], passing[0]['alpha']]
+            print(f"Fastest variant with every model at {min_accuracy:.2%} or better: "
+                  f"{passing[0]['size']}px, width {passing[0]['alpha']} ({passing[0]['latency_ms']:.1f} ms)")
+        else:
+            print(f"No variant reaches {min_accuracy:.2%} on every model")
+
+    os.makedirs(os.path.dirname(str(report_path)), exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if measured:
+        save_sweep_plot(measured, front, str(plot_path))
+        print(f"Report saved to {report_path}, plot to {plot_path}")
+    return report
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import PERF_SAMPLES, PERF_RATE_WINDOW
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class RollingStats:
+    """The last `size` samples of a measurement, e.g. a stage latency.
+
+    Recording is a deque append, cheap enough for every frame; sorting for
+    percentiles only happens when someone asks.
+    """
+
+    def __init__(self, size=PERF_SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def values(self):
+        return list(self.samples)
+
+    def percentiles(self, points=(50, 95, 99)):
+        values = sorted(self.samples)
+        if not values:
+            return {point: None for point in points}
+        return {point: values[min(len(values) - 1, int(len(values) * point / 100))] for point in points}
+
+
+class RateMeter:
+    """Events per second over the last `window` seconds"""
+
+    def __init__(self, window=PERF_RATE_WINDOW, max_events=10000):
+        self.window = window
+        self.events = deque(maxlen=max_events)
+        self.started = None
+
+    def tick(self):
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        self.events.append(now)
+
+    def rate(self):
+        if self.started is None:
+            return 0.0
+        now = time.monotonic()
+        recent = sum(1 for timestamp in list(self.events) if now - timestamp <= self.window)
+        # Just after start the window isn't full yet; don't divide by less than a second
+        span = max(1.0, min(self.window, now - self.started))
+        return recent / span
+
+
+class ProcessMonitor:
+    """CPU usage and resident memory of this process"""
+
+    def __init__(self):
+        self._process = psutil.Process() if psutil else None
+        self._last_cpu = self._cpu_time()
+        self._last_wall = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _cpu_time(self):
+        times = os.times()
+        return times.user + times.system
+
+    def cpu_percent(self):
+        """CPU used since the previous call, in percent of one core"""
+        with self._lock:
+            cpu, wall = self._cpu_time(), time.monotonic()
+            interval = wall - self._last_wall
+            used = cpu - self._last_cpu
+            self._last_cpu, self._last_wall = cpu, wall
+        return 100.0 * used / interval if interval > 0 else 0.0
+
+    def rss(self):
+        """Resident set size in bytes, or None if unavailable"""
+        if self._process is not None:
+            return self._process.memory_info().rss
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+
+class PerformanceMonitor:
+    """Frame rates and per-stage latencies collected by the detector"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.rates = {}
+        self.process = ProcessMonitor()
+
+    def track(self, name, stats):
+        """Include an externally maintained RollingStats (e.g. database writes)"""
+        self.latencies[name] = stats
+
+    def record(self, name, seconds):
+        stats = self.latencies.get(name)
+        if stats is None:
+            stats = self.latencies.setdefault(name, RollingStats())
+        stats.add(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def tick(self, name):
+        meter = self.rates.get(name)
+        if meter is None:
+            meter = self.rates.setdefault(name, RateMeter())
+        meter.tick()
+
+    def get_metrics(self):
+        latency = {}
+        for name, stats in list(self.latencies.items()):
+            latency[name] = {
+                'percentiles': stats.percentiles(),
+                'samples': stats.values(),
+                'count': stats.count
+            }
+        return {
+            'rates': {name: meter.rate() for name, meter in list(self.rates.items())},
+            'latency': latency,
+            'cpu_percent': self.process.cpu_percent(),
+            'rss': self.process.rss()
+        }
@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import deque
+
+# Edge policies when a queue is full
+BLOCK = 'block'              # producer waits for space (backpressure)
+DROP_OLDEST = 'drop_oldest'  # discard the oldest queued item, keep the new one
+DROP_NEWEST = 'drop_newest'  # discard the new item, keep what is queued
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class StageQueue:
+    """Bounded queue connecting two pipeline stages"""
+
+    def __init__(self, name, maxsize, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}' for {name}")
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def put(self, item):
+        """Add an item, applying the edge policy when full. Returns False if dropped"""
+        with self._lock:
+            if self.closed:
+                return False
+
+            if len(self._items) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._items) >= self.maxsize and not self.closed:
+                        self._not_full.wait()
+                    if self.closed:
+                        return False
+
+            self._items.append(item)
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Remove and return the next item, or None on timeout / close"""
+        with self._lock:
+            if not self._items and not self.closed:
+                self._not_empty.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def qsize(self):
+        with self._lock:
+            return len(self._items)
+
+    def close(self):
+        """Wake up every waiting producer and consumer"""
+        with self._lock:
+            self.closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'depth': len(self._items),
+                'maxsize': self.maxsize,
+                'policy': self.policy,
+                'dropped': self.dropped
+            }
+
+
+class PipelineStage:
+    """A pipeline stage running its function on a dedicated worker thread.
+
+    The function receives one item from the input queue (or nothing for a
+    source stage) and returns a dict mapping output names to items, or None.
+    """
+
+    def __init__(self, name, func, input_queue=None, outputs=None, poll_interval=0.1):
+        self.name = name
+        self.func = func
+        self.input_queue = input_queue
+        self.outputs = outputs or {}
+        self.poll_interval = poll_interval
+        self.running = False
+        self.thread = None
+
+        # Counters (read by get_metrics from other threads)
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        self.started_at = None
+
+    def start(self):
+        self.running = True
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name=f"stage-{self.name}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def _run(self):
+        while self.running:
+            if self.input_queue is not None:
+                item = self.input_queue.get(timeout=self.poll_interval)
+                if item is None:
+                    continue
+
+            started = time.perf_counter()
+            try:
+                if self.input_queue is not None:
+                    results = self.func(item)
+                else:
+                    results = self.func()
+            except Exception as e:
+                print(f"Error in {self.name} stage: {e}")
+                self.errors += 1
+                results = None
+            finished = time.perf_counter()
+            self.busy_time += finished - started
+
+            if results is None:
+                continue
+
+            self.processed += 1
+            for output_name, result in results.items():
+                if result is not None:
+                    self.outputs[output_name].put(result)
+            self.blocked_time += time.perf_counter() - finished
+
+    def get_metrics(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            'processed': self.processed,
+            'errors': self.errors,
+            'busy_time': self.busy_time,
+            'blocked_time': self.blocked_time,
+            'elapsed': elapsed
+        }
+
+
+class Pipeline:
+    """A set of stages connected by bounded queues"""
+
+    def __init__(self):
+        self.queues = {}
+        self.stages = []
+        self._last_metrics = {}
+
+    def add_queue(self, name, maxsize, policy=BLOCK):
+        self.queues[name] = StageQueue(name, maxsize, policy)
+        return self.queues[name]
+
+    def add_stage(self, name, func, input_name=None, output_names=()):
+        input_queue = self.queues[input_name] if input_name else None
+        outputs = {output_name: self.queues[output_name] for output_name in output_names}
+        stage = PipelineStage(name, func, input_queue, outputs)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2, drain_timeout=5):
+        """Stop the stages upstream first (in the order they were added).
+
+        Each stage keeps running until its input queue is empty, so items
+        already captured, e.g. bottles waiting to be persisted, are not lost.
+        Draining gives up after drain_timeout seconds in total.
+        """
+        deadline = time.monotonic() + drain_timeout
+        for stage in self.stages:
+            if stage.input_queue is not None:
+                while stage.input_queue.qsize() and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            stage.stop()
+            stage.join(timeout=timeout)
+        for queue in self.queues.values():
+            queue.close()
+
+    def get_metrics(self):
+        """Per-stage utilization since the previous call and per-queue depth"""
+        stages = {}
+        for stage in self.stages:
+            current = stage.get_metrics()
+            previous = self._last_metrics.get(stage.name, {'busy_time': 0.0, 'blocked_time': 0.0,
+                                                           'processed': 0, 'elapsed': 0.0})
+            interval = current['elapsed'] - previous['elapsed']
+            if interval > 0:
+                utilization = (current['busy_time'] - previous['busy_time']) / interval
+                blocked = (current['blocked_time'] - previous['blocked_time']) / interval
+                rate = (current['processed'] - previous['processed']) / interval
+            else:
+                utilization = blocked = rate = 0.0
+            stages[stage.name] = {
+                'utilization': min(1.0, utilization),
+                'blocked': min(1.0, blocked),
+                'rate': rate,
+                'processed': current['processed'],
+                'errors': current['errors']
+            }
+            self._last_metrics[stage.name] = current
+
+        queues = {name: queue.get_metrics() for name, queue in self.queues.items()}
+        return {'stages': stages, 'queues': queues}
+
+    def get_bottleneck(self, metrics=None):
+        """Name of the busiest stage, i.e. the one limiting throughput"""
+        metrics = metrics or self.get_metrics()
+        if not metrics['stages']:
+            return None
+        return max(metrics['stages'].items(), key=lambda entry: entry[1]['utilization'])[0]
@@ -0,0 +1,169 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from config import (SERIAL_PREFIX, SERIAL_STATION_ID, SERIAL_BLOCK_SIZE, SERIAL_PREFETCH_THRESHOLD,
+                    SERIAL_CHECKPOINT_INTERVAL, SERIAL_STATE_PATH, DB_RETRY_DELAY)
+
+MAX_SERIAL = 10 ** 10 - 1  # serial numbers are formatted with 10 digits
+
+
+class SerialAllocator:
+    """Monotonic, station-prefixed bottle serial numbers from leased blocks.
+
+    Each station leases ranges of block_size numbers from a per-station
+    counter in the database in one statement and hands them out from
+    memory. The next block is leased in the background before the current
+    one runs out, so allocating never waits on the database. Because the
+    counter only moves forward, no two leases overlap and a serial is never
+    handed out twice, even across stations sharing a database. Every lease
+    is also checked against the bottles table, which cannot enforce unique
+    serials once it is partitioned: if the counter is behind the stored
+    serials (reset, or restored from an older backup) it skips past them.
+
+    Unused leased ranges are kept in a local state file so a restart resumes
+    where it left off. The file records a high-water mark checkpointed every
+    checkpoint_interval serials, ahead of the serials actually handed out;
+    after a crash at most that many numbers are skipped, never reused.
+    """
+
+    def __init__(self, database, station_id=SERIAL_STATION_ID, block_size=SERIAL_BLOCK_SIZE,
+                 prefetch_threshold=SERIAL_PREFETCH_THRESHOLD,
+                 checkpoint_interval=SERIAL_CHECKPOINT_INTERVAL, state_path=SERIAL_STATE_PATH):
+        self.database = database
+        self.station_id = station_id
+        self.block_size = block_size
+        self.prefetch_threshold = prefetch_threshold
+        self.checkpoint_interval = checkpoint_interval
+        self.state_path = str(state_path)
+
+        self._lock = threading.Lock()
+        self.blocks = []            # [first, end) ranges leased but not yet handed out
+        self.resume_from = 0        # numbers below this may already have been handed out
+        self._lease_thread = None
+        self._next_lease_attempt = 0.0
+        self.stats = {'allocated': 0, 'leases': 0, 'lease_failures': 0}
+
+        self._load_state()
+        self._prefetch()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable serial state {self.state_path}: {e}")
+            return
+
+        if state.get('station_id') != self.station_id:
+            print(f"Serial state belongs to station {state.get('station_id')}, leasing new serials")
+            return
+        self.resume_from = state['resume_from']
+        self.blocks = [[max(first, self.resume_from), end] for first, end in state['blocks']
+                       if end > max(first, self.resume_from)]
+
+    def _save_state(self):
+        """Atomically persist the leased ranges and high-water mark (lock held)"""
+        state = {'station_id': self.station_id, 'resume_from': self.resume_from, 'blocks': self.blocks}
+        directory = os.path.dirname(self.state_path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.state_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            print(f"Error saving serial state: {e}")
+
+    def remaining(self):
+        with self._lock:
+            return sum(end - first for first, end in self.blocks)
+
+    def _prefetch(self):
+        """Lease the next block in the background when running low"""
+        with self._lock:
+            if sum(end - first for first, end in self.blocks) > self.prefetch_threshold:
+                return
+            if self._lease_thread is not None and self._lease_thread.is_alive():
+                return
+            if time.monotonic() < self._next_lease_attempt:
+                return
+            self._lease_thread = threading.Thread(target=self._lease, name="serial-lease")
+            self._lease_thread.daemon = True
+            self._lease_thread.start()
+
+    def _lease(self):
+        try:
+            first, end = self.database.lease_serial_block(self.station_id, self.block_size)
+            highest = self.database.highest_serial(self.format_serial(first), self.format_serial(MAX_SERIAL))
+            if highest is not None:
+                print(f"Serial counter of station {self.station_id} is behind {highest}, skipping ahead")
+                self.database.advance_serial_counter(self.station_id, int(highest.rsplit('-', 1)[1]) + 1)
+                first, end = self.database.lease_serial_block(self.station_id, self.block_size)
+        except self.database.DATABASE_ERRORS as e:
+            with self._lock:
+                self.stats['lease_failures'] += 1
+                self._next_lease_attempt = time.monotonic() + DB_RETRY_DELAY
+            print(f"Error leasing serial numbers: {e}")
+            return False
+
+        with self._lock:
+            self.blocks.append([first, end])
+            self.stats['leases'] += 1
+            self._save_state()
+        return True
+
+    def next_serial(self):
+        """The next serial number for this station, or None if none could be leased"""
+        number = self._take()
+        if number is None:
+            # Nothing leased yet (first start, or the database was down):
+            # this is the only case that waits for the database
+            if self._lease_thread is not None:
+                self._lease_thread.join()
+            number = self._take()
+            if number is None:
+                if not self._lease():
+                    return None
+                number = self._take()
+                if number is None:
+                    return None
+
+        self._prefetch()
+        return self.format_serial(number)
+
+    def _take(self):
+        with self._lock:
+            if not self.blocks:
+                return None
+            block = self.blocks[0]
+            number = block[0]
+            block[0] += 1
+            if block[0] >= block[1]:
+                self.blocks.pop(0)
+
+            if number >= self.resume_from:
+                self.resume_from = number + self.checkpoint_interval
+                self._save_state()
+            self.stats['allocated'] += 1
+            return number
+
+    def format_serial(self, number):
+        # Zero padded so serials of one station also sort in allocation order
+        return f"{SERIAL_PREFIX}-{self.station_id}-{number:010d}"
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics['remaining'] = sum(end - first for first, end in self.blocks)
+        return metrics
+
+    def close(self):
+        if self._lease_thread is not None:
+            self._lease_thread.join(timeout=5)
@@ -0,0 +1,215 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from config import DB_WRITE_BEHIND, DB_RETENTION_DAYS, SQLITE_PATH
+from database.setup_database import create_sqlite_schema
+from utils.database_handler import DatabaseHandler
+
+# Store timestamps/dates as ISO text so they sort and compare as strings
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('BOOLEAN', lambda value: bool(int(value)))
+
+
+class SQLiteCursor:
+    """sqlite3 cursor accepting the %s placeholders used by DatabaseHandler"""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self.dictionary = dictionary
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace('%s', '?'), params)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(query.replace('%s', '?'), seq_of_params)
+        return self
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteDatabaseHandler(DatabaseHandler):
+    """Embedded SQLite storage backend, a drop-in for the MySQL DatabaseHandler.
+
+    Uses WAL mode so the GUI can read while the writer commits, one
+    connection per thread, and plain SQL upserts instead of stored
+    procedures. The schema is created on first use.
+    """
+
+    DATABASE_ERRORS = sqlite3.Error
+    CONNECTION_ERRORS = (sqlite3.OperationalError,)  # e.g. database locked / disk I/O
+
+    INCREMENT_STATISTICS_QUERY = """
+    INSERT INTO defect_statistics (date, total_bottles, defective_bottles, perfect_bottles,
+                                   overflow_count, low_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT(date) DO UPDATE SET
+        total_bottles = total_bottles + excluded.total_bottles,
+        defective_bottles = defective_bottles + excluded.defective_bottles,
+        perfect_bottles = perfect_bottles + excluded.perfect_bottles,
+        overflow_count = overflow_count + excluded.overflow_count,
+        low_count = low_count + excluded.low_count
+    """
+
+    INCREMENT_ROLLUP_QUERY = """
+    INSERT INTO {table} (bucket, total_bottles, defective_bottles, low_count, full_count,
+                         overflow_count, shape_defective_count, confidence_sum)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT(bucket) DO UPDATE SET
+        total_bottles = total_bottles + excluded.total_bottles,
+        defective_bottles = defective_bottles + excluded.defective_bottles,
+        low_count = low_count + excluded.low_count,
+        full_count = full_count + excluded.full_count,
+        overflow_count = overflow_count + excluded.overflow_count,
+        shape_defective_count = shape_defective_count + excluded.shape_defective_count,
+        confidence_sum = confidence_sum + excluded.confidence_sum
+    """
+
+    TODAY_STATISTICS_QUERY = """
+    SELECT
+        SUM(CASE WHEN is_defective = 0 THEN 1 ELSE 0 END) as perfect_today,
+        SUM(CASE WHEN is_defective = 1 THEN 1 ELSE 0 END) as defective_today,
+        COUNT(*) as total_today
+    FROM bottles
+    WHERE detection_date >= date('now', 'localtime')
+      AND detection_date < date('now', 'localtime', '+1 day')
+    """
+
+    TODAY_TOTALS_QUERY = """
+    SELECT total_bottles as total_today, perfect_bottles as perfect_today,
+           defective_bottles as defective_today
+    FROM defect_statistics
+    WHERE date = date('now', 'localtime')
+    """
+
+    LABEL_SAMPLE_QUERY = """
+    INSERT INTO sample_labels (bottle_id, water_level, shape_status, labelled_at)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT(bottle_id) DO UPDATE SET
+        water_level = excluded.water_level,
+        shape_status = excluded.shape_status,
+        labelled_at = excluded.labelled_at
+    """
+
+    CREATE_SERIAL_COUNTER_QUERY = "INSERT OR IGNORE INTO serial_counters (station_id, next_serial) VALUES (%s, 1)"
+    LEASE_SERIALS_QUERY = """
+    UPDATE serial_counters SET next_serial = next_serial + %s WHERE station_id = %s
+    RETURNING next_serial
+    """
+    ADVANCE_SERIAL_COUNTER_QUERY = """
+    UPDATE serial_counters SET next_serial = MAX(next_serial, %s) WHERE station_id = %s
+    """
+
+    def __init__(self, write_behind=DB_WRITE_BEHIND, path=SQLITE_PATH, pool_size=None):
+        self.path = str(path)
+        self._thread_connections = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        super().__init__(write_behind=write_behind, pool_size=pool_size or 1)
+
+    def connect(self):
+        try:
+            with self._checkout() as connection:
+                create_sqlite_schema(connection)
+            print(f"SQLite database ready at {self.path}")
+        except sqlite3.Error as e:
+            print(f"Error opening SQLite database: {e}")
+
+    def maintain_storage(self, convert=False):
+        """Apply retention; SQLite has no partitions, so delete in indexed chunks"""
+        if DB_RETENTION_DAYS is None:
+            return self.prune_rollups()
+        cutoff = date.today() - timedelta(days=DB_RETENTION_DAYS)
+        deleted = 0
+        try:
+            with self._checkout() as connection:
+                while True:
+                    cursor = connection.execute(
+                        "DELETE FROM bottles WHERE id IN "
+                        "(SELECT id FROM bottles WHERE detection_date < ? LIMIT 10000)", (cutoff,))
+                    connection.commit()
+                    if cursor.rowcount <= 0:
+                        break
+                    deleted += cursor.rowcount
+            print(f"Deleted {deleted} bottles detected before {cutoff}")
+        except sqlite3.Error as e:
+            print(f"Error applying retention: {e}")
+            return False
+        return self.prune_rollups()
+
+    def _open_connection(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @contextmanager
+    def _checkout(self):
+        """Each thread keeps its own connection for its lifetime"""
+        connection = getattr(self._thread_connections, 'connection', None)
+        if connection is None:
+            connection = self._open_connection()
+            self._thread_connections.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+            with self._stats_lock:
+                self.pool_stats['checkouts'] += 1
+        yield connection
+
+    def _cursor(self, connection, dictionary=False):
+        return SQLiteCursor(connection.cursor(), dictionary)
+
+    def _prepared_cursor(self, connection, dictionary=False):
+        # sqlite3 caches compiled statements per connection
+        return self._cursor(connection, dictionary)
+
+    def _lease_serials(self, cursor, station_id, size):
+        cursor.execute(self.LEASE_SERIALS_QUERY, (size, station_id))
+        rows = cursor.fetchall()
+        return rows[0][0] if rows else None
+
+    def _streaming_cursor(self, connection):
+        # sqlite3 cursors step through the result lazily
+        return self._cursor(connection, dictionary=True)
+
+    def _close_stream(self, connection, cursor):
+        cursor.close()
+
+    def get_pool_metrics(self):
+        """None: there is no pool, every thread keeps its own connection"""
+        return None
+
+    def close(self):
+        self._close_serial_allocator()
+        self.stop_writer()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._thread_connections = threading.local()
+        print("Database connection closed")
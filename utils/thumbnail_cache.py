@@ -0,0 +1,265 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from config import (THUMBNAIL_SIZE, THUMBNAIL_WORKERS, THUMBNAIL_CACHE_BYTES, THUMBNAIL_CACHE_DIR,
+                    THUMBNAIL_DISK_CACHE_BYTES)
+
+# Decode flags by scale factor. libjpeg scales while decoding, which is far
+# cheaper than decoding the full image and resizing it.
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+    (1, cv2.IMREAD_COLOR)
+]
+
+
+def decode_thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    """RGB array of an encoded image with its longest side at most size.
+
+    Decodes at the smallest reduced scale that still covers size. Returns
+    None if the bytes are not a readable image.
+    """
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_COLOR_8)
+    if image is None:
+        return None
+
+    # The 1/8 decode tells us the full size; pick the coarsest scale that
+    # keeps the thumbnail sharp
+    longest = max(image.shape[:2]) * 8
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if longest // factor >= size or factor == 1:
+            break
+    if factor != 8:
+        image = cv2.imdecode(buffer, flag)
+        if image is None:
+            return None
+
+    scale = size / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class ThumbnailCache:
+    """Decoded thumbnails in memory, backed by small JPEGs on disk.
+
+    The memory cache is an LRU bounded by bytes of decoded pixels; the disk
+    cache keeps encoded thumbnails across restarts so the full images only
+    have to be read once. Keys must be safe file names, e.g. image digests.
+    """
+
+    def __init__(self, max_bytes=THUMBNAIL_CACHE_BYTES, cache_dir=THUMBNAIL_CACHE_DIR,
+                 size=THUMBNAIL_SIZE, max_disk_bytes=THUMBNAIL_DISK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = str(cache_dir)
+        self.size = size
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.bytes = 0
+        self._thumbnails = OrderedDict()
+        self._missing = set()       # keys without a readable image, not retried
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'decoded': 0, 'missing': 0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}_{self.size}.jpg")
+
+    def get(self, key):
+        """Thumbnail from memory, or None. Never touches the disk"""
+        with self._lock:
+            thumbnail = self._thumbnails.get(key)
+            if thumbnail is not None:
+                self._thumbnails.move_to_end(key)
+                self.stats['hits'] += 1
+            return thumbnail
+
+    def is_missing(self, key):
+        with self._lock:
+            return key in self._missing
+
+    def put(self, key, thumbnail):
+        with self._lock:
+            if key in self._thumbnails:
+                self.bytes -= self._thumbnails.pop(key).nbytes
+            self._thumbnails[key] = thumbnail
+            self.bytes += thumbnail.nbytes
+            while self.bytes > self.max_bytes and len(self._thumbnails) > 1:
+                _, evicted = self._thumbnails.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def load(self, key, fetch):
+        """Thumbnail for key from memory, disk, or by decoding fetch()'s bytes.
+
+        fetch returns the full encoded image (or None) and is only called on
+        a miss in both caches. Slow; call from a worker thread.
+        """
+        thumbnail = self.get(key)
+        if thumbnail is not None:
+            return thumbnail
+
+        path = self._path(key)
+        thumbnail = self._read(path)
+        if thumbnail is not None:
+            self.stats['disk_hits'] += 1
+        else:
+            image_bytes = fetch()
+            thumbnail = decode_thumbnail(image_bytes, self.size) if image_bytes else None
+            if thumbnail is None:
+                with self._lock:
+                    self._missing.add(key)
+                    self.stats['missing'] += 1
+                return None
+            self.stats['decoded'] += 1
+            self._write(path, thumbnail)
+
+        self.put(key, thumbnail)
+        return thumbnail
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        try:
+            # Keep the disk cache LRU-ish for prune_disk()
+            os.utime(path)
+        except OSError:
+            pass
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    def _write(self, path, thumbnail):
+        ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(thumbnail, cv2.COLOR_RGB2BGR),
+                                   [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            return
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error caching thumbnail: {e}")
+
+    def prune_disk(self):
+        """Delete the least recently used thumbnails beyond max_disk_bytes"""
+        files = []
+        total = 0
+        for directory in os.scandir(self.cache_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics.update({'thumbnails': len(self._thumbnails), 'bytes': self.bytes,
+                            'max_bytes': self.max_bytes})
+        return metrics
+
+
+class ThumbnailLoader:
+    """Loads thumbnails on worker threads, most recently requested first.
+
+    Views request thumbnails as they paint, so the newest requests are the
+    ones on screen. Beyond max_pending the oldest requests (rows scrolled
+    past) are dropped; the view asks again if they come back into sight.
+    callback(key, thumbnail) is called on the worker thread.
+    """
+
+    def __init__(self, cache, callback, workers=THUMBNAIL_WORKERS, max_pending=256):
+        self.cache = cache
+        self.callback = callback
+        self.max_pending = max_pending
+        self.closed = False
+        self.dropped = 0
+        self._pending = OrderedDict()   # key -> fetch, newest last
+        self._in_flight = set()
+        self._condition = threading.Condition()
+
+        self._threads = []
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name=f"thumbnail-{number}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        # Trimming the disk cache walks it once; keep that off the GUI thread too
+        threading.Thread(target=cache.prune_disk, name="thumbnail-prune", daemon=True).start()
+
+    def request(self, key, fetch):
+        with self._condition:
+            if self.closed or key in self._in_flight:
+                return
+            if key in self._pending:
+                self._pending.move_to_end(key)
+                return
+            self._pending[key] = fetch
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._condition.notify()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self.closed:
+                    self._condition.wait()
+                if self.closed:
+                    return
+                key, fetch = self._pending.popitem(last=True)
+                self._in_flight.add(key)
+
+            try:
+                thumbnail = self.cache.load(key, fetch)
+            except Exception as e:
+                print(f"Error loading thumbnail: {e}")
+                thumbnail = None
+            finally:
+                with self._condition:
+                    self._in_flight.discard(key)
+            self.callback(key, thumbnail)
+
+    def get_metrics(self):
+        with self._condition:
+            metrics = {'pending': len(self._pending), 'dropped': self.dropped}
+        metrics.update(self.cache.get_metrics())
+        return metrics
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._pending.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
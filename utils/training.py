@@ -0,0 +1,370 @@
+import json
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+from matplotlib.figure import Figure
+from utils.dataset_index import DatasetIndex
+from config import (BASE_DIR, MODELS_DIR, WATER_LEVEL_LABELS, SHAPE_LABELS, EPOCHS, LEARNING_RATE,
+                    TRAINING_CORES, TRAINING_LOG_PATH, TRAINING_MAX_MINUTES, CHECKPOINT_DIR)
+
+# Models trained from <train dir>/<name>/<class>/ images. Add an entry here
+# to train another classifier alongside the existing ones. label_column is
+# the bottles/sample_labels column holding the model's label, and
+# defect_labels the labels that make a bottle defective.
+TRAINING_JOBS = {
+    'water_level': {
+        'title': 'Water Level Model',
+        'labels': WATER_LEVEL_LABELS,
+        'label_column': 'water_level',
+        'defect_labels': ['low', 'overflow'],
+        'model_file': 'water_level_model.h5'
+    },
+    'shape': {
+        'title': 'Shape Model',
+        'labels': SHAPE_LABELS,
+        'label_column': 'shape_status',
+        'defect_labels': ['defective'],
+        'model_file': 'shape_model.h5'
+    }
+}
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def allot_cores(names, allotments=TRAINING_CORES, cores=None):
+    """{job name: [cpu ids]}, giving every job its own cores.
+
+    Jobs listed in allotments get that many cores; the others split the
+    rest evenly. With more jobs than cores, jobs share cores round robin.
+    """
+    cores = cores or available_cores()
+    result = {}
+    position = 0
+    for name in names:
+        if name in allotments:
+            result[name] = cores[position:position + allotments[name]]
+            position += allotments[name]
+
+    rest = [name for name in names if name not in result]
+    remaining = cores[position:]
+    for index, name in enumerate(rest):
+        share, extra = divmod(len(remaining), len(rest))
+        start = index * share + min(index, extra)
+        result[name] = remaining[start:start + share + (1 if index < extra else 0)]
+
+    for index, name in enumerate(names):
+        if not result[name]:
+            result[name] = [cores[index % len(cores)]]
+    return result
+
+
+def thread_environment(cores):
+    """Environment variables sizing a process's thread pools to its cores"""
+    threads = str(len(cores))
+    environment = {variable: threads for variable in
+                   ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')}
+    environment['TF_NUM_INTEROP_THREADS'] = '2'
+    return environment
+
+
+@contextmanager
+def _environment(variables):
+    """Set environment variables for the duration of the block"""
+    saved = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _limit_threads(cores):
+    """Pin this process to cores and size the thread pools of libraries not loaded yet.
+
+    Thread pools are sized when a library is loaded, and a spawned worker
+    has numpy loaded before its target runs (unpickling the target imports
+    its module). run_worker_processes therefore also starts each worker
+    with thread_environment() in its environment; this covers TensorFlow.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    os.environ.update(thread_environment(cores))
+
+
+def _import_tensorflow(cores):
+    """TensorFlow for a worker process running on cores"""
+    _limit_threads(cores)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+    return tf
+
+
+def _train_worker(worker, name, job, cores, data_dir, models_dir, validation_split, epochs, checkpoint_dir,
+                  resume, deadline, messages):
+    """Fit one model in a child process, reporting progress on messages"""
+    started = time.monotonic()
+    try:
+        tf = _import_tensorflow(cores)
+        from utils.model_loader import build_classifier, create_data_generators
+        from utils.dataset_index import task_split
+        from utils.checkpoints import TrainingCheckpoint
+
+        class ProgressCallback(tf.keras.callbacks.Callback):
+            def on_epoch_end(self, epoch, logs=None):
+                messages.put({'event': 'epoch', 'job': name, 'epoch': epoch + 1, 'epochs': epochs,
+                              'metrics': {key: float(value) for key, value in (logs or {}).items()},
+                              'elapsed': time.monotonic() - started})
+
+        # Prefer the deduplicated, group-aware split when one has been built;
+        # otherwise split the manifest (which leaves out corrupt images)
+        split, _ = task_split(DatasetIndex(data_dir), name, job['labels'], validation_split)
+        deduplicated = split['saved']
+        train_generator, val_generator = create_data_generators(
+            os.path.join(data_dir, name), validation_split, classes=job['labels'], split=split)
+
+        checkpoint = TrainingCheckpoint(os.path.join(checkpoint_dir, name), deadline=deadline)
+        if resume and checkpoint.can_resume():
+            model = tf.keras.models.load_model(checkpoint.last_path)
+        else:
+            checkpoint.reset()
+            model = build_classifier(len(job['labels']), LEARNING_RATE)
+        initial_epoch = checkpoint.state['epoch']
+        messages.put({'event': 'started', 'job': name, 'cores': cores, 'deduplicated': deduplicated,
+                      'train_samples': train_generator.samples, 'val_samples': val_generator.samples,
+                      'initial_epoch': initial_epoch})
+
+        if not checkpoint.finished(epochs):
+            model.fit(
+                train_generator,
+                steps_per_epoch=max(1, train_generator.samples // train_generator.batch_size),
+                validation_data=val_generator,
+                validation_steps=max(1, val_generator.samples // val_generator.batch_size),
+                initial_epoch=initial_epoch,
+                epochs=epochs,
+                callbacks=[checkpoint, ProgressCallback()],
+                verbose=0
+            )
+        checkpoint.restore_best(model)
+
+        # Save under a temporary name so a running detector never loads half a file
+        os.makedirs(models_dir, exist_ok=True)
+        path = os.path.join(models_dir, job['model_file'])
+        temp_path = path + '.tmp.h5'
+        model.save(temp_path)
+        os.replace(temp_path, path)
+
+        state = checkpoint.state
+        messages.put({'event': 'finished', 'job': name, 'path': path, 'history': state['history'],
+                      'epochs_run': state['epoch'], 'best_epoch': state['best_epoch'],
+                      'monitor': state['monitor'], 'best': state['best'],
+                      'stop_reason': state['stop_reason'] or 'completed',
+                      'elapsed': time.monotonic() - started})
+    except Exception as e:
+        messages.put({'event': 'failed', 'job': name, 'error': str(e), 'traceback': traceback.format_exc(),
+                      'elapsed': time.monotonic() - started})
+    messages.put({'event': 'done', 'worker': worker})
+
+
+def run_worker_processes(context, target, assignments, handle, cores=None):
+    """Run target(worker id, *args, messages) once per assignment, passing messages to handle.
+
+    With cores (one list of cpu ids per assignment) every worker is started
+    with thread pools sized to, and pinned to, its cores. Workers put a {'event': 'done', 'worker': id} message last; a worker
+    that dies without one is reported and given up on. Returns the ids of
+    those workers.
+    """
+    messages = context.Queue()
+    processes = {}
+    for worker, args in enumerate(assignments):
+        process = context.Process(target=target, args=(worker,) + tuple(args) + (messages,),
+                                  name=f"worker-{worker}")
+        # A spawned child copies the environment when it starts, before it
+        # imports anything
+        with _environment(thread_environment(cores[worker]) if cores else {}):
+            process.start()
+        if cores and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(process.pid, cores[worker])
+        processes[worker] = process
+
+    pending = set(processes)
+    exited = set()
+    lost = []
+    try:
+        while pending:
+            try:
+                message = messages.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that died without reporting (killed, out of memory).
+                # Give its last message one more poll to arrive first.
+                for worker in list(pending):
+                    if processes[worker].is_alive():
+                        continue
+                    if worker in exited:
+                        print(f"Worker {worker} exited with code {processes[worker].exitcode}")
+                        pending.discard(worker)
+                        lost.append(worker)
+                    exited.add(worker)
+                continue
+            if message['event'] == 'done':
+                pending.discard(message['worker'])
+            else:
+                handle(message)
+    except KeyboardInterrupt:
+        print("Interrupted, stopping workers")
+        for process in processes.values():
+            process.terminate()
+        raise
+    finally:
+        for process in processes.values():
+            process.join()
+    return lost
+
+
+class TrainingLog:
+    """JSON lines log of training events, one object per line"""
+
+    def __init__(self, path=TRAINING_LOG_PATH):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def write(self, message):
+        record = {'time': datetime.now().isoformat(timespec='seconds')}
+        record.update(message)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def report_progress(message):
+    """One console line per training event"""
+    name = message['job']
+    event = message['event']
+    if event == 'started':
+        source = "deduplicated split" if message.get('deduplicated') else "manifest split"
+        resumed = f", resuming after epoch {message['initial_epoch']}" if message.get('initial_epoch') else ""
+        print(f"[{name}] training on {message['train_samples']} images "
+              f"({message['val_samples']} validation, {source}), cores {message['cores']}{resumed}")
+    elif event == 'epoch':
+        metrics = ' '.join(f"{key}={value:.4f}" for key, value in message['metrics'].items())
+        print(f"[{name}] epoch {message['epoch']}/{message['epochs']} {metrics} ({message['elapsed']:.0f}s)")
+    elif event == 'finished':
+        reasons = {'completed': 'all epochs run', 'early_stopping': 'stopped early',
+                   'time_budget': 'stopped at the time budget'}
+        best = f", {message['monitor']}={message['best']:.4f}" if message.get('best') is not None else ""
+        print(f"[{name}] {reasons.get(message['stop_reason'], message['stop_reason'])} after "
+              f"{message['epochs_run']} epochs; saved epoch {message['best_epoch']}{best} to "
+              f"{message['path']} ({message['elapsed']:.0f}s)")
+    elif event == 'failed':
+        print(f"[{name}] training failed: {message['error']}")
+        if message.get('traceback'):
+            print(message['traceback'])
+
+
+def save_training_plot(history, title, path):
+    """Accuracy and loss curves as a PNG; needs no display"""
+    figure = Figure(figsize=(12, 4))
+    ax1, ax2 = figure.subplots(1, 2)
+
+    # Plot accuracy
+    ax1.plot(history['accuracy'], label='Training Accuracy')
+    ax1.plot(history['val_accuracy'], label='Validation Accuracy')
+    ax1.set_title(f'{title} - Accuracy')
+    ax1.set_xlabel('Epoch')
+    ax1.set_ylabel('Accuracy')
+    ax1.legend()
+    ax1.grid(True)
+
+    # Plot loss
+    ax2.plot(history['loss'], label='Training Loss')
+    ax2.plot(history['val_loss'], label='Validation Loss')
+    ax2.set_title(f'{title} - Loss')
+    ax2.set_xlabel('Epoch')
+    ax2.set_ylabel('Loss')
+    ax2.legend()
+    ax2.grid(True)
+
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def train_in_parallel(train_data_dir, jobs=None, models_dir=MODELS_DIR, validation_split=0.2, epochs=EPOCHS,
+                      allotments=TRAINING_CORES, log_path=TRAINING_LOG_PATH, plot_dir=BASE_DIR,
+                      checkpoint_dir=CHECKPOINT_DIR, resume=False, max_minutes=TRAINING_MAX_MINUTES):
+    """Train several models at once, each in its own process on its own cores.
+
+    Model fits are independent, so running them side by side instead of one
+    after the other cuts wall-clock time to roughly that of the slowest.
+    Progress goes to the console and to the JSON lines log at log_path;
+    training plots are saved to plot_dir.
+
+    Each job stops early once its validation metric stops improving, and
+    every epoch is checkpointed under checkpoint_dir; with resume, jobs
+    continue from their last checkpoint. With max_minutes, jobs stop before
+    an epoch that would overrun the budget. Either way the model file gets
+    the weights of the best epoch.
+
+    Returns {job name: history dict} for the jobs that succeeded.
+    """
+    names = list(jobs or TRAINING_JOBS)
+    cores = allot_cores(names, allotments)
+    log = TrainingLog(log_path)
+
+    # Bring the dataset manifest up to date once, here, rather than have
+    # every job walk the image folders
+    index = DatasetIndex(train_data_dir)
+    inspected, removed = index.update()
+    corrupt = index.corrupt()
+    print(f"Dataset manifest: {len(index.entries)} images ({inspected} new or changed, {removed} removed)")
+    for path, error in corrupt:
+        print(f"Skipping corrupt image {path}: {error}")
+    log.write({'event': 'manifest', 'job': None, 'images': len(index.entries), 'corrupt': len(corrupt)})
+
+    started = time.monotonic()
+    deadline = time.time() + max_minutes * 60 if max_minutes else None
+    for name in names:
+        log.write({'event': 'launched', 'job': name, 'cores': cores[name], 'epochs': epochs,
+                   'resume': resume, 'max_minutes': max_minutes})
+
+    histories = {}
+
+    def handle(message):
+        report_progress(message)
+        log.write({key: value for key, value in message.items() if key != 'history'})
+        if message['event'] == 'finished':
+            histories[message['job']] = message['history']
+
+    # Spawn, not fork: TensorFlow is not fork-safe and each child must set
+    # up its thread pools before importing it
+    context = multiprocessing.get_context('spawn')
+    try:
+        lost = run_worker_processes(context, _train_worker,
+                                    [(name, TRAINING_JOBS[name], cores[name], str(train_data_dir), str(models_dir),
+                                      validation_split, epochs, str(checkpoint_dir), resume, deadline)
+                                     for name in names], handle, cores=[cores[name] for name in names])
+    except KeyboardInterrupt:
+        print("Training interrupted (continue with --resume)")
+        raise
+    for worker in lost:
+        if names[worker] not in histories:
+            handle({'event': 'failed', 'job': names[worker], 'error': "process exited without reporting"})
+
+    elapsed = time.monotonic() - started
+    print(f"Trained {len(histories)} of {len(names)} models in {elapsed:.0f}s")
+    log.write({'event': 'completed', 'job': None, 'elapsed': elapsed, 'succeeded': sorted(histories)})
+
+    for name, history in histories.items():
+        title = TRAINING_JOBS[name]['title']
+        save_training_plot(history, title, os.path.join(str(plot_dir), f'{title.lower().replace(" ", "_")}_training.png'))
+    return histories